@@ -1,15 +1,25 @@
 from flask import Flask
 import os
+import tempfile
 from application.database import db, Admin
 from application.admin import mail
-from flask_migrate import Migrate
+from application.mail_delivery import DeliveryEngine
+from application.cache import page_cache
+from application.assets import assets, build_assets_command
+from application import schema
+from application.concurrency import engine_options
+from application.conditional import deploy_salt
+from application.profiling import profiler
+from application.metrics import metrics
+from application.export import static_export, export_site_command
+from application.compression import compression
+from application.templating import templates, compile_templates_command
+from application.uploads import uploads
 
 """
 App Configuration
 """
 
-migrate = Migrate(compare_type=True)
-
 def create_app(test_config=None):
 
     app = Flask(__name__)
@@ -20,8 +30,13 @@ def create_app(test_config=None):
         SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URL"),
         # MISC SETTINGS
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
-        # make sure all datetime values are displayed in UTC
-        SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"options": "-c timezone=utc"}},
+        # ms before a statement is stopped, so that a slow query fails before the request
+        # times out. Only for the web processes: 'flask' commands (flask db upgrade,
+        # render-posts, export-site, ...) and the workers run without a limit
+        DATABASE_STATEMENT_TIMEOUT=(
+            0 if os.environ.get("FLASK_RUN_FROM_CLI") == "true"
+            else int(os.getenv("DATABASE_STATEMENT_TIMEOUT", 20000))
+        ),
         SECRET_KEY=os.getenv("SECRET_KEY"),
         # ENV
         FLASK_ENV=os.getenv("FLASK_ENV"),
@@ -32,25 +47,149 @@ def create_app(test_config=None):
         MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
         MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
         MAIL_USE_TLS=False,
-        # ensure user doesn't upload more than 1MB of files
-        MAX_CONTENT_LENGTH=1024 * 1024
+        # SMTP DELIVERY SETTINGS (see mail_delivery.py), 0 means no per minute limit
+        MAIL_MAX_PER_CONNECTION=int(os.getenv("MAIL_MAX_PER_CONNECTION", 50)),
+        MAIL_MAX_PER_MINUTE=int(os.getenv("MAIL_MAX_PER_MINUTE", 0)),
+        MAIL_SEND_RETRIES=int(os.getenv("MAIL_SEND_RETRIES", 2)),
+        # MAIL QUEUE SETTINGS (see mail_queue.py)
+        MAIL_QUEUE_BATCH_SIZE=int(os.getenv("MAIL_QUEUE_BATCH_SIZE", 50)),
+        MAIL_QUEUE_POLL_INTERVAL=int(os.getenv("MAIL_QUEUE_POLL_INTERVAL", 5)),
+        # seconds before deliveries claimed by a worker that died can be claimed again
+        MAIL_QUEUE_LEASE=int(os.getenv("MAIL_QUEUE_LEASE", 600)),
+        MAIL_QUEUE_MAX_ATTEMPTS=int(os.getenv("MAIL_QUEUE_MAX_ATTEMPTS", 5)),
+        # seconds before the first retry of a failed email, doubled for every retry after that
+        MAIL_QUEUE_BACKOFF=int(os.getenv("MAIL_QUEUE_BACKOFF", 30)),
+        # how the body images of posts are eager loaded: selectin, joined or subquery
+        POST_IMAGES_LOADING=os.getenv("POST_IMAGES_LOADING", "selectin"),
+        # number of posts on each page of the index/category pages
+        POSTS_PER_PAGE=int(os.getenv("POSTS_PER_PAGE", 10)),
+        # FEED SETTINGS (see feeds.py), the number of posts in each feed (RSS_ITEMS is its old name)
+        FEED_ITEMS=int(os.getenv("FEED_ITEMS", os.getenv("RSS_ITEMS", 20))),
+        # whole posts in the feeds' entries instead of their samples
+        FEED_FULL_CONTENT=os.getenv("FEED_FULL_CONTENT", "false").lower() == "true",
+        FEED_TITLE=os.getenv("FEED_TITLE", "Kelly Foulk"),
+        FEED_DESCRIPTION=os.getenv("FEED_DESCRIPTION", "Code and adventure. Mainly code."),
+        FEED_AUTHOR=os.getenv("FEED_AUTHOR", "Kelly Foulk"),
+        # e.g. https://example.com, the start of the feeds' links. It has to be set outside
+        # debug and testing, the request's host is never used (see feeds.py)
+        SITE_URL=os.getenv("SITE_URL"),
+        # IMAGE SETTINGS (see images.py)
+        IMAGE_VARIANT_WIDTHS=[int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "480,960,1600").split(",")],
+        IMAGE_VARIANT_FORMATS=os.getenv("IMAGE_VARIANT_FORMATS", "avif,webp").split(","),
+        IMAGE_QUALITY=int(os.getenv("IMAGE_QUALITY", 80)),
+        # the 'sizes' attribute of responsive images, posts are at most 80% of the page wide
+        IMAGE_SIZES=os.getenv("IMAGE_SIZES", "80vw"),
+        # IMAGE WORKER SETTINGS (see image_queue.py), 0 processes means one per core
+        IMAGE_WORKER_PROCESSES=int(os.getenv("IMAGE_WORKER_PROCESSES", 0)),
+        IMAGE_QUEUE_BATCH_SIZE=int(os.getenv("IMAGE_QUEUE_BATCH_SIZE", 8)),
+        IMAGE_QUEUE_POLL_INTERVAL=int(os.getenv("IMAGE_QUEUE_POLL_INTERVAL", 5)),
+        # seconds before images claimed by a worker that died can be claimed again
+        IMAGE_QUEUE_LEASE=int(os.getenv("IMAGE_QUEUE_LEASE", 600)),
+        # CACHE SETTINGS
+        # rendered blog pages are cached in 'lru' (per worker, so an edit doesn't reach the other
+        # workers' copies until they time out), 'filesystem' (shared by the workers) or 'null'
+        PAGE_CACHE_TYPE=os.getenv("PAGE_CACHE_TYPE", "filesystem"),
+        PAGE_CACHE_MAX_ENTRIES=int(os.getenv("PAGE_CACHE_MAX_ENTRIES", 500)),
+        PAGE_CACHE_TIMEOUT=int(os.getenv("PAGE_CACHE_TIMEOUT", 3600)),
+        # changes the ETags of every page (and so the compressed copies kept under them) when
+        # a new version of the app is deployed, a fingerprint of its files if it's not set
+        ETAG_SALT=os.getenv("HEROKU_SLUG_COMMIT", ""),
+        PAGE_CACHE_DIR=os.getenv(
+            "PAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "personal_website_page_cache")
+        ),
+        # seconds browsers cache the fingerprinted CSS/JS bundles for (see assets.py)
+        ASSETS_MAX_AGE=int(os.getenv("ASSETS_MAX_AGE", 365 * 24 * 60 * 60)),
+        # check that the database is at the newest migration on the first request
+        SCHEMA_CHECK=os.getenv("SCHEMA_CHECK", "true").lower() == "true",
+        # PROFILING SETTINGS (see profiling.py), off unless PROFILING is true
+        PROFILING=os.getenv("PROFILING", "false").lower() == "true",
+        # requests slower than this (ms) are logged along with their queries
+        PROFILING_SLOW_MS=int(os.getenv("PROFILING_SLOW_MS", 500)),
+        # endpoints (e.g. blog.view_post) run under the sampling profiler
+        PROFILING_SAMPLE_ENDPOINTS=[e for e in os.getenv("PROFILING_SAMPLE_ENDPOINTS", "").split(",") if e],
+        PROFILING_SAMPLE_INTERVAL_MS=float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", 5)),
+        PROFILING_SAMPLE_DIR=os.getenv(
+            "PROFILING_SAMPLE_DIR", os.path.join(tempfile.gettempdir(), "personal_website_profiles")
+        ),
+        # METRICS SETTINGS (see metrics.py), /metrics needs 'Bearer <METRICS_TOKEN>' and
+        # without a token it's only served in debug or testing
+        METRICS=os.getenv("METRICS", "true").lower() == "true",
+        METRICS_TOKEN=os.getenv("METRICS_TOKEN"),
+        # STATIC EXPORT SETTINGS (see export.py), 'flask export-site' renders the blog to STATIC_EXPORT_DIR
+        STATIC_EXPORT_DIR=os.getenv(
+            "STATIC_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "personal_website_export")
+        ),
+        # answer GETs for exported pages from their files
+        STATIC_EXPORT_SERVE=os.getenv("STATIC_EXPORT_SERVE", "false").lower() == "true",
+        # COMPRESSION SETTINGS (see compression.py), responses smaller than COMPRESSION_MIN_SIZE bytes aren't compressed
+        COMPRESSION=os.getenv("COMPRESSION", "true").lower() == "true",
+        COMPRESSION_MIN_SIZE=int(os.getenv("COMPRESSION_MIN_SIZE", 500)),
+        COMPRESSION_GZIP_LEVEL=int(os.getenv("COMPRESSION_GZIP_LEVEL", 6)),
+        COMPRESSION_BROTLI_QUALITY=int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5)),
+        # TEMPLATE SETTINGS (see templating.py), compiled templates are kept in TEMPLATE_CACHE_DIR
+        TEMPLATE_BYTECODE_CACHE=os.getenv("TEMPLATE_BYTECODE_CACHE", "true").lower() == "true",
+        TEMPLATE_CACHE_DIR=os.getenv(
+            "TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "personal_website_templates")
+        ),
+        # load every template in create_app instead of on first use
+        TEMPLATE_PRECOMPILE=os.getenv("TEMPLATE_PRECOMPILE", "false").lower() == "true",
+        # UPLOAD SETTINGS (see uploads.py), uploads are streamed to temporary files in
+        # UPLOAD_TMP_DIR (the system's by default) and each file is limited separately
+        UPLOAD_MAX_FILE_SIZE=int(os.getenv("UPLOAD_MAX_FILE_SIZE", 16 * 1024 * 1024)),
+        # the whole request, in the admin's create and edit views
+        UPLOAD_MAX_REQUEST_SIZE=int(os.getenv("UPLOAD_MAX_REQUEST_SIZE", 64 * 1024 * 1024)),
+        # every other request, e.g. /subscribe
+        MAX_CONTENT_LENGTH=int(os.getenv("MAX_CONTENT_LENGTH", 1024 * 1024)),
+        # the form fields that aren't files
+        UPLOAD_MAX_FORM_MEMORY=int(os.getenv("UPLOAD_MAX_FORM_MEMORY", 4 * 1024 * 1024)),
+        UPLOAD_TMP_DIR=os.getenv("UPLOAD_TMP_DIR"),
     )
 
     if test_config is not None:
         app.config.from_mapping(test_config)
 
+    if not app.config["ETAG_SALT"]:
+        app.config["ETAG_SALT"] = deploy_salt(app)
+
+    # pool sized for the gunicorn profile, UTC timestamps (see concurrency.py)
+    if "SQLALCHEMY_ENGINE_OPTIONS" not in app.config:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+            app.config["SQLALCHEMY_DATABASE_URI"],
+            statement_timeout=app.config["DATABASE_STATEMENT_TIMEOUT"],
+        )
+
     db.init_app(app)
+    uploads.init_app(app)
     mail.init_app(app)
-    migrate.init_app(app, db)
-
-    with app.app_context():
-        db.create_all()
+    page_cache.init_app(app)
+    assets.init_app(app)
+    schema.init_app(app)
+    profiler.init_app(app)
+    if app.config["PROFILING"]:
+        # all mail goes through the delivery engine (see mail_delivery.py)
+        profiler.instrument(DeliveryEngine, "send")
+    metrics.init_app(app)
+    static_export.init_app(app)
+    compression.init_app(app)
+    # the schema is managed by Flask-Migrate alone, which is only needed by the
+    # 'flask' command (flask db upgrade, ...) and is slow to import
+    if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        from flask_migrate import Migrate
+        Migrate(app, db, compare_type=True)
 
     # Register Blueprints
 
-    from . import admin, blog
+    from . import admin, blog, images, image_queue, rendering
     app.register_blueprint(admin.bp)
     app.register_blueprint(blog.bp)
     app.add_url_rule('/', endpoint='index')
+    app.add_template_global(images.picture)
+    # after the blueprints and template globals, precompiling needs the whole environment
+    templates.init_app(app)
+    app.cli.add_command(image_queue.process_images_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(rendering.render_posts_command)
+    app.cli.add_command(export_site_command)
+    app.cli.add_command(compile_templates_command)
 
     return app
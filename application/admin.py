@@ -1,6 +1,7 @@
 """Blueprint for the admin side of the app"""
 
 from flask import (
+    current_app,
     flash,
     render_template,
     request,
@@ -13,8 +14,15 @@ from flask import (
 )
 from flask_mail import Mail, Message
 import os
-from application.database import db, Admin, Posts, Subscribers, BodyImages
+from application.database import db, Admin, Posts, BodyImages, ImageVariants, unique_slug
+from application.cache import page_cache, post_tag, listing_tag
+from application.mail_delivery import delivery_engine
+from application.mail_queue import enqueue_newsletter, newsletter_html, FORMAT_ERRORS
+from application.profiling import profiler, BUCKETS_MS
+from application.rendering import render_post
+from application.uploads import allow_uploads, save_upload
 from werkzeug.security import check_password_hash
+import datetime
 import functools
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -83,8 +91,24 @@ def base_styles():
     return render_template("admin/base-styles.html")
 
 
+@bp.route("/profiling")
+@login_required
+def profiling():
+    """
+    Shows this worker's request duration histograms and SQL/template times
+    for each endpoint (see profiling.py).
+    """
+    return render_template(
+        "admin/profiling.html",
+        enabled=profiler.enabled,
+        routes=profiler.stats(),
+        buckets=BUCKETS_MS,
+    )
+
+
 @bp.route("/create", methods=["GET", "POST"])
 @login_required
+@allow_uploads
 def create():
     """
     Get: renders the screen where the user can create a new post.
@@ -108,26 +132,35 @@ def create():
             img_folder = os.path.join("application", "static", "post_imgs", post_id)
             if not os.path.exists(img_folder):
                 os.makedirs(img_folder)
-            header.save(os.path.join(img_folder, header.filename))
+            save_upload(header, os.path.join(img_folder, header.filename))
             # 'header_path' assumes we're in the 'templates' directory
             header_path = os.path.join("static", "post_imgs", post_id, header.filename)
         else:
             header_path = None
         # h1, sample, header_path, youtube_vid, body, category
         data = Posts(h1, sample, header_path, youtube_vid, body, category)
+        data.slug = unique_slug(h1)
         db.session.add(data)
+        # flush so the body images can reference the post's real id
+        db.session.flush()
         for img in request.files.getlist("body_imgs"):
             if img.filename != "":
                 # image folder and save location need to be usable from top level of directory
                 img_folder = os.path.join("application", "static", "post_imgs", post_id)
                 if not os.path.exists(img_folder):
                     os.makedirs(img_folder)
-                img.save(os.path.join(img_folder, img.filename))
+                save_upload(img, os.path.join(img_folder, img.filename))
                 # img_path assumes we're in the 'templates' directory
                 img_path = os.path.join("static", "post_imgs", post_id, img.filename)
-                img_data = BodyImages(post_id, img_path)
+                # the image worker makes its variants, the original is shown until then
+                img_data = BodyImages(data.id, img_path)
                 db.session.add(img_data)
+        db.session.flush()
+        # the images were added by post id, not to data.images
+        db.session.expire(data, ["images"])
+        render_post(data)
         db.session.commit()
+        page_cache.invalidate(listing_tag("index"), listing_tag(category), listing_tag("rss"))
         flash("Success, your post is live.")
         return redirect(url_for("admin.admin"))
 
@@ -137,6 +170,7 @@ def create():
 
 @bp.route("/edit/<id>", methods=["GET", "POST"])
 @login_required
+@allow_uploads
 def edit(id):
     post = Posts.query.filter_by(id=id).first()
     if request.method == "GET":
@@ -146,16 +180,22 @@ def edit(id):
         post.sample = request.form["sample"]
         post.youtube_vid = request.form["youtube_vid"]
         post.body = request.form["body"]
+        post.updated = datetime.datetime.now(datetime.timezone.utc)
         header = request.files["header"]
         if header.filename != "":
             # image folder and save location need to be usable from top level of directory
             img_folder = os.path.join("application", "static", "post_imgs", id)
             if not os.path.exists(img_folder):
                 os.makedirs(img_folder)
-            header.save(os.path.join(img_folder, header.filename))
+            save_upload(header, os.path.join(img_folder, header.filename))
             # 'header_path' assumes we're in the 'templates' directory
             post.header_path = os.path.join("static", "post_imgs", id, header.filename)
+            ImageVariants.query.filter_by(post_id=post.id, image_id=None).delete()
+            post.header_status = "pending"
+            db.session.expire(post, ["header_variants"])
+        render_post(post)
         db.session.commit()
+        page_cache.invalidate(post_tag(post.id))
         flash("Success, the post has been updated.")
         return redirect(url_for("admin.admin"))
 
@@ -165,21 +205,22 @@ def edit(id):
 def send_mail():
     """
     The user can send out email updates - as well as see a rough preview of what the
-    email html may look like and send out a test email.
+    email html may look like and send out a test email. Email updates are queued
+    and sent by the mail worker.
     """
     if request.method == "POST":
-        subs = Subscribers.query.filter_by(still_subscribed=True).all()
         subject = request.form["subject"]
         body_text = request.form["body_text"]
         body_html = request.form["body_html"]
-        for sub in subs:
-            msg = Message(
-                subject, sender=os.getenv("MAIL_USERNAME"), recipients=[sub.email]
-            )
-            msg.body = f"Hello {sub.first},\n{body_text}"
-            msg.html = Markup(body_html).format(name=sub.first)
-            mail.send(msg)
-        flash("Success, the mail has been sent.")
+        # the worker fills it in for every subscriber, so it has to work before it's queued
+        try:
+            newsletter_html(body_html, "Kelly")
+        except FORMAT_ERRORS as e:
+            message = f"The html body can't be filled in ({type(e).__name__}: {e}), only {{name}} can be used."
+            return render_template("admin/send-mail.html", message=message), 400
+        # the mail worker does the actual sending
+        enqueue_newsletter(subject, body_text, body_html)
+        flash("Success, the mail is being sent.")
         return redirect(url_for("admin.admin"))
     else:
         return render_template("admin/send-mail.html")
@@ -201,5 +242,8 @@ def send_test():
     )
     msg.body = body_text
     msg.html = Markup(body_html).format(name="Kelly")
-    mail.send(msg)
+    result = delivery_engine().send_one(msg)
+    if not result.sent:
+        current_app.logger.warning("Failed to send the test email: %s", result.error)
+        abort(502)
     return "", 204
\ No newline at end of file
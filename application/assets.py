@@ -0,0 +1,170 @@
+"""Fingerprinted, minified and precompressed CSS/JS bundles
+
+Each bundle in BUNDLES is the minified concatenation of some files in the
+static folder, written to static/dist/ under a name with a hash of its content
+in it (site.3f2a9c1b7d.css) along with gzip and brotli copies. Since a bundle's
+URL changes whenever its content does, browsers are told to cache them forever.
+
+url_for('static', filename='site.css') gives the URL of the current build, and
+the static route serves dist/ files precompressed when the browser accepts it.
+The bundles are built when the app starts (or with 'flask build-assets') and
+files that are already built aren't written again.
+"""
+
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+import click
+import gzip
+import hashlib
+import json
+import os
+import rcssmin
+import rjsmin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bundle name: the static files it's made of, in the order they're loaded
+BUNDLES = {
+    "site.css": ["styles.css", "Normalize.css"],
+    "site.js": ["scripts.js"],
+}
+
+MINIFIERS = {".css": rcssmin.cssmin, ".js": rjsmin.jsmin}
+SEPARATORS = {".css": "\n", ".js": ";\n"}
+
+# encodings the bundles are precompressed with, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+OUTPUT_DIR = "dist"
+
+
+def _write(path, data):
+    """
+    Writes a file atomically, so another worker never serves half of it.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def compressed_copies(data):
+    """
+    The gzip and (if the brotli package is installed) brotli versions of data.
+    """
+    copies = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies["br"] = brotli.compress(data, quality=11)
+    return copies
+
+
+def build_bundle(static_folder, name, sources):
+    """
+    Minifies and concatenates the source files of a bundle and writes it (and
+    its compressed copies) to the output directory. Returns its fingerprinted
+    path relative to the static folder.
+    """
+    stem, ext = os.path.splitext(name)
+    contents = []
+    for source in sources:
+        with open(os.path.join(static_folder, source), encoding="utf-8") as f:
+            contents.append(MINIFIERS[ext](f.read()).strip())
+    data = SEPARATORS[ext].join(contents).encode("utf-8")
+
+    fingerprint = hashlib.sha1(data).hexdigest()[:10]
+    path = f"{OUTPUT_DIR}/{stem}.{fingerprint}{ext}"
+    disk_path = os.path.join(static_folder, path)
+    if not os.path.exists(disk_path):
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        for encoding, copy in compressed_copies(data).items():
+            _write(disk_path + ENCODINGS[encoding], copy)
+        # written last, it's what tells later builds that this one is complete
+        _write(disk_path, data)
+    return path
+
+
+def build_assets(static_folder, bundles=BUNDLES):
+    """
+    Builds every bundle and writes the manifest of their fingerprinted paths.
+    Returns the manifest.
+    """
+    manifest = {
+        name: build_bundle(static_folder, name, sources)
+        for name, sources in bundles.items()
+    }
+    _write(
+        os.path.join(static_folder, OUTPUT_DIR, "manifest.json"),
+        json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+    )
+    return manifest
+
+
+class Assets(object):
+    """
+    Builds the bundles when the app starts, makes url_for('static', ...) point
+    at their fingerprinted files and serves those precompressed, with headers
+    that let browsers cache them for ASSETS_MAX_AGE seconds without revalidating.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ASSETS_MAX_AGE", 365 * 24 * 60 * 60)
+        app.extensions["assets"] = build_assets(app.static_folder)
+        app.url_defaults(self._fingerprint_url)
+        app.view_functions["static"] = self.send_static_file
+
+    @property
+    def manifest(self):
+        return current_app.extensions["assets"]
+
+    def _fingerprint_url(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = self.manifest[values["filename"]]
+
+    def send_static_file(self, filename):
+        """
+        The static route. The bundles in the manifest are sent precompressed
+        when the browser accepts it, everything else (including the manifest
+        itself, which isn't fingerprinted) is sent by Flask as usual.
+        """
+        if filename not in self.manifest.values():
+            return current_app.send_static_file(filename)
+
+        static_folder = current_app.static_folder
+        mimetype = "text/css" if filename.endswith(".css") else "application/javascript"
+        encoding = None
+        for name, suffix in ENCODINGS.items():
+            if request.accept_encodings[name] and os.path.exists(
+                os.path.join(static_folder, filename + suffix)
+            ):
+                encoding = name
+                filename += suffix
+                break
+
+        response = send_from_directory(static_folder, filename, mimetype=mimetype)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config["ASSETS_MAX_AGE"]
+        response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
+
+
+@click.command("build-assets")
+@with_appcontext
+def build_assets_command():
+    """
+    Builds the CSS/JS bundles, for deploys that build them ahead of time.
+    """
+    for name, path in build_assets(current_app.static_folder).items():
+        click.echo(f"{name} -> {path}")
@@ -1,16 +1,24 @@
 """Blueprint for the user-facing blog side of the app"""
 
 from flask import (
+    abort,
+    current_app,
+    redirect,
     render_template,
     request,
-    Markup,
+    url_for,
     Response,
     Blueprint
 )
-import os
-from application.database import db, Posts, Subscribers, BodyImages
-from application.admin import mail
-from flask_mail import Message
+from application.database import db, Posts, insert_subscriber, with_images, post_versions
+from sqlalchemy.orm import defer
+from application.mail_queue import enqueue_welcome
+from application.pagination import paginate_posts
+from application.cache import cached, tag_page, post_tag, listing_tag
+from application.conditional import conditional, make_etag
+from application.search import search_posts
+from application.rendering import post_html
+from application.feeds import feed, feed_versions, MIME_TYPES as FEED_TYPES
 
 bp = Blueprint('blog', __name__)
 
@@ -18,67 +26,184 @@ bp = Blueprint('blog', __name__)
 def base_styles():
     return render_template("base-styles.html")
 
+def page_args():
+    """
+    The pagination cursors passed in the query string.
+    """
+    return dict(
+        before=request.args.get("before", type=int),
+        after=request.args.get("after", type=int),
+    )
+
+
+def listing_validators(query):
+    """
+    ETag and Last-Modified of the page of posts the request is for, found
+    from the ids and updated dates of the posts alone.
+    """
+    cursors = page_args()
+    page = paginate_posts(post_versions(query), **cursors)
+    if not page.posts and any(cursor is not None for cursor in cursors.values()):
+        # a cursor past the end of the listing (a stale or made up link),
+        # there's nothing to show so send them to the first page instead
+        abort(redirect(url_for(request.endpoint, **request.view_args)))
+    versions = [tuple(post) for post in page.posts]
+    last_modified = max((post.updated for post in page.posts if post.updated), default=None)
+    return make_etag(request.full_path, versions, page.older, page.newer), last_modified
+
+
+def index_validators():
+    return listing_validators(Posts.query)
+
+
+def post_validators(slug):
+    post = post_versions(Posts.query.filter_by(slug=slug)).first()
+    if post is None:
+        return make_etag(request.full_path, None), None
+    return make_etag(request.full_path, tuple(post)), post.updated
+
+
+def category_validators(category):
+    return listing_validators(Posts.query.filter_by(category=category))
+
+
+def feed_validators(category=None):
+    posts = feed_versions(category)
+    versions = [tuple(post) for post in posts]
+    last_modified = max((post.updated for post in posts if post.updated), default=None)
+    return make_etag(request.full_path, versions), last_modified
+
+
 @bp.route("/", methods=["GET"])
+@cached
+@conditional(index_validators)
 def index():
     """
-    Renders the main home page of the blog - including a short display of all posts.
+    Renders the main home page of the blog - including a short display of one page of posts.
     """
-    posts = Posts.query.order_by(Posts.id.desc()).all()
-    for post in posts:
-        post.date = post.date.strftime("%B %d, %Y")
-        post.header = BodyImages.query.filter_by(post_id=post.id).first()
-    return render_template("blog/index.html", posts=posts)
+    page = paginate_posts(with_images(Posts.query), **page_args())
+    tag_page(*[post_tag(post.id) for post in page.posts])
+    if page.newer is None:
+        # only the newest page changes when a post is published
+        tag_page(listing_tag("index"))
+    return render_template("blog/index.html", posts=page.posts, page=page)
 
 
-@bp.route("/post/<id>", methods=["GET"])
-def view_post(id):
+def post_slug(id):
     """
-    Renders the post with a given id (the id of the post to render is passed with the route).
+    The slug of the post with a given id, or None if there isn't one. Slugs
+    never change, so once a post's slug is looked up it's kept in memory.
     """
-    current_post = Posts.query.filter_by(id=id).first()
+    slugs = current_app.extensions.setdefault("post_slugs", {})
+    if id not in slugs:
+        slug = db.session.query(Posts.slug).filter_by(id=id).scalar()
+        if slug is None:
+            return None
+        slugs[id] = slug
+    return slugs[id]
+
 
-    imgs = BodyImages.query.filter_by(post_id=id).all()
-    body = Markup(current_post.body).format(imgs=imgs)
-    current_post.date = current_post.date.strftime("%B %d, %Y")
-    return render_template("blog/post.html", post=current_post, body=body)
+@bp.route("/post/<int:id>", methods=["GET"])
+def redirect_post(id):
+    """
+    Permanently redirects the old /post/<id> urls to the post's slug url.
+    """
+    slug = post_slug(id)
+    if slug is None:
+        abort(404)
+    return redirect(url_for("blog.view_post", slug=slug), code=301)
+
+
+@bp.route("/post/<slug>", methods=["GET"])
+@cached
+@conditional(post_validators)
+def view_post(slug):
+    """
+    Renders the post with a given slug (the slug of the post to render is passed with the route).
+    """
+    # the body was rendered when the post was saved (see rendering.py)
+    current_post = Posts.query.options(defer(Posts.body)).filter_by(slug=slug).first()
+    if current_post is None:
+        abort(404)
+
+    header, body = post_html(current_post)
+    tag_page(post_tag(current_post.id))
+    return render_template("blog/post.html", post=current_post, header=header, body=body)
+
+
+@bp.route("/search", methods=["GET"])
+def search():
+    """
+    Renders one page of the posts that match the search query, best matches first.
+    """
+    query = request.args.get("q", "").strip()
+    page = search_posts(query, request.args.get("page", 1, type=int))
+    return render_template("blog/search.html", query=query, page=page)
 
 
 @bp.route("/<category>", methods=["GET"])
+@cached
+@conditional(category_validators)
 def post_layout(category):
     """
-    Renders a list of all the posts in a given category.
+    Renders a list of one page of the posts in a given category.
     """
-    posts = Posts.query.filter_by(category=category).order_by(Posts.id.desc()).all()
-    for post in posts:
-        post.date = post.date.strftime("%B %d, %Y")
-    return render_template("blog/post_layout.html", posts=posts, category=category)
+    page = paginate_posts(Posts.query.filter_by(category=category), **page_args())
+    tag_page(*[post_tag(post.id) for post in page.posts])
+    if page.newer is None:
+        tag_page(listing_tag(category))
+    return render_template(
+        "blog/post_layout.html", posts=page.posts, page=page, category=category
+    )
 
 
 @bp.route("/subscribe", methods=['POST'])
 def subscribe():
     """
-    Adds people to the subscribers database.
+    Adds people to the subscribers database and queues their welcome email.
     """
     first = request.form["first"]
     last = request.form["last"]
     email = request.form["email"]
-    if Subscribers.query.filter_by(email=email).first():
+    subscriber_id = insert_subscriber(first, last, email)
+    if subscriber_id is None:
+        db.session.rollback()
         return "Database Integrity Error", "200 Duplicate Email"
-    data = Subscribers(first, last, email)
-    db.session.add(data)
+    # the mail worker sends the welcome email so the response doesn't wait on SMTP
+    enqueue_welcome(subscriber_id)
     db.session.commit()
-
-    # send them a welcome email
-    subject = "Hi, it's Kelly"
-    msg = Message(subject, sender=os.getenv("MAIL_USERNAME"), recipients=[email])
-    msg.body = f"Hello {first},\nThanks for subscribing!\nBest,\n Kelly"
-    msg.html = render_template("/emails/welcome.html", name=first)
-    mail.send(msg)
     return "", 200
 
 
-@bp.route('/rss')
-def rss():
-    posts = Posts.query.all()
-    xml = render_template("blog/rss.xml", posts=posts)
-    return Response(xml, mimetype='text/xml')
+def feed_response(fmt, category):
+    """
+    A feed of the newest posts, of the whole blog or of one category (see feeds.py).
+    """
+    document, post_ids = feed(fmt, category)
+    # the blog's feeds are invalidated by the 'rss' listing, a category's with its listing
+    tag_page(listing_tag(category or "rss"), *[post_tag(post_id) for post_id in post_ids])
+    return Response(document, mimetype=FEED_TYPES[fmt])
+
+
+@bp.route("/rss", defaults={"category": None})
+@bp.route("/<category>/rss")
+@cached
+@conditional(feed_validators)
+def rss(category):
+    return feed_response("rss", category)
+
+
+@bp.route("/atom", defaults={"category": None})
+@bp.route("/<category>/atom")
+@cached
+@conditional(feed_validators)
+def atom(category):
+    return feed_response("atom", category)
+
+
+@bp.route("/feed.json", defaults={"category": None})
+@bp.route("/<category>/feed.json")
+@cached
+@conditional(feed_validators)
+def json_feed(category):
+    return feed_response("json", category)
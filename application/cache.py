@@ -0,0 +1,253 @@
+"""Rendered-page cache for the public blog routes"""
+
+from collections import OrderedDict
+from flask import current_app, g, request, make_response
+from cachelib import BaseCache, FileSystemCache, NullCache
+from application.conditional import cached_response_not_modified
+from application.metrics import PAGE_CACHE
+import functools
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+# set in the environ of requests whose responses are not to be cached (see export.py)
+NO_STORE = "page_cache.no_store"
+
+
+class LRUCache(BaseCache):
+    """
+    In-process cache that evicts the least recently used entry once it holds
+    more than max_entries, and drops entries older than their timeout.
+    """
+
+    def __init__(self, max_entries=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self._max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._cache[key]
+            except KeyError:
+                return None
+            if expires != 0 and expires <= time.time():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._cache[key] = (self._expires(timeout), value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class PageCache(object):
+    """
+    Caches whole responses of the blog views.
+
+    Every cached page is stored along with the tags of what it displays (the
+    listing it belongs to and the posts on it). Each tag has a token in the
+    cache, invalidating a tag replaces its token, and pages saved with an old
+    token are treated as misses. Tokens record when they were replaced, so a
+    page whose tags were invalidated while it was being rendered isn't saved.
+
+    PAGE_CACHE_TYPE picks the backend: 'lru' (per process), 'filesystem'
+    (shared by all the workers on a machine) or 'null' (no caching). The
+    tokens live in the backend, so with 'lru' an invalidation only reaches
+    the process it happened in: the other gunicorn workers keep serving
+    their copies until PAGE_CACHE_TIMEOUT. create_app uses 'filesystem'.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PAGE_CACHE_TYPE", "lru")
+        app.config.setdefault("PAGE_CACHE_MAX_ENTRIES", 500)
+        app.config.setdefault("PAGE_CACHE_TIMEOUT", 3600)
+        app.config.setdefault(
+            "PAGE_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "personal_website_page_cache"),
+        )
+        app.extensions["page_cache"] = self._make_backend(app.config)
+
+    @staticmethod
+    def _make_backend(config):
+        cache_type = config["PAGE_CACHE_TYPE"]
+        if cache_type == "lru":
+            return LRUCache(
+                config["PAGE_CACHE_MAX_ENTRIES"], config["PAGE_CACHE_TIMEOUT"]
+            )
+        if cache_type == "filesystem":
+            return FileSystemCache(
+                config["PAGE_CACHE_DIR"],
+                threshold=config["PAGE_CACHE_MAX_ENTRIES"],
+                default_timeout=config["PAGE_CACHE_TIMEOUT"],
+            )
+        if cache_type == "null":
+            return NullCache()
+        raise ValueError(f"Unknown PAGE_CACHE_TYPE: {cache_type}")
+
+    @property
+    def backend(self):
+        return current_app.extensions["page_cache"]
+
+    def _tag_tokens(self, tags):
+        tags = sorted(tags)
+        tokens = self.backend.get_many(*[f"tag:{tag}" for tag in tags])
+        return dict(zip(tags, tokens))
+
+    def get(self, key):
+        """
+        Returns the cached page for a key, or None if it's missing or one of
+        its tags has been invalidated since it was saved.
+        """
+        page = self.backend.get(f"page:{key}")
+        if page is None:
+            return None
+        if not self.is_current(page["tags"]):
+            return None
+        return page
+
+    def tokens(self, tags, since=None):
+        """
+        The current tokens of some tags, giving tags that have none a new one.
+        With 'since' (a time.time()), the tags that were invalidated after it
+        get None instead, which is never current.
+        """
+        tokens = self._tag_tokens(tags)
+        for tag, token in tokens.items():
+            if token is None:
+                tokens[tag] = new_token()
+                # tags never expire on their own, pages do
+                self.backend.set(f"tag:{tag}", tokens[tag], timeout=0)
+            elif since is not None and invalidated_at(token) >= since:
+                tokens[tag] = None
+        return tokens
+
+    def is_current(self, tokens):
+        """
+        Whether none of the tags have been invalidated since their tokens were taken.
+        """
+        return self._tag_tokens(tokens) == tokens
+
+    def set(self, key, response, tags, since=None):
+        """
+        Saves a response along with the current tokens of its tags, unless one
+        of them was invalidated after 'since' (when the response was started),
+        since the response may show what it was before.
+        """
+        tokens = self.tokens(tags, since)
+        if None in tokens.values():
+            return False
+        return self.backend.set(
+            f"page:{key}",
+            dict(
+                data=response.get_data(),
+                status=response.status_code,
+                headers=list(response.headers.items()),
+                tags=tokens,
+            ),
+        )
+
+    def invalidate(self, *tags):
+        """
+        Drops every cached page that was saved with any of the given tags.
+        """
+        for tag in tags:
+            self.backend.set(f"tag:{tag}", new_token(time.time()), timeout=0)
+
+    def clear(self):
+        self.backend.clear()
+
+
+page_cache = PageCache()
+
+
+def new_token(invalidated=0.0):
+    """
+    A tag token, recording when the tag was invalidated (0 for new tags).
+    """
+    return f"{invalidated!r}:{uuid.uuid4().hex}"
+
+
+def invalidated_at(token):
+    stamp, _, _ = token.rpartition(":")
+    return float(stamp) if stamp else 0.0
+
+
+def tag_page(*tags):
+    """
+    Tags the page the current view is rendering (see cached).
+    """
+    g.setdefault("page_cache_tags", set()).update(tags)
+
+
+def post_tag(post_id):
+    return f"post:{post_id}"
+
+
+def listing_tag(listing):
+    return f"listing:{listing}"
+
+
+def cached(view):
+    """
+    Serves the view from the page cache when possible, otherwise renders it
+    and caches the response if it was successful.
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        key = request.full_path
+        page = page_cache.get(key)
+        PAGE_CACHE.labels("miss" if page is None else "hit").inc()
+        if page is not None:
+            # tagged like the page that was cached (see export.py)
+            tag_page(*page["tags"])
+            not_modified = cached_response_not_modified(page["headers"])
+            if not_modified is not None:
+                return not_modified
+            return current_app.response_class(
+                page["data"], status=page["status"], headers=page["headers"]
+            )
+
+        started = time.time()
+        response = make_response(view(**kwargs))
+        if response.status_code == 200 and not request.environ.get(NO_STORE):
+            page_cache.set(key, response, g.get("page_cache_tags", set()), since=started)
+        return response
+
+    return wrapped_view
@@ -0,0 +1,107 @@
+"""gzip/brotli compression of the app's responses
+
+Responses with a type in COMPRESSION_MIMETYPES and at least
+COMPRESSION_MIN_SIZE bytes long are compressed with the best encoding the
+request's Accept-Encoding allows (brotli, if the package is installed, then
+gzip) and get 'Vary: Accept-Encoding'. Their ETags are made weak, because the
+compressed bytes differ from the uncompressed ones, and weak ETags still
+match If-None-Match (see conditional.py).
+
+Compressed bodies of responses with an ETag are kept in the page cache's
+backend under the ETag, which changes whenever the page does. So each version
+of a page is compressed once per encoding, not on every request, whether the
+page itself came from the page cache or was rendered.
+
+Files sent by Flask (the static route, which has its own precompressed
+bundles, see assets.py) are left alone.
+"""
+
+from flask import current_app, request
+from application.cache import page_cache
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIMETYPES = [
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+    "application/javascript",
+    "application/json",
+    "application/rss+xml",
+    "application/atom+xml",
+    "application/feed+json",
+]
+
+
+def available_encodings():
+    """
+    The encodings responses can be compressed with, in order of preference.
+    """
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(data, encoding):
+    config = current_app.config
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESSION_BROTLI_QUALITY"])
+    return gzip.compress(data, compresslevel=config["COMPRESSION_GZIP_LEVEL"], mtime=0)
+
+
+class Compression(object):
+    """
+    Compresses responses after every request, when COMPRESSION is on.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESSION", True)
+        app.config.setdefault("COMPRESSION_MIN_SIZE", 500)
+        app.config.setdefault("COMPRESSION_MIMETYPES", MIMETYPES)
+        app.config.setdefault("COMPRESSION_GZIP_LEVEL", 6)
+        app.config.setdefault("COMPRESSION_BROTLI_QUALITY", 5)
+        if app.config["COMPRESSION"]:
+            app.after_request(self._compress)
+
+    def _compress(self, response):
+        config = current_app.config
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in config["COMPRESSION_MIMETYPES"]
+            or "no-transform" in response.headers.get("Cache-Control", "")
+        ):
+            return response
+        data = response.get_data()
+        if len(data) < config["COMPRESSION_MIN_SIZE"]:
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = next((name for name in available_encodings() if request.accept_encodings[name]), None)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        key = f"compressed:{encoding}:{etag}" if etag else None
+        compressed = page_cache.backend.get(key) if key else None
+        if compressed is None:
+            compressed = compress(data, encoding)
+            if key:
+                page_cache.backend.set(key, compressed)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compression = Compression()
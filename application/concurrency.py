@@ -0,0 +1,120 @@
+"""Concurrency settings for the web dynos: gunicorn's workers and the database pool
+
+gunicorn.conf.py and create_app both get their settings from here, so each
+worker's database pool always matches how many requests that worker can serve
+at once. Everything comes from environment variables, with defaults derived
+from the CPU count.
+
+GUNICORN_PROFILE picks how each worker process serves requests:
+- 'sync': one request at a time
+- 'gthread' (the default): GUNICORN_THREADS threads
+- 'gevent': up to GUNICORN_WORKER_CONNECTIONS greenlets. This needs the gevent
+  and psycogreen packages, which aren't in requirements.txt.
+
+WEB_CONCURRENCY is the number of worker processes. Heroku sets it for each
+dyno size. DATABASE_MAX_CONNECTIONS is the number of connections one dyno may
+open in total, and the per-worker pools are shrunk to fit it.
+"""
+
+from sqlalchemy.engine.url import make_url
+import os
+
+PROFILES = {
+    "sync": {"worker_class": "sync", "threads": 1, "worker_connections": 1},
+    "gthread": {"worker_class": "gthread", "threads": 4, "worker_connections": 1},
+    "gevent": {"worker_class": "gevent", "threads": 1, "worker_connections": 50},
+}
+
+
+def _int(env, name, default):
+    value = env.get(name)
+    return int(value) if value else default
+
+
+def default_workers(worker_class, cpus):
+    """
+    Sync workers spend most of their time waiting on the database, so there
+    are more of them than there are CPUs. Threaded and gevent workers each
+    serve several requests at once.
+    """
+    if worker_class == "sync":
+        return cpus * 2 + 1
+    return cpus + 1
+
+
+def gunicorn_settings(env=None, cpus=None):
+    """
+    The gunicorn settings (the names gunicorn.conf.py uses) for the web dyno.
+    """
+    env = os.environ if env is None else env
+    cpus = cpus or os.cpu_count() or 1
+    name = env.get("GUNICORN_PROFILE", "gthread")
+    if name not in PROFILES:
+        raise ValueError(f"Unknown GUNICORN_PROFILE: {name}")
+    profile = PROFILES[name]
+    return dict(
+        profile=name,
+        worker_class=profile["worker_class"],
+        workers=_int(env, "WEB_CONCURRENCY", default_workers(profile["worker_class"], cpus)),
+        threads=_int(env, "GUNICORN_THREADS", profile["threads"]),
+        worker_connections=_int(env, "GUNICORN_WORKER_CONNECTIONS", profile["worker_connections"]),
+        # loads the app once before forking, which create_app allows since it
+        # doesn't connect to the database (each worker opens its own connections)
+        preload_app=env.get("GUNICORN_PRELOAD", "true").lower() == "true",
+        # under Heroku's 30 second router timeout
+        timeout=_int(env, "GUNICORN_TIMEOUT", 25),
+        keepalive=_int(env, "GUNICORN_KEEPALIVE", 5),
+        # replacing workers now and then keeps memory leaks in check
+        max_requests=_int(env, "GUNICORN_MAX_REQUESTS", 1000),
+        max_requests_jitter=_int(env, "GUNICORN_MAX_REQUESTS_JITTER", 100),
+    )
+
+
+def requests_per_worker(settings):
+    """
+    How many requests one worker process can be serving at the same time.
+    """
+    if settings["worker_class"] == "gevent":
+        return settings["worker_connections"]
+    if settings["worker_class"] == "gthread":
+        return settings["threads"]
+    return 1
+
+
+def engine_options(url, env=None, settings=None, statement_timeout=0):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for one worker process and a database URL. The
+    pool holds a connection for every request the worker can serve at once
+    (at most 10), and DATABASE_MAX_CONNECTIONS caps every worker's pool
+    together. Connections are checked before use and replaced every
+    DATABASE_POOL_RECYCLE seconds, since Heroku drops idle ones. On Postgres,
+    statements are stopped after statement_timeout ms (0 for no limit).
+    SQLite keeps its own pools, which don't take any of these settings.
+    """
+    backend = make_url(url).get_backend_name() if url else None
+    if backend == "sqlite":
+        return {}
+    env = os.environ if env is None else env
+    settings = settings or gunicorn_settings(env)
+    pool_size = _int(env, "DATABASE_POOL_SIZE", min(requests_per_worker(settings), 10))
+    max_overflow = _int(env, "DATABASE_MAX_OVERFLOW", 2)
+    max_connections = _int(env, "DATABASE_MAX_CONNECTIONS", 0)
+    if max_connections:
+        per_worker = max(max_connections // settings["workers"], 1)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+    options = dict(
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=_int(env, "DATABASE_POOL_TIMEOUT", 10),
+        pool_recycle=_int(env, "DATABASE_POOL_RECYCLE", 300),
+        pool_pre_ping=True,
+    )
+    # Heroku's DATABASE_URL starts with postgres://
+    if backend in ("postgresql", "postgres"):
+        # make sure all datetime values are displayed in UTC
+        server_options = "-c timezone=utc"
+        if statement_timeout:
+            server_options += f" -c statement_timeout={statement_timeout}"
+        options["connect_args"] = {"options": server_options}
+    return options
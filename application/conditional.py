@@ -0,0 +1,93 @@
+"""Conditional GET (ETag / Last-Modified / 304) support for the blog routes"""
+
+from flask import current_app, request, make_response
+from werkzeug.http import is_resource_modified, parse_date
+import functools
+import hashlib
+import os
+
+
+def deploy_salt(app):
+    """
+    A fingerprint of the app's code, templates and stylesheets/scripts (their
+    paths, sizes and modification times), for ETAG_SALT when
+    HEROKU_SLUG_COMMIT isn't set. It changes whenever a new version is
+    deployed, but is the same in every worker started from the same files.
+    """
+    files = []
+    for directory, subdirectories, names in os.walk(app.root_path):
+        # uploads and the built bundles don't change the app
+        subdirectories[:] = [d for d in subdirectories if d not in ("__pycache__", "post_imgs", "dist")]
+        for name in names:
+            if name.endswith((".py", ".html", ".xml", ".css", ".js")):
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                files.append((os.path.relpath(path, app.root_path), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(sorted(files)).encode()).hexdigest()
+
+
+def make_etag(*parts):
+    """
+    Builds a strong ETag out of anything that identifies the content of a page.
+    """
+    digest = hashlib.sha1(repr((current_app.config["ETAG_SALT"],) + parts).encode())
+    return digest.hexdigest()
+
+
+def not_modified_response(etag, last_modified):
+    """
+    Returns a 304 response if the client's copy of the page (according to its
+    If-None-Match/If-Modified-Since headers) is still current, otherwise None.
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def conditional(validator):
+    """
+    Makes a view answer conditional GETs.
+
+    validator is called with the view's arguments and returns (etag, last_modified)
+    for the page. It should be much cheaper than the view itself (e.g. only look
+    at post ids and dates) because when the client's copy is still current the
+    view isn't called at all.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            etag, last_modified = validator(**kwargs)
+            response = not_modified_response(etag, last_modified)
+            if response is not None:
+                return response
+
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def cached_response_not_modified(headers):
+    """
+    Checks a cached page's stored ETag/Last-Modified against the request, so
+    cache hits can be answered with a 304 too.
+    """
+    headers = dict(headers)
+    etag = headers.get("ETag")
+    if etag is None:
+        return None
+    last_modified = headers.get("Last-Modified")
+    if last_modified is not None:
+        last_modified = parse_date(last_modified)
+    # stored etags are quoted, not_modified_response expects the raw value
+    return not_modified_response(etag.strip('"'), last_modified)
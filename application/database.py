@@ -1,8 +1,21 @@
 import datetime
+import re
+import unicodedata
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, or_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import joinedload, selectinload, subqueryload
 
 db = SQLAlchemy()
 
+# eager loading strategies that can be used for Posts.images (see POST_IMAGES_LOADING)
+IMAGE_LOADING_STRATEGIES = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "subquery": subqueryload,
+}
+
 class Posts(db.Model):
     """
     Stores blog post information.
@@ -11,15 +24,47 @@ class Posts(db.Model):
     __tablename__ = "posts"
     id = db.Column(db.Integer, primary_key=True)
     h1 = db.Column(db.String(100))
+    # used in the post's url, it doesn't change when the post is edited
+    slug = db.Column(db.String(120), unique=True, index=True)
     header_path = db.Column(db.String(175))
     youtube_vid = db.Column(db.String(100))
     sample = db.Column(db.String(355))
     body = db.Column(db.Text())
+    # the body and the header image's markup, as shown on the post's page (see rendering.py)
+    rendered_body = db.Column(db.Text())
+    rendered_header = db.Column(db.Text())
     category = db.Column(db.String(200))
     date = db.Column(db.DateTime(timezone=True))
+    # last time the post was created or edited, used for conditional GETs
+    updated = db.Column(db.DateTime(timezone=True))
+    # whether the header image's variants have been made: pending, processing, ready or failed
+    header_status = db.Column(db.String(20))
+    # when an image worker started making them
+    header_claimed_at = db.Column(db.DateTime(timezone=True))
+    images = db.relationship(
+        "BodyImages", backref="post", order_by="BodyImages.id", lazy="select"
+    )
+    header_variants = db.relationship(
+        "ImageVariants",
+        primaryjoin="and_(Posts.id == foreign(ImageVariants.post_id), ImageVariants.image_id == None)",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        # category listings: WHERE category = ? ORDER BY id DESC
+        db.Index("ix_posts_category_id", category, id),
+        # the image worker's queue of headers
+        db.Index(
+            "ix_posts_header_unfinished",
+            id,
+            postgresql_where=header_status.in_(["pending", "processing"]),
+            sqlite_where=header_status.in_(["pending", "processing"]),
+        ),
+    )
 
     def __init__(self, h1, sample, header_path, youtube_vid, body, category):
         self.h1 = h1
+        self.slug = slugify(h1)
         self.sample = sample
         self.header_path = header_path
         self.youtube_vid = youtube_vid
@@ -27,21 +72,177 @@ class Posts(db.Model):
         self.category = category
         print(datetime.datetime.now(datetime.timezone.utc))
         self.date = datetime.datetime.now()
+        self.updated = datetime.datetime.now(datetime.timezone.utc)
+        self.header_status = "pending" if header_path else None
+
+    @property
+    def ready_header_variants(self):
+        """
+        The variants of the header image, or none until the image worker has made all of them.
+        """
+        return self.header_variants if self.header_status == "ready" else []
+
+    @property
+    def header(self):
+        """
+        The first body image of the post (or None if the post doesn't have any).
+        """
+        return self.images[0] if self.images else None
+
+
+def slugify(text, max_length=80):
+    """
+    Turns a post title into the lowercase, dash separated ascii used in its url.
+    Slugs are never all digits, those urls are the old /post/<id> ones.
+    """
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+    if len(slug) > max_length:
+        slug = slug[:max_length].rsplit("-", 1)[0]
+    if not slug or slug.isdigit():
+        slug = f"post-{slug}".strip("-")
+    return slug
+
+
+def unique_slug(h1):
+    """
+    The slug for a new post, with -2, -3, ... added if another post already has it.
+    """
+    base = slugify(h1)
+    taken = {
+        slug
+        for (slug,) in db.session.query(Posts.slug).filter(
+            or_(Posts.slug == base, Posts.slug.like(f"{base}-%"))
+        )
+    }
+    slug, number = base, 2
+    while slug in taken:
+        slug = f"{base}-{number}"
+        number += 1
+    return slug
+
+
+# posts.search_vector (see search.py) is Postgres only, so it isn't a column of
+# the model, it's added whenever the table is created on Postgres (and by a migration)
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(h1, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(sample, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(body, '')), 'C')"
+)
+event.listen(
+    Posts.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE posts ADD COLUMN search_vector tsvector "
+        f"GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED"
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    Posts.__table__,
+    "after_create",
+    DDL(
+        "CREATE INDEX ix_posts_search_vector ON posts USING gin (search_vector)"
+    ).execute_if(dialect="postgresql"),
+)
 
 
 class BodyImages(db.Model):
     """
     Stores the file locations of the images used in the body of the blog posts.
+    Status is 'pending' until an image worker claims the image ('processing'),
+    then 'ready' once its variants are made (see image_queue.py), or 'failed'
+    if they couldn't be.
     """
 
     __tablename__ = "body_images"
     id = db.Column(db.Integer, primary_key=True)
-    post_id = db.Column(db.Integer)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
     img_path = db.Column(db.String(175))
+    status = db.Column(db.String(20), default="pending")
+    # when an image worker claimed it
+    claimed_at = db.Column(db.DateTime(timezone=True))
+    variants = db.relationship("ImageVariants", backref="image")
+
+    __table_args__ = (
+        # the images of a page of posts: WHERE post_id IN (...) ORDER BY id
+        db.Index("ix_body_images_post_id_id", post_id, id),
+        # the image worker's queue
+        db.Index(
+            "ix_body_images_unfinished",
+            id,
+            postgresql_where=status.in_(["pending", "processing"]),
+            sqlite_where=status.in_(["pending", "processing"]),
+        ),
+    )
 
     def __init__(self, post_id, img_path):
         self.post_id = post_id
         self.img_path = img_path
+        self.status = "pending"
+
+    @property
+    def picture(self):
+        """
+        Responsive <picture> markup for the image, for use in post bodies as {imgs[0].picture}.
+        The original file is used until the image's variants are ready.
+        """
+        from application.images import picture
+        return picture(self.img_path, self.variants if self.status == "ready" else ())
+
+
+class ImageVariants(db.Model):
+    """
+    Resized and re-encoded copies of the images uploaded with a post, used to
+    build srcset attributes (see images.py). image_id is None for header images.
+    """
+
+    __tablename__ = "image_variants"
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    image_id = db.Column(db.Integer, db.ForeignKey("body_images.id"))
+    source_path = db.Column(db.String(175))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    format = db.Column(db.String(10))
+    path = db.Column(db.String(200))
+
+    __table_args__ = (
+        db.Index("ix_image_variants_image_id", image_id),
+        # header variants (Posts.header_variants) are the ones without an image
+        db.Index(
+            "ix_image_variants_header",
+            post_id,
+            postgresql_where=image_id == None,
+            sqlite_where=image_id == None,
+        ),
+    )
+
+    def __init__(self, post_id, image_id, source_path, width, height, format, path):
+        self.post_id = post_id
+        self.image_id = image_id
+        self.source_path = source_path
+        self.width = width
+        self.height = height
+        self.format = format
+        self.path = path
+
+
+def with_images(query):
+    """
+    Eager loads the body images of every post returned by a Posts query so that
+    the images of all the posts are fetched in one go instead of once per post.
+    The strategy comes from the POST_IMAGES_LOADING config value.
+    """
+    strategy = current_app.config.get("POST_IMAGES_LOADING", "selectin")
+    return query.options(IMAGE_LOADING_STRATEGIES[strategy](Posts.images))
+
+
+def post_versions(query):
+    """
+    Narrows a Posts query down to the (id, updated) of each post, which is
+    enough to tell whether a page of posts has changed without loading them.
+    """
+    return query.with_entities(Posts.id, Posts.updated)
 
 
 class Subscribers(db.Model):
@@ -58,6 +259,16 @@ class Subscribers(db.Model):
     date_subscribed = db.Column(db.Date)
     date_unsubscribed = db.Column(db.Date)
 
+    __table_args__ = (
+        # only current subscribers are emailed, and they're most of the table
+        db.Index(
+            "ix_subscribers_active",
+            id,
+            postgresql_where=still_subscribed == True,
+            sqlite_where=still_subscribed == True,
+        ),
+    )
+
     def __init__(self, first, last, email):
         self.first = first
         self.last = last
@@ -65,6 +276,104 @@ class Subscribers(db.Model):
         self.date_subscribed = datetime.date.today()
 
 
+class MailJobs(db.Model):
+    """
+    Emails that are sent out to every subscriber in the background by the mail worker
+    (see mail_queue.py). Status is 'queued' until every delivery of the job is
+    finished, then 'done'.
+    """
+
+    __tablename__ = "mail_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200))
+    body_text = db.Column(db.Text())
+    body_html = db.Column(db.Text())
+    status = db.Column(db.String(20), default="queued")
+    created = db.Column(db.DateTime(timezone=True))
+    finished = db.Column(db.DateTime(timezone=True))
+    deliveries = db.relationship("MailDeliveries", backref="job", lazy="dynamic")
+
+    def __init__(self, subject, body_text, body_html):
+        self.subject = subject
+        self.body_text = body_text
+        self.body_html = body_html
+        self.status = "queued"
+        self.created = datetime.datetime.now(datetime.timezone.utc)
+
+
+class MailDeliveries(db.Model):
+    """
+    An email to one subscriber: either their copy of a mail job ('newsletter')
+    or the email they get when they subscribe ('welcome', which has no job).
+    Status goes from 'pending' to 'sending' (claimed by a worker) to 'sent' or
+    'failed'. Failed attempts aren't retried before next_attempt_at.
+    """
+
+    __tablename__ = "mail_deliveries"
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey("mail_jobs.id"))
+    subscriber_id = db.Column(db.Integer, db.ForeignKey("subscribers.id"), nullable=False)
+    kind = db.Column(db.String(20), default="newsletter")
+    status = db.Column(db.String(20), default="pending")
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text())
+    claimed_at = db.Column(db.DateTime(timezone=True))
+    next_attempt_at = db.Column(db.DateTime(timezone=True))
+    sent_at = db.Column(db.DateTime(timezone=True))
+    subscriber = db.relationship("Subscribers")
+
+    __table_args__ = (
+        # the mail worker's queue, which stays small while the table keeps growing
+        db.Index(
+            "ix_mail_deliveries_unfinished",
+            id,
+            postgresql_where=status.in_(["pending", "sending"]),
+            sqlite_where=status.in_(["pending", "sending"]),
+        ),
+        # counting the unfinished deliveries of a job (mail_queue.finish_jobs)
+        db.Index("ix_mail_deliveries_job_id_status", job_id, status),
+    )
+
+    def __init__(self, job_id, subscriber_id, kind="newsletter"):
+        self.job_id = job_id
+        self.subscriber_id = subscriber_id
+        self.kind = kind
+        self.status = "pending"
+        self.attempts = 0
+
+
+def insert_subscriber(first, last, email):
+    """
+    Adds a subscriber in a single atomic statement and returns their id, or None
+    if the email is already subscribed. Concurrent sign-ups with the same email
+    can't race each other because the unique constraint on email decides.
+    Emails are stored lowercase.
+    """
+    values = dict(
+        first=first,
+        last=last,
+        email=email.strip().lower(),
+        still_subscribed=True,
+        date_subscribed=datetime.date.today(),
+    )
+    table = Subscribers.__table__
+    if db.session.get_bind().dialect.name == "postgresql":
+        statement = (
+            postgresql.insert(table)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=[table.c.email])
+            .returning(table.c.id)
+        )
+        return db.session.execute(statement).scalar()
+
+    # SQLite (used in development/testing) has no RETURNING, but INSERT OR IGNORE
+    # is just as atomic
+    result = db.session.execute(table.insert().values(**values).prefix_with("OR IGNORE"))
+    if not result.rowcount:
+        return None
+    return result.inserted_primary_key[0]
+
+
 class Admin(db.Model):
     """
     Database containing email and encrypted password for admin users. These users
@@ -0,0 +1,250 @@
+"""Static export of the public blog
+
+'flask export-site' renders every public page to STATIC_EXPORT_DIR:
+- / and each page of older posts after it (/?before=<id>)
+- /post/<slug> for every post (/post/<id> only redirects there)
+- /<category> and its pages of older posts, for every category
+- /rss, /atom and /feed.json, and those of every category
+
+The pages are rendered by the blog views themselves, so they're exactly what
+the app would serve. Every page's ETag is kept in manifest.json and the next
+export asks for each page with If-None-Match, so pages showing no changed post
+are answered with a 304 by their validators and aren't rendered or written
+again. Pages that are gone (e.g. a listing with fewer pages) are deleted.
+
+With STATIC_EXPORT_SERVE on, GETs for exported pages are answered from their
+files without touching the database. Each page is exported with the page cache
+tokens of its tags (see cache.py), so a page that admin.create/edit, the image
+worker or 'flask render-posts' invalidates is rendered dynamically until the
+next export, as is any page that wasn't exported. The tokens are only shared
+with the exporting process by the 'filesystem' page cache on the same machine,
+with the other page caches every page is rendered dynamically.
+"""
+
+from flask import current_app, g, request, url_for
+from flask.cli import with_appcontext
+from application.database import db, Posts
+from application.cache import page_cache, NO_STORE
+import click
+import json
+import os
+import re
+import tempfile
+import time
+
+MANIFEST = "manifest.json"
+
+# response headers saved with each page and sent when it's served from its file
+SAVED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control")
+
+EXTENSIONS = {
+    "text/html": ".html",
+    "application/rss+xml": ".xml",
+    "application/atom+xml": ".xml",
+    "application/feed+json": ".json",
+}
+
+FEEDS = ("blog.rss", "blog.atom", "blog.json_feed")
+
+# set in the environ of the requests that render the export, so they aren't served from it
+RENDERING = "static_export.rendering"
+
+
+def page_key(url):
+    """
+    The key of a page in the manifest, its request.full_path.
+    """
+    return url if "?" in url else url + "?"
+
+
+def page_file(key, mimetype):
+    """
+    Where a page is saved in the export, relative to its directory: /code is
+    saved as code/index.html and /code?before=12 as code/index-before-12.html.
+    """
+    path, _, query = key.partition("?")
+    name = "index"
+    if query:
+        name += "-" + re.sub(r"[^A-Za-z0-9]+", "-", query).strip("-")
+    return os.path.join(*path.strip("/").split("/"), name + EXTENSIONS.get(mimetype, ".html"))
+
+
+def listing_urls(query, endpoint, **values):
+    """
+    The urls of every page of a listing of posts, newest first.
+    """
+    ids = [post_id for (post_id,) in query.with_entities(Posts.id).order_by(Posts.id.desc())]
+    per_page = current_app.config["POSTS_PER_PAGE"]
+    urls = [url_for(endpoint, **values)]
+    # each page's 'older' cursor is the id of its last post
+    for end in range(per_page, len(ids), per_page):
+        urls.append(url_for(endpoint, before=ids[end - 1], **values))
+    return urls
+
+
+def site_urls():
+    """
+    The urls of every page of the public blog.
+    """
+    with current_app.test_request_context():
+        urls = listing_urls(Posts.query, "blog.index")
+        for (slug,) in db.session.query(Posts.slug).order_by(Posts.id):
+            urls.append(url_for("blog.view_post", slug=slug))
+        for (category,) in db.session.query(Posts.category).distinct().order_by(Posts.category):
+            urls += listing_urls(Posts.query.filter_by(category=category), "blog.post_layout", category=category)
+            urls += [url_for(endpoint, category=category) for endpoint in FEEDS]
+        urls += [url_for(endpoint) for endpoint in FEEDS]
+    return urls
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            return json.load(manifest)["pages"]
+    except FileNotFoundError:
+        return {}
+
+
+def write_file(path, data):
+    """
+    Writes a file so that readers only ever see the old or the new version.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+    os.replace(temp, path)
+
+
+def render_page(url, etag=None):
+    """
+    Requests a page from the app, with If-None-Match if the exported copy's
+    ETag is given, and returns the response, the tags of the page and when
+    it was started. The request is made on SITE_URL, and the page isn't
+    saved in the page cache.
+    """
+    app = current_app._get_current_object()
+    headers = {"If-None-Match": f'"{etag}"'} if etag else {}
+    started = time.time()
+    with app.test_request_context(
+        url,
+        base_url=app.config["SITE_URL"],
+        headers=headers,
+        environ_base={RENDERING: True, NO_STORE: True},
+    ):
+        response = app.full_dispatch_request()
+        tags = g.get("page_cache_tags", set())
+    # the export runs in one app context, don't keep every post it loaded
+    db.session.remove()
+    return response, tags, started
+
+
+def export_site(directory, full=False):
+    """
+    Exports the public blog to a directory and returns how many pages were
+    rendered, were unchanged and were deleted. 'full' renders every page.
+    SITE_URL has to be set, it's what the feeds' links start with.
+    """
+    if not current_app.config["SITE_URL"]:
+        raise click.UsageError("SITE_URL has to be set to export the site")
+    old_pages = {} if full else read_manifest(directory)
+    pages = {}
+    rendered = unchanged = 0
+    for url in site_urls():
+        key = page_key(url)
+        old = old_pages.get(key)
+        if old is not None and not os.path.exists(os.path.join(directory, old["file"])):
+            old = None
+        response, tags, started = render_page(url, old and old["etag"])
+        # tags invalidated while the page was rendered get no token, so the
+        # file isn't served until the next export
+        if response.status_code == 304:
+            # the same page, but the tokens of its tags may have been replaced
+            pages[key] = dict(old, tags=page_cache.tokens(old["tags"], since=started))
+            unchanged += 1
+            continue
+        if response.status_code != 200:
+            current_app.logger.warning("Not exporting %s, it returned %s", url, response.status)
+            continue
+        file = page_file(key, response.mimetype)
+        write_file(os.path.join(directory, file), response.get_data())
+        pages[key] = dict(
+            file=file,
+            etag=response.get_etag()[0],
+            headers=[(name, response.headers[name]) for name in SAVED_HEADERS if name in response.headers],
+            tags=page_cache.tokens(tags, since=started),
+        )
+        rendered += 1
+
+    write_file(os.path.join(directory, MANIFEST), json.dumps({"pages": pages}, indent=1).encode())
+    removed = 0
+    for key, old in old_pages.items():
+        if key not in pages:
+            try:
+                os.remove(os.path.join(directory, old["file"]))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return rendered, unchanged, removed
+
+
+class StaticExport(object):
+    """
+    Serves GETs for exported pages from their files, when STATIC_EXPORT_SERVE is on.
+    """
+
+    def __init__(self, app=None):
+        # (manifest modified time, pages), read again whenever the manifest changes
+        self._manifest = (None, {})
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "STATIC_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "personal_website_export")
+        )
+        app.config.setdefault("STATIC_EXPORT_SERVE", False)
+        if app.config["STATIC_EXPORT_SERVE"]:
+            app.before_request(self._serve)
+
+    def pages(self):
+        path = os.path.join(current_app.config["STATIC_EXPORT_DIR"], MANIFEST)
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if modified != self._manifest[0]:
+            with open(path) as manifest:
+                self._manifest = (modified, json.load(manifest)["pages"])
+        return self._manifest[1]
+
+    def _serve(self):
+        if request.method not in ("GET", "HEAD") or request.environ.get(RENDERING):
+            return None
+        page = self.pages().get(request.full_path)
+        if page is None or not page_cache.is_current(page["tags"]):
+            return None
+        try:
+            with open(os.path.join(current_app.config["STATIC_EXPORT_DIR"], page["file"]), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        # read rather than sent as a file so that it's compressed (see compression.py)
+        response = current_app.response_class(data, headers=page["headers"])
+        return response.make_conditional(request)
+
+
+static_export = StaticExport()
+
+
+@click.command("export-site")
+@click.option("--output", type=click.Path(file_okay=False), help="Directory to export to, STATIC_EXPORT_DIR by default.")
+@click.option("--full", is_flag=True, help="Render every page, not only the changed ones.")
+@with_appcontext
+def export_site_command(output, full):
+    """
+    Renders the public blog to static files.
+    """
+    directory = output or current_app.config["STATIC_EXPORT_DIR"]
+    rendered, unchanged, removed = export_site(directory, full)
+    click.echo(f"Exported to {directory}: {rendered} rendered, {unchanged} unchanged, {removed} removed")
@@ -0,0 +1,237 @@
+"""RSS 2.0, Atom and JSON Feed feeds of the blog
+
+Each feed is the newest FEED_ITEMS posts of the whole blog or of one category.
+A post's entry is serialized once per format and kept in the page cache's
+backend under a key made from the post's id and updated time, so a feed is
+joined together from ready-made strings and publishing or editing a post only
+serializes that post's entry again. The finished feeds are cached like any
+other page by the blog views (see cache.py).
+
+Entries have the post's sample as their summary, or with FEED_FULL_CONTENT
+its whole rendered header and body. Links are made absolute with SITE_URL,
+never with the request's Host header: the feeds are cached for every host,
+so one request with a forged Host would otherwise poison them. Outside debug
+and testing the feeds can't be built without it.
+"""
+
+from flask import current_app, request, url_for
+from markupsafe import escape
+from email.utils import format_datetime
+from application.database import Posts, post_versions
+from application.cache import page_cache
+from application.conditional import make_etag
+from application.rendering import post_html, with_render_data
+import datetime
+import json
+import re
+
+MIME_TYPES = {
+    "rss": "application/rss+xml",
+    "atom": "application/atom+xml",
+    "json": "application/feed+json",
+}
+
+URL_ATTRIBUTE = re.compile(r'\b(src|href|srcset)="([^"]*)"')
+
+# the site url in debug and testing when SITE_URL isn't set, 'flask run's
+DEVELOPMENT_URL = "http://localhost:5000"
+
+
+def site_url():
+    url = current_app.config["SITE_URL"]
+    if not url:
+        if not (current_app.debug or current_app.testing):
+            raise RuntimeError("SITE_URL has to be set for the feeds' links")
+        url = DEVELOPMENT_URL
+    return url.rstrip("/")
+
+
+def absolute(path):
+    return site_url() + path
+
+
+def absolute_urls(html):
+    """
+    Makes the site-relative urls of the links and images in some HTML absolute,
+    feed readers show entries away from the site.
+    """
+    def replace(match):
+        value = re.sub(r"(^|,\s*)/(?!/)", lambda m: m.group(1) + site_url() + "/", match.group(2))
+        return f'{match.group(1)}="{value}"'
+
+    return URL_ATTRIBUTE.sub(replace, html)
+
+
+def utc(value):
+    """
+    A datetime in UTC, naive ones (from databases without time zones) are taken to be UTC.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def entry_dates(post):
+    published = utc(post.date or post.updated)
+    return published, utc(post.updated or post.date)
+
+
+def entry_content(post):
+    """
+    The HTML of an entry when FEED_FULL_CONTENT is on, otherwise None.
+    """
+    if not current_app.config["FEED_FULL_CONTENT"]:
+        return None
+    header, body = post_html(post)
+    return absolute_urls(str(header) + str(body))
+
+
+def rss_entry(post):
+    published, _ = entry_dates(post)
+    content = entry_content(post)
+    return (
+        "<item>"
+        f"<title>{escape(post.h1)}</title>"
+        f"<link>{escape(absolute(url_for('blog.view_post', slug=post.slug)))}</link>"
+        f"<description>{escape(post.sample if content is None else content)}</description>"
+        f"<pubDate>{format_datetime(published)}</pubDate>"
+        f'<guid isPermaLink="false">{post.id}</guid>'
+        "</item>"
+    )
+
+
+def atom_entry(post):
+    published, updated = entry_dates(post)
+    content = entry_content(post)
+    # the id is the /post/<id> url, which never changes unlike the slug
+    entry = (
+        "<entry>"
+        f"<title>{escape(post.h1)}</title>"
+        f'<link rel="alternate" href="{escape(absolute(url_for("blog.view_post", slug=post.slug)))}"/>'
+        f"<id>{escape(absolute(url_for('blog.redirect_post', id=post.id)))}</id>"
+        f"<published>{published.isoformat()}</published>"
+        f"<updated>{updated.isoformat()}</updated>"
+        f'<summary type="html">{escape(post.sample)}</summary>'
+    )
+    if content is not None:
+        entry += f'<content type="html">{escape(content)}</content>'
+    return entry + "</entry>"
+
+
+def json_entry(post):
+    published, updated = entry_dates(post)
+    content = entry_content(post)
+    item = dict(
+        id=str(post.id),
+        url=absolute(url_for("blog.view_post", slug=post.slug)),
+        title=post.h1,
+        summary=post.sample,
+        date_published=published.isoformat(),
+        date_modified=updated.isoformat(),
+    )
+    if content is not None:
+        item["content_html"] = content
+    else:
+        item["content_text"] = post.sample
+    return json.dumps(item)
+
+
+ENTRIES = {"rss": rss_entry, "atom": atom_entry, "json": json_entry}
+
+
+def feed_title(category):
+    title = current_app.config["FEED_TITLE"]
+    return title if category is None else f"{title}: {category}"
+
+
+def rss_document(entries, category, updated):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">'
+        "<channel>"
+        f"<title>{escape(feed_title(category))}</title>"
+        f"<link>{escape(site_url())}/</link>"
+        f"<description>{escape(current_app.config['FEED_DESCRIPTION'])}</description>"
+        f'<atom:link href="{escape(absolute(request.path))}" rel="self" type="{MIME_TYPES["rss"]}"/>'
+        f"<lastBuildDate>{format_datetime(updated)}</lastBuildDate>"
+        + "".join(entries)
+        + "</channel></rss>"
+    )
+
+
+def atom_document(entries, category, updated):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom">'
+        f"<title>{escape(feed_title(category))}</title>"
+        f"<subtitle>{escape(current_app.config['FEED_DESCRIPTION'])}</subtitle>"
+        f'<link rel="alternate" href="{escape(site_url())}/"/>'
+        f'<link rel="self" href="{escape(absolute(request.path))}"/>'
+        f"<id>{escape(absolute(request.path))}</id>"
+        f"<updated>{updated.isoformat()}</updated>"
+        f"<author><name>{escape(current_app.config['FEED_AUTHOR'])}</name></author>"
+        + "".join(entries)
+        + "</feed>"
+    )
+
+
+def json_document(entries, category, updated):
+    head = json.dumps(dict(
+        version="https://jsonfeed.org/version/1.1",
+        title=feed_title(category),
+        home_page_url=site_url() + "/",
+        feed_url=absolute(request.path),
+        description=current_app.config["FEED_DESCRIPTION"],
+        authors=[dict(name=current_app.config["FEED_AUTHOR"])],
+    ))
+    # the entries are already JSON, they're spliced in as the last member
+    return head[:-1] + ', "items": [' + ", ".join(entries) + "]}"
+
+
+DOCUMENTS = {"rss": rss_document, "atom": atom_document, "json": json_document}
+
+
+def feed_versions(category=None):
+    """
+    The (id, updated) of the posts in a feed, newest first.
+    """
+    query = Posts.query if category is None else Posts.query.filter_by(category=category)
+    return (
+        post_versions(query)
+        .order_by(Posts.id.desc())
+        .limit(current_app.config["FEED_ITEMS"])
+        .all()
+    )
+
+
+def entry_key(fmt, post_id, updated):
+    full = current_app.config["FEED_FULL_CONTENT"]
+    return "feed-entry:" + make_etag(fmt, full, site_url(), post_id, updated)
+
+
+def feed(fmt, category=None):
+    """
+    A feed in one of the formats and the ids of the posts in it. Only the
+    entries that aren't in the cache are serialized, from posts loaded in one query.
+    """
+    versions = feed_versions(category)
+    keys = [entry_key(fmt, *version) for version in versions]
+    backend = page_cache.backend
+    entries = backend.get_many(*keys) if keys else []
+    missing = [version.id for version, entry in zip(versions, entries) if entry is None]
+    if missing:
+        query = Posts.query.filter(Posts.id.in_(missing))
+        if current_app.config["FEED_FULL_CONTENT"]:
+            query = with_render_data(query)
+        posts = {post.id: post for post in query}
+        for index, version in enumerate(versions):
+            if entries[index] is None and version.id in posts:
+                entries[index] = ENTRIES[fmt](posts[version.id])
+                backend.set(keys[index], entries[index])
+
+    updated = max(
+        (utc(version.updated) for version in versions if version.updated),
+        default=datetime.datetime.now(datetime.timezone.utc),
+    )
+    document = DOCUMENTS[fmt]([entry for entry in entries if entry is not None], category, updated)
+    return document.encode(), [version.id for version in versions]
@@ -0,0 +1,247 @@
+"""Background processing of uploaded images.
+
+admin.create and admin.edit only save the uploaded originals and mark their
+BodyImages rows (or the post's header_status) as 'pending', and the blog
+serves the original files until then. The image worker (image_worker.py, the
+'images' process in the Procfile) claims pending images in batches and encodes
+their variants in a ProcessPoolExecutor, so a batch is spread over every core.
+
+Claiming an image marks it 'processing' and commits, so no rows are locked
+while it's encoded and the admin can still edit its post. An image that can't
+be encoded for any reason is marked 'failed' instead of stopping the worker.
+Images claimed by a worker that died are claimed again after
+IMAGE_QUEUE_LEASE seconds.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image
+from sqlalchemy import and_, or_
+from application.database import db, BodyImages, ImageVariants, Posts
+from application.images import encode_variants
+from application.cache import page_cache, post_tag
+from application.rendering import render_post, with_render_data
+import click
+import datetime
+import os
+import time
+
+# errors that mean Pillow can't make variants of a file, it stays 'failed'
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def disk_path(source_path):
+    """
+    Where an image path relative to the 'application' directory is on disk.
+    """
+    return os.path.join("application", source_path)
+
+
+# model: BodyImages or Posts (for a header)
+# row_id: the id of its row
+# post_id, source_path: the image's post and path relative to 'application'
+# image_id: the BodyImages id, None for a header
+ImageJob = namedtuple("ImageJob", ["model", "row_id", "post_id", "source_path", "image_id"])
+
+# the status and claimed_at columns of each model
+COLUMNS = {BodyImages: ("status", "claimed_at"), Posts: ("header_status", "header_claimed_at")}
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _unclaimed(model, stale):
+    status, claimed_at = (getattr(model, column) for column in COLUMNS[model])
+    return model.query.filter(
+        or_(status == "pending", and_(status == "processing", claimed_at < stale))
+    ).order_by(model.id)
+
+
+def claim_images(batch_size):
+    """
+    Marks up to batch_size pending body images and pending post headers as
+    'processing' and returns an ImageJob for each of them. Images claimed
+    longer than IMAGE_QUEUE_LEASE seconds ago belong to a worker that died,
+    so they can be claimed again. The claim is committed, so the rows are only
+    locked for as long as it takes to claim them.
+    """
+    now = _now()
+    stale = now - datetime.timedelta(seconds=current_app.config["IMAGE_QUEUE_LEASE"])
+    jobs = []
+    for model in (BodyImages, Posts):
+        status, claimed_at = COLUMNS[model]
+        rows = _unclaimed(model, stale).limit(batch_size).with_for_update(skip_locked=True).all()
+        for row in rows:
+            setattr(row, status, "processing")
+            setattr(row, claimed_at, now)
+            if model is BodyImages:
+                jobs.append(ImageJob(model, row.id, row.post_id, row.img_path, row.id))
+            else:
+                jobs.append(ImageJob(model, row.id, row.id, row.header_path, None))
+    db.session.commit()
+    return jobs
+
+
+def release_images(jobs):
+    """
+    Puts claimed images back in the queue, for when they couldn't be started.
+    """
+    for job in jobs:
+        status, claimed_at = COLUMNS[job.model]
+        job.model.query.filter(job.model.id == job.row_id).update(
+            {status: "pending", claimed_at: None}, synchronize_session=False
+        )
+    db.session.commit()
+
+
+def encode_jobs(executor, jobs):
+    """
+    Encodes the variants of every job in 'executor', outside of any
+    transaction. Returns the variants of each job, or None for the ones that
+    couldn't be made.
+    """
+    config = current_app.config
+    try:
+        futures = [
+            executor.submit(
+                encode_variants,
+                disk_path(job.source_path),
+                config["IMAGE_VARIANT_WIDTHS"],
+                config["IMAGE_VARIANT_FORMATS"],
+                config["IMAGE_QUALITY"],
+            )
+            for job in jobs
+        ]
+    except BrokenProcessPool:
+        # none of them were tried, another worker (or a new pool) can have them
+        release_images(jobs)
+        raise
+
+    results = []
+    for job, future in zip(jobs, futures):
+        try:
+            encoded = future.result()
+        except IMAGE_ERRORS as e:
+            # not an image Pillow can read, the original is still served
+            current_app.logger.warning("Couldn't make variants of %s: %s", job.source_path, e)
+            encoded = None
+        except Exception:
+            current_app.logger.exception("Failed to make variants of %s", job.source_path)
+            encoded = None
+        else:
+            if not encoded:
+                current_app.logger.warning("%s is animated, it's served as it is without variants", job.source_path)
+        results.append(encoded)
+    return results
+
+
+def record_variants(jobs, results):
+    """
+    Saves the variants of the jobs and marks each of them 'ready', or 'failed'
+    if they couldn't be made. Images that aren't 'processing' any more (their
+    post was edited in the meantime) are left alone. Returns the ids of the
+    posts whose images changed.
+    """
+    post_ids = set()
+    for job, encoded in zip(jobs, results):
+        status, claimed_at = COLUMNS[job.model]
+        row = job.model.query.filter(job.model.id == job.row_id).with_for_update().one_or_none()
+        path = None if row is None else row.img_path if job.model is BodyImages else row.header_path
+        if row is None or getattr(row, status) != "processing" or path != job.source_path:
+            continue
+        if encoded is None:
+            setattr(row, status, "failed")
+            continue
+        for width, height, fmt, variant_path in encoded:
+            path = os.path.relpath(variant_path, "application")
+            db.session.add(ImageVariants(job.post_id, job.image_id, job.source_path, width, height, fmt, path))
+        setattr(row, status, "ready")
+        post_ids.add(job.post_id)
+    return post_ids
+
+
+def run_once(executor, batch_size=None):
+    """
+    Makes the variants of one batch of pending images in 'executor' and
+    returns how many images were processed.
+    """
+    if batch_size is None:
+        batch_size = current_app.config["IMAGE_QUEUE_BATCH_SIZE"]
+    jobs = claim_images(batch_size)
+    if not jobs:
+        return 0
+    post_ids = record_variants(jobs, encode_jobs(executor, jobs))
+
+    if post_ids:
+        db.session.flush()
+        # the pages of these posts change, so they're rendered again with the
+        # variants, and their ETags and Last-Modified have to change as well
+        now = _now()
+        posts = with_render_data(Posts.query.filter(Posts.id.in_(post_ids))).populate_existing().all()
+        for post in posts:
+            render_post(post)
+            post.updated = now
+    db.session.commit()
+    if post_ids:
+        page_cache.invalidate(*[post_tag(post_id) for post_id in post_ids])
+    return len(jobs)
+
+
+def image_executor(processes=None):
+    """
+    The process pool the variants are encoded in, IMAGE_WORKER_PROCESSES
+    processes (one per core if it isn't set).
+    """
+    if processes is None:
+        processes = current_app.config["IMAGE_WORKER_PROCESSES"] or None
+    return ProcessPoolExecutor(max_workers=processes)
+
+
+def work(poll_interval=None):
+    """
+    Processes uploaded images forever, sleeping for poll_interval seconds
+    whenever there aren't any pending. This is what the image worker process runs.
+    """
+    if poll_interval is None:
+        poll_interval = current_app.config["IMAGE_QUEUE_POLL_INTERVAL"]
+    current_app.logger.info("Image worker started")
+    while True:
+        with image_executor() as executor:
+            try:
+                while True:
+                    if not run_once(executor):
+                        time.sleep(poll_interval)
+            except BrokenProcessPool:
+                # an encoding process died (e.g. out of memory), its batch is
+                # marked failed and the next one gets a new pool
+                current_app.logger.error("The image encoding processes died, starting new ones")
+
+
+@click.command("process-images")
+@with_appcontext
+def process_images_command():
+    """
+    Queues every post image without variants (from before the image pipeline,
+    or that failed) and processes all of them.
+    """
+    queued = BodyImages.query.filter(~BodyImages.variants.any()).update(
+        {BodyImages.status: "pending"}, synchronize_session=False
+    )
+    for post in Posts.query.filter(Posts.header_path != None).all():
+        if post.header_path and not post.header_variants:
+            post.header_status = "pending"
+            queued += 1
+    db.session.commit()
+    click.echo(f"Queued {queued} images")
+    processed = 0
+    with image_executor() as executor:
+        while True:
+            count = run_once(executor)
+            if not count:
+                break
+            processed += count
+    click.echo(f"Processed {processed} images")
@@ -0,0 +1,222 @@
+"""Upload-time image pipeline: resized, recompressed copies of post images for srcset.
+
+Every uploaded image gets a copy at each IMAGE_VARIANT_WIDTHS width (never
+wider than the original) in each IMAGE_VARIANT_FORMATS format plus a fallback
+JPEG/PNG. Copies are saved next to the original as <name>-<width>w.<format>
+and recorded in the ImageVariants table by the image worker (see
+image_queue.py), so none of this happens during a request. EXIF metadata
+(camera, GPS, ...) is dropped from the copies. The original's pixels are left
+as they were uploaded, only its metadata is cut out of the file (JPEG and
+PNG), keeping just its orientation.
+"""
+
+from flask import current_app, Markup
+from markupsafe import escape
+from PIL import Image, ImageOps
+from urllib.parse import quote
+import os
+import zlib
+
+try:
+    # registers the AVIF encoder with Pillow
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pillow_avif = None
+
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+EXTENSIONS = {"avif": "avif", "webp": "webp", "jpeg": "jpg", "png": "png"}
+
+
+def supported_formats(formats):
+    """
+    The formats out of 'formats' that this Pillow install can encode.
+    """
+    # make sure all of Pillow's plugins are registered
+    Image.init()
+    return [f for f in formats if f.upper() in Image.SAVE]
+
+
+def is_animated(img):
+    return getattr(img, "is_animated", False)
+
+
+def fallback_format(img):
+    """
+    Format for browsers that support none of the modern ones: PNG for images
+    with transparency, JPEG for everything else.
+    """
+    if img.mode in ("RGBA", "LA", "P") and (img.mode != "P" or "transparency" in img.info):
+        return "png"
+    return "jpeg"
+
+
+def _save(img, disk_path, fmt, quality):
+    if fmt == "jpeg" and img.mode != "RGB":
+        img = img.convert("RGB")
+    options = {"quality": quality} if fmt in ("jpeg", "webp", "avif") else {"optimize": True}
+    if fmt == "jpeg":
+        options.update(optimize=True, progressive=True)
+    # no exif= argument, so no metadata is written
+    img.save(disk_path, format=fmt.upper(), **options)
+
+
+EXIF_ORIENTATION = 0x0112
+# APP1 (Exif or XMP) and APP13 (Photoshop's IPTC) segments
+JPEG_METADATA = {0xE1, 0xED}
+PNG_METADATA = {b"eXIf", b"tEXt", b"zTXt", b"iTXt", b"tIME"}
+
+
+def _orientation_exif(orientation):
+    """
+    EXIF data holding nothing but the orientation, or b"" if it's the default.
+    """
+    if orientation in (None, 1):
+        return b""
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = orientation
+    return exif.tobytes()
+
+
+def _strip_jpeg(data, orientation):
+    if data[:2] != b"\xff\xd8":
+        return None
+    segments = []
+    pos = 2
+    while True:
+        if pos + 4 > len(data) or data[pos] != 0xFF:
+            # not a JPEG we understand, leave it alone
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte before a marker
+            pos += 1
+            continue
+        if marker == 0xDA:
+            # start of the image data, which runs to the end of the file
+            rest = data[pos:]
+            break
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+        segments.append((marker, data[pos:end]))
+        pos = end
+    kept = [segment for marker, segment in segments if marker not in JPEG_METADATA]
+    exif = _orientation_exif(orientation)
+    if exif:
+        app1 = b"\xff\xe1" + (len(exif) + 2).to_bytes(2, "big") + exif
+        # after the JFIF header, which has to come first
+        at = 1 if segments and segments[0][0] == 0xE0 else 0
+        kept.insert(at, app1)
+    return b"\xff\xd8" + b"".join(kept) + rest
+
+
+def _png_chunk(kind, payload):
+    return len(payload).to_bytes(4, "big") + kind + payload + zlib.crc32(kind + payload).to_bytes(4, "big")
+
+
+def _strip_png(data, orientation):
+    signature = b"\x89PNG\r\n\x1a\n"
+    if not data.startswith(signature):
+        return None
+    chunks = []
+    pos = len(signature)
+    while pos + 8 <= len(data):
+        kind = data[pos + 4:pos + 8]
+        end = pos + 12 + int.from_bytes(data[pos:pos + 4], "big")
+        if kind not in PNG_METADATA:
+            chunks.append(data[pos:end])
+        pos = end
+    exif = _orientation_exif(orientation)
+    if exif:
+        # after IHDR, without the "Exif\0\0" header JPEGs have
+        chunks.insert(1, _png_chunk(b"eXIf", exif[6:]))
+    return signature + b"".join(chunks)
+
+
+def strip_metadata(disk_path, image_format, orientation=1):
+    """
+    Cuts the metadata out of a JPEG or PNG file without re-encoding it, and
+    returns whether the file changed. Only the EXIF orientation is kept.
+    """
+    strip = {"JPEG": _strip_jpeg, "PNG": _strip_png}.get(image_format)
+    if strip is None:
+        return False
+    with open(disk_path, "rb") as f:
+        data = f.read()
+    stripped = strip(data, orientation)
+    if stripped is None or stripped == data:
+        return False
+    temporary = disk_path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(stripped)
+    os.replace(temporary, disk_path)
+    return True
+
+
+def encode_variants(disk_path, widths, formats, quality=80):
+    """
+    Writes the resized and re-encoded copies of the image at disk_path next to
+    it and strips the original's metadata. Returns (width, height, format,
+    disk_path) for each copy. Animated images are left alone.
+    """
+    with Image.open(disk_path) as original:
+        if is_animated(original):
+            return []
+        original_format = original.format
+        orientation = original.getexif().get(EXIF_ORIENTATION)
+        # apply the EXIF orientation before the EXIF data is dropped
+        img = ImageOps.exif_transpose(original)
+        img.load()
+
+    strip_metadata(disk_path, original_format, orientation)
+
+    stem = os.path.splitext(disk_path)[0]
+    targets = sorted({w for w in widths if w < img.width} | {min(img.width, max(widths))})
+    variants = []
+    for width in targets:
+        height = round(img.height * width / img.width)
+        resized = img.resize((width, height), Image.LANCZOS) if width != img.width else img
+        for fmt in supported_formats(formats) + [fallback_format(img)]:
+            variant_path = f"{stem}-{width}w.{EXTENSIONS[fmt]}"
+            _save(resized, variant_path, fmt, quality)
+            variants.append((width, height, fmt, variant_path))
+    return variants
+
+
+def url(path):
+    """
+    The URL of a path relative to the 'application' directory. It's
+    percent-encoded, since a space would split a srcset candidate in two.
+    """
+    return quote(f"/{path}")
+
+
+def srcset(variants):
+    return ", ".join(f"{url(v.path)} {v.width}w" for v in sorted(variants, key=lambda v: v.width))
+
+
+def picture(src, variants=(), alt="", sizes=None):
+    """
+    <picture> markup for an image: one <source> per modern format and an <img>
+    with the fallback format's srcset. Without variants it's a plain lazy <img>.
+    src is a path relative to the 'application' directory.
+    """
+    if sizes is None:
+        sizes = current_app.config["IMAGE_SIZES"]
+    img = f'<img src="{escape(url(src))}" alt="{escape(alt)}" loading="lazy"'
+    if not variants:
+        return Markup(img + ">")
+
+    by_format = {}
+    for variant in variants:
+        by_format.setdefault(variant.format, []).append(variant)
+    html = ["<picture>"]
+    for fmt in ("avif", "webp"):
+        if fmt in by_format:
+            html.append(
+                f'<source type="{MIME_TYPES[fmt]}" srcset="{escape(srcset(by_format[fmt]))}" sizes="{sizes}">'
+            )
+    fallback = by_format.get("jpeg") or by_format.get("png")
+    if fallback:
+        img += f' srcset="{escape(srcset(fallback))}" sizes="{sizes}"'
+    html.append(img + ">")
+    html.append("</picture>")
+    return Markup("".join(html))
@@ -0,0 +1,161 @@
+"""Batched SMTP delivery engine for sending many emails over a few connections.
+
+mail.send() opens a new SMTP connection (SSL handshake and login) for every
+message. The engine instead sends up to MAIL_MAX_PER_CONNECTION messages over
+one mail.connect() session, reconnects if the connection drops, and keeps under
+MAIL_MAX_PER_MINUTE messages a minute.
+"""
+
+from collections import deque, namedtuple
+from flask import current_app
+from flask_mail import BadHeaderError
+import smtplib
+import time
+
+# message: the flask_mail Message
+# sent: whether the SMTP server accepted it
+# error: why it wasn't sent (None if it was)
+DeliveryResult = namedtuple("DeliveryResult", ["message", "sent", "error"])
+
+# errors about one message, the connection can still be used for the next one
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+    smtplib.SMTPNotSupportedError,
+    BadHeaderError,
+    AssertionError,
+    ValueError,
+)
+
+
+class DeliveryEngine(object):
+    """
+    Sends batches of flask_mail Messages over pooled SMTP connections.
+
+    Connection errors (including SMTP errors that aren't about a particular
+    message) close the connection and the message is retried on a new one up
+    to 'retries' times. If a new connection can't be opened the rest of the
+    batch fails with the same error instead of hammering the server.
+    """
+
+    def __init__(
+        self,
+        mail,
+        max_per_connection=50,
+        max_per_minute=0,
+        retries=2,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.mail = mail
+        self.max_per_connection = max_per_connection
+        self.max_per_minute = max_per_minute
+        self.retries = retries
+        self._clock = clock
+        self._sleep = sleep
+        self._sent_times = deque()
+        self.connections_opened = 0
+
+    def send(self, messages, on_result=None):
+        """
+        Sends messages and returns a DeliveryResult for each of them, in order.
+        on_result is called with each DeliveryResult as soon as it's known.
+        """
+        messages = list(messages)
+        results = []
+        for start in range(0, len(messages), self.max_per_connection):
+            batch = messages[start:start + self.max_per_connection]
+            for result in self._send_batch(batch):
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+        return results
+
+    def send_one(self, message):
+        return self.send([message])[0]
+
+    def _send_batch(self, batch):
+        """
+        Sends a batch over one connection, yielding each message's
+        DeliveryResult as soon as it's sent (or has failed).
+        """
+        connection = None
+        try:
+            for i, message in enumerate(batch):
+                attempts = 0
+                while True:
+                    try:
+                        if connection is None:
+                            connection = self._connect()
+                    except (OSError, smtplib.SMTPException) as e:
+                        # the server can't be reached, don't try the rest of the batch
+                        for msg in batch[i:]:
+                            yield DeliveryResult(msg, False, str(e))
+                        return
+                    try:
+                        self._throttle()
+                        connection.send(message)
+                    except MESSAGE_ERRORS as e:
+                        result = DeliveryResult(message, False, str(e))
+                        break
+                    except (OSError, smtplib.SMTPException) as e:
+                        self._close(connection)
+                        connection = None
+                        attempts += 1
+                        if attempts > self.retries:
+                            result = DeliveryResult(message, False, str(e))
+                            break
+                    else:
+                        result = DeliveryResult(message, True, None)
+                        break
+                yield result
+        finally:
+            self._close(connection)
+
+    def _connect(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        self.connections_opened += 1
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        if connection is None:
+            return
+        try:
+            connection.__exit__(None, None, None)
+        except (OSError, smtplib.SMTPException):
+            # the connection is already gone
+            pass
+
+    def _throttle(self):
+        """
+        Waits until sending another message keeps us under max_per_minute.
+        """
+        if not self.max_per_minute:
+            return
+        now = self._clock()
+        while self._sent_times and self._sent_times[0] <= now - 60:
+            self._sent_times.popleft()
+        if len(self._sent_times) >= self.max_per_minute:
+            self._sleep(self._sent_times[0] + 60 - now)
+            self._sent_times.popleft()
+        self._sent_times.append(self._clock())
+
+
+def delivery_engine():
+    """
+    The current app's DeliveryEngine, for its mail settings. It's made once
+    per process, so MAIL_MAX_PER_MINUTE holds across all of a worker's batches.
+    """
+    engine = current_app.extensions.get("delivery_engine")
+    if engine is None:
+        config = current_app.config
+        engine = current_app.extensions["delivery_engine"] = DeliveryEngine(
+            current_app.extensions["mail"],
+            max_per_connection=config["MAIL_MAX_PER_CONNECTION"],
+            max_per_minute=config["MAIL_MAX_PER_MINUTE"],
+            retries=config["MAIL_SEND_RETRIES"],
+        )
+    return engine
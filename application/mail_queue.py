@@ -0,0 +1,233 @@
+"""Database-backed queue for sending emails to subscribers in the background.
+
+admin.send_mail only queues a MailJobs row with one MailDeliveries row per
+subscriber, and blog.subscribe only queues the new subscriber's welcome
+email. The mail worker (worker.py, the 'worker' process in the Procfile)
+claims pending deliveries in batches and sends each batch over pooled SMTP
+connections (see mail_delivery.py). Every delivery is committed as soon as
+it's sent, so a worker that crashes picks up where it left off.
+"""
+
+from flask import current_app, render_template, Markup
+from flask_mail import Message
+from sqlalchemy import literal, or_, and_
+from application.database import db, MailJobs, MailDeliveries, Subscribers
+from application.mail_delivery import DeliveryResult, delivery_engine
+from application.metrics import MAIL_MESSAGES
+import datetime
+import os
+import time
+
+# what filling in a newsletter's html body raises when it has placeholders
+# other than {name} or unbalanced braces
+FORMAT_ERRORS = (KeyError, IndexError, ValueError, AttributeError)
+
+
+def enqueue_newsletter(subject, body_text, body_html):
+    """
+    Queues an email to every current subscriber and returns its MailJobs row.
+    The deliveries are copied from the subscribers table in a single statement.
+    """
+    job = MailJobs(subject, body_text, body_html)
+    db.session.add(job)
+    db.session.flush()
+    subscribers = db.session.query(
+        literal(job.id), Subscribers.id, literal("newsletter"), literal("pending"), literal(0)
+    ).filter(Subscribers.still_subscribed == True)
+    db.session.execute(
+        MailDeliveries.__table__.insert().from_select(
+            ["job_id", "subscriber_id", "kind", "status", "attempts"], subscribers
+        )
+    )
+    db.session.commit()
+    return job
+
+
+def enqueue_welcome(subscriber_id):
+    """
+    Queues the welcome email for a new subscriber. It's added to the session
+    but not committed, so it's saved in the same transaction as the subscriber.
+    """
+    delivery = MailDeliveries(None, subscriber_id, kind="welcome")
+    db.session.add(delivery)
+    return delivery
+
+
+def welcome_message(subscriber):
+    """
+    The email people get when they subscribe.
+    """
+    subject = "Hi, it's Kelly"
+    msg = Message(subject, sender=os.getenv("MAIL_USERNAME"), recipients=[subscriber.email])
+    msg.body = f"Hello {subscriber.first},\nThanks for subscribing!\nBest,\n Kelly"
+    msg.html = render_template("/emails/welcome.html", name=subscriber.first)
+    return msg
+
+
+def newsletter_message(job, subscriber):
+    """
+    The email a subscriber gets for a mail job.
+    """
+    msg = Message(
+        job.subject, sender=os.getenv("MAIL_USERNAME"), recipients=[subscriber.email]
+    )
+    msg.body = f"Hello {subscriber.first},\n{job.body_text}"
+    msg.html = newsletter_html(job.body_html, subscriber.first)
+    return msg
+
+
+def newsletter_html(body_html, name):
+    """
+    A newsletter's html body for a subscriber, {name} is replaced by their
+    first name. Raises one of FORMAT_ERRORS if the body can't be filled in.
+    """
+    return Markup(body_html).format(name=name)
+
+
+def delivery_message(delivery):
+    if delivery.kind == "welcome":
+        return welcome_message(delivery.subscriber)
+    return newsletter_message(delivery.job, delivery.subscriber)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def claim_deliveries(batch_size):
+    """
+    Marks up to batch_size deliveries as 'sending' and returns them. Deliveries
+    that were claimed longer than MAIL_QUEUE_LEASE seconds ago belong to a worker
+    that died, so they can be claimed again, unless they've been attempted
+    MAIL_QUEUE_MAX_ATTEMPTS times already: those are marked 'failed' instead,
+    so a message that kills the worker isn't tried forever. Deliveries waiting
+    to be retried are skipped until their next_attempt_at.
+    """
+    now = _now()
+    stale = now - datetime.timedelta(seconds=current_app.config["MAIL_QUEUE_LEASE"])
+    deliveries = (
+        MailDeliveries.query.filter(
+            or_(
+                and_(
+                    MailDeliveries.status == "pending",
+                    or_(
+                        MailDeliveries.next_attempt_at == None,
+                        MailDeliveries.next_attempt_at <= now,
+                    ),
+                ),
+                and_(
+                    MailDeliveries.status == "sending",
+                    MailDeliveries.claimed_at < stale,
+                ),
+            )
+        )
+        .order_by(MailDeliveries.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    claimed, abandoned = [], []
+    for delivery in deliveries:
+        if (
+            delivery.status == "sending"
+            and delivery.attempts >= current_app.config["MAIL_QUEUE_MAX_ATTEMPTS"]
+        ):
+            current_app.logger.warning("Giving up on delivery %s, its worker died", delivery.id)
+            MAIL_MESSAGES.labels(delivery.kind, "failed").inc()
+            delivery.status = "failed"
+            delivery.error = "The worker sending it died"
+            abandoned.append(delivery)
+            continue
+        delivery.status = "sending"
+        delivery.claimed_at = now
+        delivery.attempts += 1
+        claimed.append(delivery)
+    db.session.commit()
+    if abandoned:
+        finish_jobs({d.job_id for d in abandoned if d.job_id is not None})
+    return claimed
+
+
+def record_result(delivery, result):
+    """
+    Records whether a delivery was sent. Failed deliveries are retried with
+    exponential backoff (MAIL_QUEUE_BACKOFF seconds, then twice that, ...) until
+    they've been attempted MAIL_QUEUE_MAX_ATTEMPTS times.
+    """
+    if result.sent:
+        MAIL_MESSAGES.labels(delivery.kind, "sent").inc()
+        delivery.status = "sent"
+        delivery.sent_at = _now()
+        delivery.error = None
+    else:
+        current_app.logger.warning("Failed to send delivery %s: %s", delivery.id, result.error)
+        delivery.error = result.error
+        if delivery.attempts >= current_app.config["MAIL_QUEUE_MAX_ATTEMPTS"]:
+            MAIL_MESSAGES.labels(delivery.kind, "failed").inc()
+            delivery.status = "failed"
+        else:
+            MAIL_MESSAGES.labels(delivery.kind, "retried").inc()
+            delivery.status = "pending"
+            backoff = current_app.config["MAIL_QUEUE_BACKOFF"] * 2 ** (delivery.attempts - 1)
+            delivery.next_attempt_at = _now() + datetime.timedelta(seconds=backoff)
+    db.session.commit()
+
+
+def finish_jobs(job_ids):
+    """
+    Marks the jobs that don't have any unfinished deliveries left as done.
+    """
+    for job in MailJobs.query.filter(MailJobs.id.in_(job_ids)).all():
+        unfinished = job.deliveries.filter(
+            MailDeliveries.status.in_(["pending", "sending"])
+        ).count()
+        if not unfinished:
+            job.status = "done"
+            job.finished = _now()
+    db.session.commit()
+
+
+def run_once(engine=None, batch_size=None):
+    """
+    Claims and sends one batch of deliveries with 'engine' (the app's
+    DeliveryEngine by default). Returns how many were claimed.
+    """
+    if engine is None:
+        engine = delivery_engine()
+    if batch_size is None:
+        batch_size = current_app.config["MAIL_QUEUE_BATCH_SIZE"]
+    deliveries = claim_deliveries(batch_size)
+    sending, messages = [], []
+    for delivery in deliveries:
+        try:
+            message = delivery_message(delivery)
+        except Exception as e:
+            # e.g. a newsletter body that can't be filled in, it fails like
+            # an unsent message instead of stopping the worker
+            current_app.logger.exception("Couldn't make the email of delivery %s", delivery.id)
+            record_result(delivery, DeliveryResult(None, False, f"{type(e).__name__}: {e}"))
+            continue
+        sending.append(delivery)
+        messages.append(message)
+    # the batch goes out over as few SMTP connections as possible, and since
+    # results come back in order each delivery is committed as soon as it's sent
+    unrecorded = iter(sending)
+    engine.send(
+        messages, on_result=lambda result: record_result(next(unrecorded), result)
+    )
+    finish_jobs({d.job_id for d in deliveries if d.job_id is not None})
+    return len(deliveries)
+
+
+def work(poll_interval=None):
+    """
+    Sends queued mail forever, sleeping for poll_interval seconds whenever
+    the queue is empty. This is what the mail worker process runs.
+    """
+    if poll_interval is None:
+        poll_interval = current_app.config["MAIL_QUEUE_POLL_INTERVAL"]
+    current_app.logger.info("Mail worker started")
+    engine = delivery_engine()
+    while True:
+        if not run_once(engine):
+            time.sleep(poll_interval)
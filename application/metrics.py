@@ -0,0 +1,186 @@
+"""Prometheus metrics, served at /metrics
+
+The metrics are:
+- flask_http_requests_total and flask_http_request_duration_seconds, by endpoint
+- db_pool_open_connections and db_pool_checked_out_connections, the connections
+  each worker's pool has open and has lent out (from pool events)
+- page_cache_requests_total, page cache hits and misses (see cache.py)
+- mail_messages_total, emails sent, failed or retried, by kind (see mail_queue.py)
+- mail_queue_deliveries, queued deliveries by status, read from the database
+  when /metrics is scraped
+- template_precompile_seconds, how long loading every template took when the
+  app started, if TEMPLATE_PRECOMPILE is on (see templating.py)
+
+With several gunicorn workers each one has its own counters. gunicorn.conf.py
+sets prometheus_multiproc_dir so prometheus_client keeps them in memory mapped
+files in that directory, and /metrics adds up the files of every worker. The
+variable has to be set before prometheus_client is imported. Without it the
+metrics are only those of the process that serves /metrics. So the mail
+worker's mail_messages_total only reaches /metrics when the worker shares the
+directory (runs on the same machine). mail_queue_deliveries comes from the
+database, so it's right wherever the worker runs.
+
+/metrics needs an 'Authorization: Bearer <METRICS_TOKEN>' header. Without a
+METRICS_TOKEN it's only served in debug or testing, so the metrics of a
+production app are never public.
+"""
+
+from flask import current_app, request, abort, Response, has_app_context
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client import multiprocess
+from sqlalchemy import event, func
+from sqlalchemy.pool import Pool
+import hmac
+import os
+import time
+
+# the methods that get their own label, the client picks the method so any
+# other one is counted as 'other' instead of adding a series for each
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "CONNECT", "TRACE"))
+
+REQUESTS = Counter(
+    "flask_http_requests_total", "HTTP requests served", ["method", "endpoint", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "flask_http_request_duration_seconds",
+    "Time spent serving HTTP requests",
+    ["endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_POOL_OPEN = Gauge(
+    "db_pool_open_connections", "Database connections open in the pools", multiprocess_mode="livesum"
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Database connections in use", multiprocess_mode="livesum"
+)
+PAGE_CACHE = Counter("page_cache_requests_total", "Page cache lookups", ["result"])
+MAIL_MESSAGES = Counter("mail_messages_total", "Emails sent, given up on or retried", ["kind", "result"])
+TEMPLATE_PRECOMPILE = Gauge(
+    "template_precompile_seconds", "Time taken to load every template at startup", multiprocess_mode="max"
+)
+
+
+class MailQueueCollector(object):
+    """
+    The number of deliveries waiting to be sent or being sent, straight from
+    the database, so it's right whichever dyno the mail worker runs on.
+    """
+
+    def describe(self):
+        return [GaugeMetricFamily("mail_queue_deliveries", "Queued email deliveries", labels=["status"])]
+
+    def collect(self):
+        from application.database import db, MailDeliveries
+        metric = GaugeMetricFamily("mail_queue_deliveries", "Queued email deliveries", labels=["status"])
+        if has_app_context():
+            counts = dict(
+                db.session.query(MailDeliveries.status, func.count(MailDeliveries.id))
+                .filter(MailDeliveries.status.in_(["pending", "sending"]))
+                .group_by(MailDeliveries.status)
+                .all()
+            )
+            for status in ("pending", "sending"):
+                metric.add_metric([status], counts.get(status, 0))
+        yield metric
+
+
+QUEUE_REGISTRY = CollectorRegistry()
+QUEUE_REGISTRY.register(MailQueueCollector())
+
+
+def multiprocess_dir():
+    return os.environ.get("prometheus_multiproc_dir")
+
+
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_POOL_CHECKED_OUT.inc()
+
+
+def _checkin(dbapi_connection, connection_record):
+    DB_POOL_CHECKED_OUT.dec()
+
+
+def _connect(dbapi_connection, connection_record):
+    DB_POOL_OPEN.inc()
+
+
+def _close(dbapi_connection, connection_record):
+    DB_POOL_OPEN.dec()
+
+
+class Metrics(object):
+    """
+    Counts and times every request and serves /metrics, when METRICS is on.
+    """
+
+    _listening = False
+
+    def __init__(self, app=None):
+        # (method, endpoint, status): their request counter and duration histogram
+        self._children = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("METRICS", True)
+        app.config.setdefault("METRICS_TOKEN", None)
+        if not app.config["METRICS"]:
+            return
+        # every pool the process makes, engines are made lazily for each app
+        if not Metrics._listening:
+            event.listen(Pool, "checkout", _checkout)
+            event.listen(Pool, "checkin", _checkin)
+            event.listen(Pool, "connect", _connect)
+            event.listen(Pool, "close", _close)
+            Metrics._listening = True
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        if not app.config["METRICS_TOKEN"] and not (app.debug or app.testing):
+            app.logger.warning("METRICS_TOKEN isn't set, /metrics won't be served")
+            return
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def _start(self):
+        request.environ["metrics.start"] = time.perf_counter()
+
+    def _finish(self, response):
+        # this runs for every request: the request proxy is only looked up
+        # once and the labelled metrics are kept instead of found each time
+        req = request._get_current_object()
+        start = req.environ.get("metrics.start")
+        if start is None:
+            return response
+        method = req.method if req.method in METHODS else "other"
+        key = (method, req.endpoint or "<no endpoint>", response.status_code)
+        children = self._children.get(key)
+        if children is None:
+            children = self._children[key] = (REQUESTS.labels(*key), REQUEST_DURATION.labels(key[1]))
+        children[1].observe(time.perf_counter() - start)
+        children[0].inc()
+        return response
+
+    def metrics_view(self):
+        token = current_app.config["METRICS_TOKEN"]
+        if token:
+            given = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+                abort(401)
+        if multiprocess_dir():
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        output = generate_latest(registry) + generate_latest(QUEUE_REGISTRY)
+        return Response(output, content_type=CONTENT_TYPE_LATEST, headers={"Cache-Control": "no-store"})
+
+
+metrics = Metrics()
@@ -0,0 +1,52 @@
+"""Keyset (cursor) pagination for lists of posts"""
+
+from collections import namedtuple
+from flask import current_app
+from application.database import Posts
+
+# posts: the posts on the page, newest first
+# older: cursor for the page of older posts (None if there isn't one)
+# newer: cursor for the page of newer posts (None if there isn't one)
+Page = namedtuple("Page", ["posts", "older", "newer"])
+
+
+def paginate_posts(query, before=None, after=None, per_page=None):
+    """
+    Returns one page of the posts in a Posts query, newest first.
+
+    Pages are found by seeking on Posts.id instead of using OFFSET, so only the
+    rows of the requested page are read no matter how deep into the archive it is.
+    'before' gets the posts older than the given id, 'after' the posts newer than it.
+    A cursor past either end of the list gets an empty page without links.
+    """
+    if per_page is None:
+        per_page = current_app.config["POSTS_PER_PAGE"]
+
+    if after is not None:
+        # walk up from the cursor, then flip the page back to newest first
+        posts = (
+            query.filter(Posts.id > after)
+            .order_by(Posts.id.asc())
+            .limit(per_page + 1)
+            .all()
+        )
+        has_newer = len(posts) > per_page
+        posts = posts[:per_page][::-1]
+        # the page holds every post newer than the cursor, so the older ones
+        # are the cursor itself and the posts before it
+        has_older = bool(posts) and (
+            query.filter(Posts.id <= after).with_entities(Posts.id).first() is not None
+        )
+    else:
+        if before is not None:
+            query = query.filter(Posts.id < before)
+        posts = query.order_by(Posts.id.desc()).limit(per_page + 1).all()
+        has_older = len(posts) > per_page
+        posts = posts[:per_page]
+        has_newer = before is not None
+
+    if not posts:
+        return Page(posts, None, None)
+    older = posts[-1].id if has_older else None
+    newer = posts[0].id if has_newer else None
+    return Page(posts, older, newer)
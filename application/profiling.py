@@ -0,0 +1,298 @@
+"""Opt-in per-request profiling: SQL, template and mail timings
+
+When PROFILING is on, every request records:
+- how many SQL statements it ran and how long they took, from engine events
+- how long rendering templates took
+- how long sending mail took
+
+The totals are sent back in a Server-Timing header, so they show up in the
+browser's network panel. Requests slower than PROFILING_SLOW_MS are logged
+with every statement they ran. The timings are also added to per-endpoint
+histograms, which logged in admins can see at /admin/profiling. Each worker
+process keeps its own histograms.
+
+Endpoints listed in PROFILING_SAMPLE_ENDPOINTS are also run under a sampling
+profiler. A thread records the request's stack every
+PROFILING_SAMPLE_INTERVAL_MS and adds it to PROFILING_SAMPLE_DIR/<endpoint>.folded
+in the folded format that flamegraph.pl and speedscope read. Only threaded
+workers can be sampled this way, not gevent ones.
+"""
+
+from collections import Counter
+from flask import current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import functools
+import os
+import sys
+import threading
+import time
+
+# upper bounds (ms) of the request duration histogram buckets, the last one catches the rest
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf")]
+
+# statements kept per request for the slow request log
+MAX_LOGGED_STATEMENTS = 100
+
+
+class RequestProfile(object):
+    """
+    What one request spent its time on, in ms.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.statements = []
+        self.render_ms = 0.0
+        self.render_depth = 0
+        self.render_start = None
+        self.mail_ms = 0.0
+        self.sampler = None
+
+    def add_statement(self, statement, ms):
+        self.queries += 1
+        self.db_ms += ms
+        if len(self.statements) < MAX_LOGGED_STATEMENTS:
+            self.statements.append((statement, ms))
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self, total_ms):
+        timings = [
+            f'db;dur={self.db_ms:.2f};desc="{self.queries} queries"',
+            f"render;dur={self.render_ms:.2f}",
+        ]
+        if self.mail_ms:
+            timings.append(f"mail;dur={self.mail_ms:.2f}")
+        timings.append(f"total;dur={total_ms:.2f}")
+        return ", ".join(timings)
+
+
+class RouteStats(object):
+    """
+    Request duration histograms and SQL/template totals for each endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def add(self, endpoint, total_ms, profile):
+        with self._lock:
+            route = self._routes.setdefault(endpoint, dict(
+                count=0, total_ms=0.0, queries=0, db_ms=0.0, render_ms=0.0, mail_ms=0.0,
+                buckets=[0] * len(BUCKETS_MS),
+            ))
+            route["count"] += 1
+            route["total_ms"] += total_ms
+            route["queries"] += profile.queries
+            route["db_ms"] += profile.db_ms
+            route["render_ms"] += profile.render_ms
+            route["mail_ms"] += profile.mail_ms
+            for i, bound in enumerate(BUCKETS_MS):
+                if total_ms <= bound:
+                    route["buckets"][i] += 1
+                    break
+
+    def snapshot(self):
+        """
+        (endpoint, stats) for every endpoint, slowest on average first.
+        """
+        with self._lock:
+            routes = {endpoint: dict(route, buckets=list(route["buckets"])) for endpoint, route in self._routes.items()}
+        return sorted(routes.items(), key=lambda item: -item[1]["total_ms"] / item[1]["count"])
+
+
+class StackSampler(threading.Thread):
+    """
+    Records the stack of another thread every interval seconds, as folded
+    stacks ('outermost;...;innermost') with how many times each was seen.
+    """
+
+    def __init__(self, thread_id, interval):
+        threading.Thread.__init__(self, daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[fold(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+def fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _profile():
+    """
+    The profile of the request being handled, or None.
+    """
+    if has_request_context():
+        return g.get("_profile")
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _profile() is not None:
+        conn.info.setdefault("profiling_starts", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _profile()
+    starts = conn.info.get("profiling_starts")
+    if profile is not None and starts:
+        profile.add_statement(statement, (time.perf_counter() - starts.pop()) * 1000)
+
+
+def _before_render(app, template, context):
+    profile = _profile()
+    if profile is not None:
+        # templates rendered while rendering another are counted once
+        if profile.render_depth == 0:
+            profile.render_start = time.perf_counter()
+        profile.render_depth += 1
+
+
+def _rendered(app, template, context):
+    profile = _profile()
+    if profile is not None and profile.render_depth:
+        profile.render_depth -= 1
+        if profile.render_depth == 0:
+            profile.render_ms += (time.perf_counter() - profile.render_start) * 1000
+
+
+class Profiler(object):
+    """
+    Adds the request hooks, engine events and template signals that fill in
+    each request's RequestProfile, when PROFILING is on.
+    """
+
+    _listening = False
+
+    def __init__(self, app=None):
+        self._folded = {}
+        self._folded_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PROFILING", False)
+        app.config.setdefault("PROFILING_SLOW_MS", 500)
+        app.config.setdefault("PROFILING_SAMPLE_ENDPOINTS", [])
+        app.config.setdefault("PROFILING_SAMPLE_INTERVAL_MS", 5)
+        app.config.setdefault("PROFILING_SAMPLE_DIR", "profiles")
+        app.extensions["profiler"] = RouteStats()
+        if not app.config["PROFILING"]:
+            return
+
+        # engines are made lazily for each app, so every engine is listened to
+        # and statements outside a profiled request are ignored
+        if not Profiler._listening:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            Profiler._listening = True
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_rendered, app)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop_sampler)
+
+    @property
+    def enabled(self):
+        return current_app.config["PROFILING"]
+
+    def stats(self):
+        return current_app.extensions["profiler"].snapshot()
+
+    def instrument(self, obj, name, kind="mail"):
+        """
+        Times calls to obj.name as part of the request's kind time (only
+        'mail' so far). Calls outside a profiled request aren't affected.
+        """
+        method = getattr(obj, name)
+        if getattr(method, "_profiled", False):
+            return
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            profile = _profile()
+            if profile is None:
+                return method(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - start) * 1000
+                setattr(profile, f"{kind}_ms", getattr(profile, f"{kind}_ms") + ms)
+
+        timed._profiled = True
+        setattr(obj, name, timed)
+
+    def _start(self):
+        g._profile = profile = RequestProfile()
+        if request.endpoint in current_app.config["PROFILING_SAMPLE_ENDPOINTS"]:
+            interval = current_app.config["PROFILING_SAMPLE_INTERVAL_MS"] / 1000
+            profile.sampler = StackSampler(threading.get_ident(), interval)
+            profile.sampler.start()
+
+    def _finish(self, response):
+        profile = g.get("_profile")
+        if profile is None:
+            return response
+        total_ms = profile.elapsed_ms()
+        response.headers["Server-Timing"] = profile.server_timing(total_ms)
+        current_app.extensions["profiler"].add(request.endpoint or "<no endpoint>", total_ms, profile)
+        if total_ms > current_app.config["PROFILING_SLOW_MS"]:
+            current_app.logger.warning(
+                "Slow request: %s %s took %.1f ms, %d queries took %.1f ms\n%s",
+                request.method,
+                request.full_path,
+                total_ms,
+                profile.queries,
+                profile.db_ms,
+                "\n".join(f"{ms:9.2f} ms  {' '.join(statement.split())}" for statement, ms in profile.statements),
+            )
+        return response
+
+    def _stop_sampler(self, exc):
+        profile = g.get("_profile")
+        if profile is None or profile.sampler is None:
+            return
+        stacks = profile.sampler.stop()
+        profile.sampler = None
+        self._save_stacks(request.endpoint, stacks)
+
+    def _save_stacks(self, endpoint, stacks):
+        """
+        Adds a request's stacks to everything sampled for the endpoint so far,
+        and rewrites the endpoint's .folded file.
+        """
+        directory = current_app.config["PROFILING_SAMPLE_DIR"]
+        with self._folded_lock:
+            folded = self._folded.setdefault(endpoint, Counter())
+            folded.update(stacks)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{endpoint}.folded")
+            with open(f"{path}.tmp", "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in folded.items())
+            os.replace(f"{path}.tmp", path)
+
+
+profiler = Profiler()
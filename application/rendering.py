@@ -0,0 +1,137 @@
+"""Pre-rendering of post bodies and header images
+
+Post bodies are written as HTML with placeholders for the post's body images,
+like {imgs[0].picture} (the image's <picture> markup) or {imgs[0].img_path}.
+They're rendered once into Posts.rendered_body (and the header image's markup
+into Posts.rendered_header) whenever what they show changes:
+- when a post is created or edited (admin.py)
+- when the image worker has made a post's image variants (image_queue.py)
+- by 'flask render-posts', for every post or only those never rendered
+
+So viewing a post is a single row fetch. Bodies were written for str.format,
+so {{ and }} still stand for a literal { and }. Only the placeholders and the
+doubled braces are replaced, any other { or } in a body is left as it is.
+"""
+
+from flask import current_app, escape, Markup
+from flask.cli import with_appcontext
+from sqlalchemy.orm import selectinload
+from application.database import db, Posts, BodyImages
+from application.cache import page_cache, post_tag
+from application.images import picture
+import click
+import datetime
+import re
+
+# a doubled brace, or a placeholder
+PLACEHOLDER = re.compile(r"\{\{|\}\}|\{imgs\[(\d+)\]\.(picture|img_path)\}")
+
+# posts rendered per transaction by 'flask render-posts'
+RENDER_BATCH_SIZE = 100
+
+
+def image_markup(image, attribute):
+    if attribute == "picture":
+        return image.picture
+    return escape(image.img_path)
+
+
+def render_body(post):
+    """
+    The post's body with its image placeholders replaced and its doubled
+    braces undoubled, like str.format. Placeholders for images the post
+    doesn't have are left in and logged.
+    """
+    images = post.images
+
+    def replace(match):
+        if match.group(1) is None:
+            return match.group(0)[0]
+        index = int(match.group(1))
+        if index >= len(images):
+            current_app.logger.warning("Post %s has no image %s for %s", post.id, index, match.group(0))
+            return match.group(0)
+        return image_markup(images[index], match.group(2))
+
+    return PLACEHOLDER.sub(replace, post.body or "")
+
+
+def render_header(post):
+    """
+    The header image's markup, empty if the post has a video or no header image.
+    """
+    if post.youtube_vid or not post.header_path:
+        return ""
+    return picture(post.header_path, post.ready_header_variants, alt=post.h1)
+
+
+def render_post(post):
+    """
+    Renders the post into its rendered_body and rendered_header columns and
+    returns whether either of them changed.
+    """
+    rendered = (render_body(post), str(render_header(post)))
+    changed = rendered != (post.rendered_body, post.rendered_header)
+    post.rendered_body, post.rendered_header = rendered
+    return changed
+
+
+def post_html(post):
+    """
+    The (header, body) markup of a post for its page. Posts that were never
+    rendered are rendered now, but not saved.
+    """
+    if post.rendered_body is None:
+        return Markup(render_header(post)), Markup(render_body(post))
+    return Markup(post.rendered_header or ""), Markup(post.rendered_body)
+
+
+def with_render_data(query):
+    """
+    Eager loads everything render_post needs for a Posts query.
+    """
+    return query.options(
+        selectinload(Posts.images).selectinload(BodyImages.variants),
+        selectinload(Posts.header_variants),
+    )
+
+
+def render_posts(query):
+    """
+    Renders the posts a query returns, RENDER_BATCH_SIZE at a time, and
+    returns how many of them changed. Changed posts get a new updated time (so
+    their ETags change) and their cached pages are dropped.
+    """
+    changed_ids = []
+    last_id = 0
+    while True:
+        posts = (
+            with_render_data(query.filter(Posts.id > last_id))
+            .order_by(Posts.id)
+            .limit(RENDER_BATCH_SIZE)
+            .all()
+        )
+        if not posts:
+            break
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for post in posts:
+            if render_post(post):
+                post.updated = now
+                changed_ids.append(post.id)
+        db.session.commit()
+        last_id = posts[-1].id
+    page_cache.invalidate(*[post_tag(post_id) for post_id in changed_ids])
+    return len(changed_ids)
+
+
+@click.command("render-posts")
+@click.option("--missing", is_flag=True, help="Only render posts that have never been rendered.")
+@with_appcontext
+def render_posts_command(missing):
+    """
+    Re-renders the bodies and header images of every post.
+    """
+    query = Posts.query
+    if missing:
+        query = query.filter(Posts.rendered_body == None)
+    click.echo(f"Rendered {render_posts(query)} changed posts")
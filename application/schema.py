@@ -0,0 +1,93 @@
+"""Checks that the database schema is at the latest migration
+
+The schema is only changed by Flask-Migrate ('flask db upgrade', which Heroku
+runs in the release phase before new dynos start), so the app doesn't create
+tables when it starts. Instead the first request each process serves compares
+the database's alembic_version with the newest migration in migrations/versions
+and logs an error if they differ. The result is kept for the life of the
+process, so every other request (and every other app created for the same
+database) skips the check.
+"""
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from application.database import db
+import functools
+import glob
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations", "versions")
+
+REVISION = re.compile(r"^revision = ['\"](\w+)['\"]", re.MULTILINE)
+DOWN_REVISION = re.compile(r"^down_revision = (.*)$", re.MULTILINE)
+
+# database url: the problem with its schema (None if it's up to date)
+_checked = {}
+
+
+@functools.lru_cache(maxsize=None)
+def head_revisions(directory=MIGRATIONS_DIR):
+    """
+    The revisions no other migration is based on. The migration files are read
+    as text, which is much quicker than importing alembic to load them.
+    """
+    revisions, parents = set(), set()
+    for path in glob.glob(os.path.join(directory, "*.py")):
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        revision = REVISION.search(source)
+        if revision is None:
+            continue
+        revisions.add(revision.group(1))
+        down_revision = DOWN_REVISION.search(source)
+        if down_revision is not None:
+            parents.update(re.findall(r"['\"](\w+)['\"]", down_revision.group(1)))
+    return frozenset(revisions - parents)
+
+
+def current_revisions():
+    """
+    The revisions the database has been migrated to (empty if it never has been).
+    """
+    try:
+        rows = db.session.execute(text("SELECT version_num FROM alembic_version")).fetchall()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return frozenset()
+    return frozenset(row[0] for row in rows)
+
+
+def schema_problem():
+    """
+    Why the database's schema doesn't match the code, or None if it does.
+    """
+    current, heads = current_revisions(), head_revisions()
+    if current == heads:
+        return None
+    if not current:
+        return "the database has never been migrated, run 'flask db upgrade'"
+    return (
+        f"the database is at revision {', '.join(sorted(current))} but the newest "
+        f"migration is {', '.join(sorted(heads))}, run 'flask db upgrade'"
+    )
+
+
+def check_schema():
+    """
+    Logs an error if the database isn't at the newest migration. Only the
+    first call for each database does any work.
+    """
+    url = str(db.engine.url)
+    if url not in _checked:
+        _checked[url] = schema_problem()
+    problem = _checked[url]
+    if problem is not None:
+        current_app.logger.error("Database schema is out of date: %s", problem)
+    return problem
+
+
+def init_app(app):
+    if app.config["SCHEMA_CHECK"]:
+        app.before_first_request(check_schema)
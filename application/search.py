@@ -0,0 +1,166 @@
+"""Full-text search over the posts
+
+On Postgres, posts.search_vector is a generated tsvector of the title, sample
+and body (weighted in that order) with a GIN index on it, so a search is an
+index lookup ranked by ts_rank_cd with snippets from ts_headline. SQLite (used
+in development/testing) has neither, so there the posts are searched with an
+inverted index kept in memory, which is rebuilt whenever the posts change.
+"""
+
+from collections import defaultdict, namedtuple
+from flask import current_app, Markup
+from markupsafe import escape
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import defer
+from application.database import db, Posts
+import html
+import re
+
+# snippet: Markup of the part of the post that matched, with the terms in <mark>s
+SearchResult = namedtuple("SearchResult", ["post", "snippet"])
+# page: the page number (from 1), has_next: whether there's a page after it
+SearchPage = namedtuple("SearchPage", ["results", "page", "has_next"])
+
+# options for ts_headline, the in-Python snippets are made to look the same
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=15, MaxFragments=2"
+SNIPPET_WORDS = 30
+
+# same weights ts_rank_cd gives the A (title), B (sample) and C (body) labels
+FIELD_WEIGHTS = {"h1": 1.0, "sample": 0.4, "body": 0.2}
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such "
+    "that the their then there these they this to was will with i my me".split()
+)
+
+TAG = re.compile(r"<[^>]+>")
+WORD = re.compile(r"\w+")
+
+
+def plain_text(body):
+    """
+    The text of a post body without its html tags and entities.
+    """
+    return html.unescape(TAG.sub(" ", body or ""))
+
+
+def terms(text):
+    return [word for word in WORD.findall(text.lower()) if word not in STOP_WORDS]
+
+
+def search_posts(query, page=1, per_page=None):
+    """
+    The page of posts matching the search query, best matches first.
+    """
+    if per_page is None:
+        per_page = current_app.config["POSTS_PER_PAGE"]
+    page = max(page, 1)
+    if not terms(query):
+        return SearchPage([], page, False)
+    if db.session.get_bind().dialect.name == "postgresql":
+        results = _search_postgres(query, (page - 1) * per_page, per_page + 1)
+    else:
+        results = _search_index(query, (page - 1) * per_page, per_page + 1)
+    return SearchPage(results[:per_page], page, len(results) > per_page)
+
+
+def _search_postgres(query, offset, limit):
+    vector = literal_column("posts.search_vector")
+    tsquery = func.websearch_to_tsquery("english", query)
+    rank = func.ts_rank_cd(vector, tsquery)
+    snippet = func.ts_headline(
+        "english",
+        func.regexp_replace(Posts.body, "<[^>]+>", " ", "g"),
+        tsquery,
+        HEADLINE_OPTIONS,
+    )
+    rows = (
+        db.session.query(Posts, snippet)
+        # only the snippet needs the body, and Postgres makes it from the page of results alone
+        .options(defer(Posts.body))
+        .filter(vector.op("@@")(tsquery))
+        .order_by(rank.desc(), Posts.id.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    # ts_headline's output is the post's own (already trusted) html-stripped text
+    return [SearchResult(post, Markup(headline)) for post, headline in rows]
+
+
+class InvertedIndex(object):
+    """
+    Maps every term in the posts to the posts it's in and how well it scores
+    there, the same way the tsvector column is weighted.
+    """
+
+    def __init__(self, posts):
+        self.postings = defaultdict(lambda: defaultdict(float))
+        self.texts = {}
+        for post in posts:
+            text = plain_text(post.body)
+            self.texts[post.id] = text
+            for field, weight in FIELD_WEIGHTS.items():
+                value = text if field == "body" else getattr(post, field) or ""
+                for term in terms(value):
+                    self.postings[term][post.id] += weight
+
+    def search(self, query):
+        """
+        The ids of the posts that have every term of the query, best first.
+        """
+        query_terms = set(terms(query))
+        scores = None
+        for term in query_terms:
+            matches = self.postings.get(term, {})
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {id: score + matches[id] for id, score in scores.items() if id in matches}
+        return sorted(scores or {}, key=lambda id: (-scores[id], -id))
+
+    def snippet(self, post_id, query):
+        return highlight(self.texts[post_id], set(terms(query)))
+
+
+def highlight(text, query_terms, words=SNIPPET_WORDS):
+    """
+    Markup of about 'words' words of text around the first term that matched,
+    with the terms in <mark>s.
+    """
+    matches = list(WORD.finditer(text))
+    hits = [i for i, match in enumerate(matches) if match.group().lower() in query_terms]
+    start = max(hits[0] - words // 3, 0) if hits else 0
+    window = matches[start:start + words]
+    if not window:
+        return Markup("")
+    parts = []
+    position = window[0].start()
+    for match in window:
+        parts.append(escape(text[position:match.start()]))
+        word = escape(match.group())
+        if match.group().lower() in query_terms:
+            word = Markup("<mark>%s</mark>") % word
+        parts.append(word)
+        position = match.end()
+    return Markup(" ".join(Markup("").join(parts).split()))
+
+
+def search_index():
+    """
+    The inverted index of the current posts. It's kept on the app and only
+    rebuilt when a post has been added, edited or deleted since it was built.
+    """
+    version = tuple(db.session.query(func.count(Posts.id), func.max(Posts.updated)).one())
+    cached = current_app.extensions.get("search_index")
+    if cached is None or cached[0] != version:
+        cached = (version, InvertedIndex(Posts.query.all()))
+        current_app.extensions["search_index"] = cached
+    return cached[1]
+
+
+def _search_index(query, offset, limit):
+    index = search_index()
+    ids = index.search(query)[offset:offset + limit]
+    posts = {post.id: post for post in Posts.query.filter(Posts.id.in_(ids)).all()} if ids else {}
+    return [SearchResult(posts[id], index.snippet(id, query)) for id in ids if id in posts]
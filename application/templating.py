@@ -0,0 +1,79 @@
+"""Jinja bytecode cache and template precompilation
+
+Jinja compiles a template to Python code the first time it's used, in every
+worker. With TEMPLATE_BYTECODE_CACHE on the compiled code is kept in
+TEMPLATE_CACHE_DIR, so a worker only has to load it, and only the first
+worker after a template changes compiles it (Jinja checks the source's
+checksum and its own version before using a cached template).
+
+With TEMPLATE_PRECOMPILE on, create_app loads every template in the templates
+tree, so no request pays for it. With gunicorn's preload_app that's done once
+in the master and the workers share it. 'flask compile-templates' fills the
+bytecode cache ahead of time, e.g. while building a deploy.
+
+How long loading every template took is logged and reported as
+template_precompile_seconds (see metrics.py).
+"""
+
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+from application.metrics import TEMPLATE_PRECOMPILE
+import click
+import os
+import tempfile
+import time
+
+
+def precompile(app):
+    """
+    Loads every template of an app and returns how many there are and how
+    many seconds loading them took.
+    """
+    start = time.perf_counter()
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    seconds = time.perf_counter() - start
+    TEMPLATE_PRECOMPILE.set(seconds)
+    app.extensions["templates"] = dict(count=len(names), precompile_seconds=seconds)
+    return len(names), seconds
+
+
+class Templates(object):
+    """
+    Sets up the bytecode cache and precompiles the templates if they're turned on.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("TEMPLATE_BYTECODE_CACHE", True)
+        app.config.setdefault(
+            "TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "personal_website_templates")
+        )
+        app.config.setdefault("TEMPLATE_PRECOMPILE", False)
+        if app.config["TEMPLATE_BYTECODE_CACHE"]:
+            os.makedirs(app.config["TEMPLATE_CACHE_DIR"], exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["TEMPLATE_CACHE_DIR"])
+        if app.config["TEMPLATE_PRECOMPILE"]:
+            count, seconds = precompile(app)
+            app.logger.info("Loaded %s templates in %.1f ms", count, seconds * 1000)
+
+
+templates = Templates()
+
+
+@click.command("compile-templates")
+@with_appcontext
+def compile_templates_command():
+    """
+    Compiles every template into the bytecode cache.
+    """
+    app = current_app._get_current_object()
+    if app.jinja_env.bytecode_cache is None:
+        raise click.ClickException("TEMPLATE_BYTECODE_CACHE is off, there's nowhere to save them")
+    count, seconds = precompile(app)
+    click.echo(f"Compiled {count} templates into {app.config['TEMPLATE_CACHE_DIR']} in {seconds * 1000:.1f} ms")
@@ -0,0 +1,173 @@
+"""Streaming file uploads with per-file and per-request size limits
+
+Werkzeug parses multipart bodies in 64 KiB chunks. The app's request class
+(UploadRequest) has every file part written straight to a temporary file in
+UPLOAD_TMP_DIR, hashing it and counting its size as it goes, so memory use
+doesn't grow with the size of the uploads. The limits are:
+- UPLOAD_MAX_FILE_SIZE, for each file, checked while the file is streamed
+- UPLOAD_MAX_REQUEST_SIZE, for the whole request, only in views decorated
+  with allow_uploads (the admin's create and edit). Every other request is
+  held to Flask's much smaller MAX_CONTENT_LENGTH.
+- UPLOAD_MAX_FORM_MEMORY, for the fields that aren't files (e.g. a post's body)
+Going over any of them is a 413.
+
+save_upload moves an upload's temporary file into place instead of copying it.
+Uploads that aren't saved are deleted at the end of the request.
+"""
+
+from flask import current_app, request, Request
+from werkzeug.exceptions import RequestEntityTooLarge
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+class UploadedFile(object):
+    """
+    The temporary file an uploaded file is streamed to, with the upload's
+    size and SHA-256 hash. It's read like any other file once it's uploaded.
+    """
+
+    _file = None
+    path = None
+
+    def __init__(self, filename, max_size, directory=None):
+        self.filename = filename
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix=".upload")
+        self._file = os.fdopen(fd, "w+b")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge(f"{self.filename} is over the {self.max_size} byte limit for one file.")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def move_to(self, destination):
+        """
+        Moves the upload to its destination, by renaming it when they're on the same filesystem.
+        """
+        self._file.flush()
+        try:
+            os.replace(self.path, destination)
+        except OSError:
+            self._file.seek(0)
+            with open(destination, "wb") as f:
+                shutil.copyfileobj(self._file, f)
+            os.remove(self.path)
+        self.path = None
+
+    def close(self):
+        self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __getattr__(self, name):
+        # read, seek, tell, ... of the temporary file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    """
+    Flask's request, with file uploads streamed to UploadedFiles. Its
+    max_content_length can be raised for a view before the body is read.
+    """
+
+    @property
+    def max_content_length(self):
+        if "_max_content_length" in self.__dict__:
+            return self.__dict__["_max_content_length"]
+        return Request.max_content_length.fget(self)
+
+    @max_content_length.setter
+    def max_content_length(self, value):
+        self.__dict__["_max_content_length"] = value
+
+    @property
+    def max_form_memory_size(self):
+        return current_app.config["UPLOAD_MAX_FORM_MEMORY"]
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        upload = UploadedFile(filename, config["UPLOAD_MAX_FILE_SIZE"], config["UPLOAD_TMP_DIR"])
+        # kept, so that uploads are removed even if parsing the body stopped half way through
+        self.__dict__.setdefault("_uploads", []).append(upload)
+        return upload
+
+    def close(self):
+        Request.close(self)
+        for upload in self.__dict__.get("_uploads", ()):
+            upload.close()
+
+
+def allow_uploads(view):
+    """
+    Lets a view's requests be up to UPLOAD_MAX_REQUEST_SIZE instead of
+    MAX_CONTENT_LENGTH. Put it under login_required, so only logged in
+    requests get the higher limit.
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        request.max_content_length = current_app.config["UPLOAD_MAX_REQUEST_SIZE"]
+        return view(**kwargs)
+
+    return wrapped_view
+
+
+def save_upload(file, destination):
+    """
+    Saves an uploaded FileStorage to a path, moving it there when it was
+    streamed to an UploadedFile. Returns its SHA-256 hash.
+    """
+    stream = file.stream
+    if isinstance(stream, UploadedFile):
+        stream.move_to(destination)
+        digest = stream.hexdigest()
+        size = stream.size
+    else:
+        file.save(destination)
+        hash = hashlib.sha256()
+        with open(destination, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                hash.update(chunk)
+        digest = hash.hexdigest()
+        size = os.path.getsize(destination)
+    current_app.logger.info("Saved upload %s (%s bytes, sha256 %s)", destination, size, digest)
+    return digest
+
+
+class Uploads(object):
+    """
+    Makes the app's requests stream their uploads (see UploadRequest).
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("UPLOAD_MAX_FILE_SIZE", 16 * 1024 * 1024)
+        app.config.setdefault("UPLOAD_MAX_REQUEST_SIZE", 64 * 1024 * 1024)
+        app.config.setdefault("UPLOAD_MAX_FORM_MEMORY", 4 * 1024 * 1024)
+        app.config.setdefault("UPLOAD_TMP_DIR", None)
+        if app.config["UPLOAD_TMP_DIR"]:
+            os.makedirs(app.config["UPLOAD_TMP_DIR"], exist_ok=True)
+        app.request_class = UploadRequest
+
+
+uploads = Uploads()
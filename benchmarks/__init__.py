@@ -0,0 +1 @@
+"""Benchmarks for the blog, run with python -m benchmarks.<name> from the top level directory"""
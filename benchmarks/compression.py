@@ -0,0 +1,164 @@
+"""Bytes on the wire and CPU cost of compressing the blog's pages
+
+Fills a fresh database with benchmarks/dataset.py, then for each route
+compares the uncompressed, gzip and brotli sizes of its response and the CPU
+time it takes to compress it at the configured levels. It also times whole
+requests for each encoding, once with the page cache off, so every request
+compresses, and once with it on, so a page is only compressed once.
+
+    python -m benchmarks.compression --repeat 50
+    python -m benchmarks.compression --gzip-level 9 --brotli-quality 11
+
+BENCH_DATABASE_URL is dropped and recreated, never point it at real data. A
+temporary SQLite database is used when it isn't set.
+"""
+
+from application import create_app
+from application.compression import available_encodings, compress
+from application.database import db, Posts
+from benchmarks import dataset
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+def bench_app(url, page_cache, gzip_level, brotli_quality):
+    config = {
+        "SQLALCHEMY_DATABASE_URI": url,
+        "SCHEMA_CHECK": False,
+        "SITE_URL": "http://localhost",
+        "PAGE_CACHE_TYPE": "lru" if page_cache else "null",
+        "COMPRESSION_MIN_SIZE": 0,
+        "COMPRESSION_GZIP_LEVEL": gzip_level,
+        "COMPRESSION_BROTLI_QUALITY": brotli_quality,
+    }
+    return create_app(config)
+
+
+def routes(app):
+    with app.app_context():
+        post = Posts.query.order_by(Posts.id).offset(Posts.query.count() // 2).first()
+    return {
+        "blog.index": "/",
+        "blog.view_post": f"/post/{post.slug}",
+        "blog.post_layout": "/code",
+        "blog.rss": "/rss",
+        "blog.atom": "/atom",
+        "blog.json_feed": "/feed.json",
+    }
+
+
+def cpu_ms(app, data, encoding, repeat):
+    """
+    The median CPU time (ms) of compressing data with an encoding.
+    """
+    times = []
+    with app.app_context():
+        for _ in range(repeat):
+            start = time.process_time()
+            compress(data, encoding)
+            times.append((time.process_time() - start) * 1000)
+    return statistics.median(times)
+
+
+def request_ms(client, path, encoding, repeat):
+    """
+    The median wall time (ms) of requesting a page with an Accept-Encoding.
+    """
+    headers = {"Accept-Encoding": encoding} if encoding else {}
+    client.get(path, headers=headers)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(path, headers=headers)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def measure(url, args):
+    encodings = available_encodings()
+    uncached = bench_app(url, False, args.gzip_level, args.brotli_quality)
+    cached = bench_app(url, True, args.gzip_level, args.brotli_quality)
+    results = {}
+    for name, path in routes(uncached).items():
+        print(f"Measuring {name}...", file=sys.stderr)
+        data = uncached.test_client().get(path).data
+        result = dict(identity_bytes=len(data))
+        for encoding in encodings:
+            response = uncached.test_client().get(path, headers={"Accept-Encoding": encoding})
+            result[f"{encoding}_bytes"] = len(response.data)
+            result[f"{encoding}_cpu_ms"] = cpu_ms(uncached, data, encoding, args.repeat)
+        for label, app in (("uncached", uncached), ("cached", cached)):
+            client = app.test_client()
+            for encoding in [None] + encodings:
+                result[f"{encoding or 'identity'}_request_ms_{label}"] = request_ms(
+                    client, path, encoding, args.repeat
+                )
+        results[name] = result
+    return results
+
+
+def print_report(results):
+    encodings = available_encodings()
+    header = f"{'route':18} {'identity':>9}"
+    for encoding in encodings:
+        header += f" {encoding + ' bytes':>11} {'ratio':>6} {encoding + ' cpu ms':>11}"
+    print(header)
+    for name, result in results.items():
+        line = f"{name:18} {result['identity_bytes']:9d}"
+        for encoding in encodings:
+            size = result[f"{encoding}_bytes"]
+            line += f" {size:11d} {size / result['identity_bytes']:6.2f} {result[f'{encoding}_cpu_ms']:11.3f}"
+        print(line)
+
+    print()
+    header = f"{'request ms':18}"
+    for encoding in ["identity"] + encodings:
+        header += f" {encoding + ' uncached':>16} {encoding + ' cached':>14}"
+    print(header)
+    for name, result in results.items():
+        line = f"{name:18}"
+        for encoding in ["identity"] + encodings:
+            line += f" {result[f'{encoding}_request_ms_uncached']:16.2f} {result[f'{encoding}_request_ms_cached']:14.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--images-per-post", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=30, help="timings per measurement")
+    parser.add_argument("--gzip-level", type=int, default=6)
+    parser.add_argument("--brotli-quality", type=int, default=5)
+    parser.add_argument("--output", help="where to save the JSON report")
+    args = parser.parse_args()
+
+    url = os.getenv("BENCH_DATABASE_URL")
+    temporary = None
+    if not url:
+        temporary = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(temporary.name, 'bench.db')}"
+    try:
+        app = bench_app(url, False, args.gzip_level, args.brotli_quality)
+        with app.app_context():
+            print(f"Seeding {args.posts} posts...", file=sys.stderr)
+            db.drop_all()
+            db.create_all()
+            dataset.generate(args.posts, 0, args.images_per_post)
+        results = measure(url, args)
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(settings=vars(args), routes=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Generates posts, body images and subscribers to benchmark against
+
+The posts look like the staging app's (tests/staging-app/staging-app-data.py):
+every third one is in 'code' and the rest in 'other'. Each post has
+images_per_post body images that are ready, with a webp variant for every
+IMAGE_VARIANT_WIDTHS width, and a body that uses them, so post pages render
+<picture> markup like the real ones do, and they're pre-rendered like posts
+saved by the admin pages are. One in ten subscribers has unsubscribed.
+The data is the same every time for the same arguments.
+
+Must be called within an app context.
+"""
+
+from application.database import db, Posts, BodyImages, ImageVariants, Subscribers
+from application.rendering import render_posts
+from flask import current_app
+import datetime
+import random
+
+WORDS = [
+    "pandas", "flask", "climbing", "postgres", "backpacking", "python", "travel", "sql",
+    "notes", "week", "learning", "trail", "query", "index", "camera", "mountain",
+]
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def post_body(rng, images):
+    paragraphs = [f"<p>{' '.join(sentence(rng) for _ in range(6))}</p>" for _ in range(4)]
+    for n in range(images):
+        paragraphs.insert(1 + n, f"{{imgs[{n}].picture}}")
+    paragraphs.insert(2, "<h2>My Learning Process</h2>")
+    return "\n\n".join(paragraphs)
+
+
+def generate(posts=200, subscribers=1000, images_per_post=2, seed=0):
+    """
+    Adds the posts, their images and the subscribers, and commits.
+    """
+    rng = random.Random(seed)
+    widths = current_app.config["IMAGE_VARIANT_WIDTHS"]
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=posts)
+
+    for i in range(posts):
+        h1 = f"Post {i} about {rng.choice(WORDS)} and {rng.choice(WORDS)}"
+        post = Posts(
+            h1,
+            sentence(rng, 20),
+            "",
+            "",
+            post_body(rng, images_per_post),
+            "code" if i % 3 == 0 else "other",
+        )
+        post.date = post.updated = start + datetime.timedelta(hours=i)
+        db.session.add(post)
+        db.session.flush()
+        for n in range(images_per_post):
+            image = BodyImages(post.id, f"static/post_imgs/{post.id}/{n}.jpg")
+            image.status = "ready"
+            db.session.add(image)
+            db.session.flush()
+            db.session.add_all(
+                ImageVariants(
+                    post.id, image.id, image.img_path, width, width * 2 // 3, "webp",
+                    f"static/post_imgs/{post.id}/{n}-{width}.webp",
+                )
+                for width in widths
+            )
+    db.session.commit()
+    render_posts(Posts.query.filter(Posts.rendered_body == None))
+
+    for i in range(subscribers):
+        subscriber = Subscribers(f"First{i}", f"Last{i}", f"subscriber{i}@example.com")
+        if i % 10 == 9:
+            subscriber.still_subscribed = False
+            subscriber.date_unsubscribed = datetime.date.today()
+        db.session.add(subscriber)
+    db.session.commit()
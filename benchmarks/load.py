@@ -0,0 +1,144 @@
+"""Throughput and latency of the web dyno under each gunicorn profile
+
+For each profile it starts gunicorn with gunicorn.conf.py, as the Procfile does,
+and sets GUNICORN_PROFILE. It warms the server up and then keeps --clients
+connections busy for --seconds, requesting --path in a loop. The app is
+configured by the environment as usual, so DATABASE_URL should point at a
+migrated database with some posts in it. Any other setting, such as
+WEB_CONCURRENCY, GUNICORN_THREADS or DATABASE_MAX_CONNECTIONS, is passed
+through to every profile.
+
+    python -m benchmarks.load --profiles sync gthread --clients 32 --seconds 20
+
+Profiles that can't start are skipped: gevent needs the gevent and psycogreen
+packages.
+"""
+
+from application.concurrency import PROFILES
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(profile, port):
+    env = dict(os.environ, GUNICORN_PROFILE=profile)
+    env.pop("FLASK_RUN_FROM_CLI", None)
+    command = [
+        "gunicorn", "-c", "gunicorn.conf.py",
+        "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "wsgi:app",
+    ]
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+
+def wait_until_up(server, port, path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", path)
+            connection.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def client(port, path, stop_at, latencies, errors):
+    """
+    Requests path over one keep-alive connection until stop_at.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        if response.status >= 500:
+            errors.append(1)
+        else:
+            latencies.append((time.perf_counter() - start) * 1000)
+    connection.close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def load(port, path, clients, seconds):
+    latencies, errors = [], []
+    stop_at = time.monotonic() + seconds
+    threads = [
+        threading.Thread(target=client, args=(port, path, stop_at, latencies, errors))
+        for _ in range(clients)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    return dict(
+        requests_per_second=len(latencies) / elapsed,
+        p50_ms=statistics.median(latencies) if latencies else float("nan"),
+        p99_ms=percentile(latencies, 0.99) if latencies else float("nan"),
+        errors=len(errors),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent connections")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for profile in args.profiles:
+        port = free_port()
+        server = start_server(profile, port)
+        try:
+            if not wait_until_up(server, port, args.path):
+                print(f"{profile}: gunicorn didn't start, skipping", file=sys.stderr)
+                continue
+            print(f"Loading the {profile} profile...", file=sys.stderr)
+            load(port, args.path, args.clients, args.warmup)
+            results[profile] = load(port, args.path, args.clients, args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'profile':10} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    for profile, result in results.items():
+        print(
+            f"{profile:10} {result['requests_per_second']:9.1f} {result['p50_ms']:9.1f} "
+            f"{result['p99_ms']:9.1f} {result['errors']:7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""What the Prometheus metrics add to every request
+
+Times a route that does nothing, called straight through the WSGI app so the
+test client's overhead doesn't hide the difference. It's timed with the
+metrics' request hooks and without them, taking turns in the same process so
+that noise affects both alike. That's done once with the metrics kept in
+memory and once with them kept in files, as gunicorn.conf.py sets them up. Each
+mode runs in a new process because prometheus_client picks its mode when it's
+imported.
+
+    python -m benchmarks.metrics_overhead --requests 20000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+from application import create_app
+from werkzeug.test import EnvironBuilder
+
+requests, repeat = int(sys.argv[1]), int(sys.argv[2])
+app = create_app({
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+    "SCHEMA_CHECK": False,
+    "PAGE_CACHE_TYPE": "null",
+    "METRICS": True,
+})
+app.add_url_rule("/bench-noop", "bench_noop", lambda: "ok")
+environ = EnvironBuilder(path="/bench-noop").get_environ()
+hooks = {"on": (app.before_request_funcs, app.after_request_funcs), "off": ({}, {})}
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+def run(metrics):
+    app.before_request_funcs, app.after_request_funcs = hooks[metrics]
+    start = time.perf_counter()
+    for _ in range(requests):
+        for _ in app.wsgi_app(dict(environ), start_response):
+            pass
+    return (time.perf_counter() - start) / requests * 1e6
+
+run("on")
+runs = {"on": [], "off": []}
+for _ in range(repeat):
+    for metrics in runs:
+        runs[metrics].append(run(metrics))
+print(json.dumps({metrics: min(times) for metrics, times in runs.items()}))
+"""
+
+MODES = ["single process", "multiprocess"]
+
+
+def time_mode(mode, requests, repeat):
+    """
+    The best mean µs per request with the metrics on and off.
+    """
+    env = dict(os.environ)
+    env.pop("prometheus_multiproc_dir", None)
+    with tempfile.TemporaryDirectory() as directory:
+        if mode == "multiprocess":
+            env["prometheus_multiproc_dir"] = directory
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD, str(requests), str(repeat)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'mode':16} {'off (µs)':>9} {'on (µs)':>9} {'overhead (µs)':>14}")
+    for mode in MODES:
+        timings = time_mode(mode, args.requests, args.repeat)
+        print(f"{mode:16} {timings['off']:9.1f} {timings['on']:9.1f} {timings['on'] - timings['off']:14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""EXPLAIN ANALYZE timings of the app's queries without and with its indexes
+
+Seeds a Postgres database with --posts posts (two body images each) and
+--subscribers subscribers (one in ten unsubscribed), then runs every blog and
+admin route (and the mail worker's claim) with a test client, records the SQL
+each of them runs and times it with EXPLAIN ANALYZE. That's done once with the
+secondary indexes dropped and once with them in place.
+
+    BENCH_DATABASE_URL=postgresql://localhost/blog_bench python -m benchmarks.query_plans
+
+Every table in BENCH_DATABASE_URL is dropped and recreated, never point it at real data.
+"""
+
+from application import create_app
+from application.database import db, MailDeliveries
+from application.mail_queue import claim_deliveries
+from sqlalchemy import event, text
+import argparse
+import json
+import os
+import statistics
+import sys
+
+# the indexes added for the hot query paths (migrations b58e0d4a7f26 and f3c8a1d6b204)
+INDEXES = [
+    "ix_posts_category_id",
+    "ix_posts_header_unfinished",
+    "ix_body_images_post_id_id",
+    "ix_body_images_unfinished",
+    "ix_image_variants_image_id",
+    "ix_image_variants_header",
+    "ix_subscribers_active",
+    "ix_mail_deliveries_unfinished",
+    "ix_mail_deliveries_job_id_status",
+]
+
+WORDS = ["pandas", "flask", "climbing", "postgres", "backpacking", "python", "travel", "sql"]
+
+SEED = [
+    """
+    INSERT INTO posts (h1, slug, sample, body, rendered_body, rendered_header, category, youtube_vid, header_path, header_status, date, updated)
+    SELECT
+        'Post ' || i || ' about ' || (:words)[1 + i % 8],
+        'post-' || i || '-bench',
+        'A sample of post ' || i,
+        '<p>' || repeat((:words)[1 + i % 8] || ' and ' || (:words)[1 + i % 7] || ' notes. ', 40) || '</p>',
+        '<p>' || repeat((:words)[1 + i % 8] || ' and ' || (:words)[1 + i % 7] || ' notes. ', 40) || '</p>',
+        '',
+        CASE WHEN i % 3 = 0 THEN 'code' ELSE 'other' END,
+        '',
+        NULL,
+        NULL,
+        now() - (:posts - i) * interval '1 hour',
+        now() - (:posts - i) * interval '1 hour'
+    FROM generate_series(1, :posts) AS i
+    """,
+    """
+    INSERT INTO body_images (post_id, img_path, status)
+    SELECT id, 'static/post_imgs/' || id || '/' || n || '.jpg', 'ready'
+    FROM posts, generate_series(1, 2) AS n
+    """,
+    """
+    INSERT INTO subscribers (first, last, email, still_subscribed, date_subscribed)
+    SELECT 'First' || i, 'Last' || i, 'sub' || i || '@example.com', i % 10 <> 0, current_date
+    FROM generate_series(1, :subscribers) AS i
+    """,
+]
+
+
+def seed(posts, subscribers):
+    db.drop_all()
+    db.create_all()
+    for statement in SEED:
+        db.session.execute(
+            text(statement), dict(posts=posts, subscribers=subscribers, words=WORDS)
+        )
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+
+def scenarios(posts):
+    """
+    (name, function run with the test client) for every query path.
+    """
+    middle = posts // 2
+    slug = f"post-{middle}-bench"
+
+    def get(path):
+        return lambda client: client.get(path)
+
+    def send_mail(client):
+        with client.session_transaction() as session:
+            session["user_id"] = "bench"
+        client.post(
+            "/admin/send-mail",
+            data=dict(subject="Bench", body_text="Hi", body_html="<p>Hi {name}</p>"),
+        )
+
+    def claim(client):
+        with client.application.app_context():
+            claim_deliveries(client.application.config["MAIL_QUEUE_BATCH_SIZE"])
+
+    return [
+        ("blog.index", get("/")),
+        ("blog.index (deep page)", get(f"/?before={middle}")),
+        ("blog.post_layout", get("/code")),
+        ("blog.post_layout (deep page)", get(f"/code?before={middle}")),
+        ("blog.view_post", get(f"/post/{slug}")),
+        ("blog.redirect_post", get(f"/post/{middle}")),
+        ("blog.rss", get("/rss")),
+        ("blog.search", get("/search?q=climbing+notes")),
+        ("admin.send_mail", send_mail),
+        ("mail worker claim", claim),
+    ]
+
+
+def record_statements(app, run, client):
+    """
+    The (statement, parameters) of every query run(client) makes.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        run(client)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return [
+        (statement, parameters)
+        for statement, parameters in statements
+        if statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "WITH"))
+    ]
+
+
+def explain(statement, parameters, repeat):
+    """
+    Median planning + execution time (ms) of a statement and its plan. The
+    statement is rolled back, so INSERTs and UPDATEs don't change anything.
+    """
+    times = []
+    plan = None
+    connection = db.engine.raw_connection()
+    try:
+        for _ in range(repeat):
+            cursor = connection.cursor()
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+            result = cursor.fetchone()[0]
+            result = json.loads(result) if isinstance(result, str) else result
+            connection.rollback()
+            plan = result[0]
+            times.append(plan["Planning Time"] + plan["Execution Time"])
+    finally:
+        connection.close()
+    return statistics.median(times), plan["Plan"]
+
+
+def describe(plan):
+    """
+    A one line summary of a plan: its node types, outermost first.
+    """
+    nodes = []
+    while plan:
+        name = plan["Node Type"]
+        if "Index Name" in plan:
+            name += f" on {plan['Index Name']}"
+        nodes.append(name)
+        plan = plan.get("Plans", [None])[0]
+    return " > ".join(nodes)
+
+
+def measure(app, posts, repeat, verbose):
+    """
+    Total EXPLAIN ANALYZE time of each scenario's queries.
+    """
+    client = app.test_client()
+    totals = {}
+    for name, run in scenarios(posts):
+        # once to warm the caches, then once to see what it runs
+        run(client)
+        statements = record_statements(app, run, client)
+        with app.app_context():
+            total = 0.0
+            for statement, parameters in statements:
+                ms, plan = explain(statement, parameters, repeat)
+                total += ms
+                if verbose:
+                    print(f"  {name}: {ms:9.2f} ms  {describe(plan)}", file=sys.stderr)
+        totals[name] = (total, len(statements))
+    return totals
+
+
+def set_indexes(present):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in INDEXES:
+                if present:
+                    index.create(db.engine)
+                else:
+                    db.session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--subscribers", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5, help="EXPLAIN ANALYZE runs per query")
+    parser.add_argument("--verbose", action="store_true", help="print every query's plan")
+    args = parser.parse_args()
+
+    url = os.getenv("BENCH_DATABASE_URL")
+    if not url or not url.startswith("postgres"):
+        parser.error("BENCH_DATABASE_URL must be a Postgres database that can be wiped")
+
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": url,
+        "PAGE_CACHE_TYPE": "null",
+        "TESTING": True,
+    })
+    with app.app_context():
+        print(f"Seeding {args.posts} posts and {args.subscribers} subscribers...", file=sys.stderr)
+        seed(args.posts, args.subscribers)
+
+        results = {}
+        for label, present in (("without", False), ("with", True)):
+            print(f"Timing queries {label} indexes...", file=sys.stderr)
+            set_indexes(present)
+            # every run starts from the same queue
+            MailDeliveries.query.delete()
+            db.session.commit()
+            results[label] = measure(app, args.posts, args.repeat, args.verbose)
+
+    print(f"{'query path':32} {'queries':>7} {'without (ms)':>13} {'with (ms)':>10} {'speedup':>8}")
+    for name, (without, count) in results["without"].items():
+        with_ = results["with"][name][0]
+        speedup = without / with_ if with_ else float("inf")
+        print(f"{name:32} {count:7} {without:13.2f} {with_:10.2f} {speedup:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
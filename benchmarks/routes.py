@@ -0,0 +1,354 @@
+"""Throughput and p50/p95/p99 latency of the public and admin routes
+
+Fills a fresh database with benchmarks/dataset.py. It then runs each scenario
+with test clients for --seconds (or --requests), after a --warmup. The
+scenarios are the blog pages, /subscribe, admin.send_mail, and the mail worker
+sending everything those queued. Mail goes to a local aiosmtpd stand-in, which
+can add --smtp-latency-ms to every message to behave more like a real server.
+
+    python -m benchmarks.routes --seconds 10 --clients 4
+    python -m benchmarks.routes --compare benchmarks/results/1a0d9c3.json
+
+The report is saved as JSON (benchmarks/results/<commit>.json by default).
+--compare prints the change from an earlier report. It exits with status 1 if
+any scenario's throughput or p99 got more than --tolerance worse.
+
+BENCH_DATABASE_URL is dropped and recreated, never point it at real data. A
+temporary SQLite database is used when it isn't set. The page cache is off
+unless --page-cache is given, so pages are rendered every time.
+"""
+
+from application import create_app
+from application import mail_queue
+from application.database import db, Posts
+from benchmarks import dataset
+from aiosmtpd.controller import Controller
+from collections import namedtuple
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# run(client, n) is timed and returns the response. ok is the status codes
+# that count as a success. limit caps how many times it runs. A scenario with
+# drain=True is run by one client until run returns 0, and run returns how
+# many items (emails) it handled instead of a response.
+Scenario = namedtuple("Scenario", ["name", "run", "ok", "limit", "drain"])
+
+
+class SinkHandler(object):
+    """
+    aiosmtpd handler that accepts and counts every message, optionally after a delay.
+    """
+    def __init__(self, latency):
+        self.latency = latency
+        self.messages = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.messages += 1
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_app(url, smtp, page_cache):
+    config = {
+        "SQLALCHEMY_DATABASE_URI": url,
+        "SCHEMA_CHECK": False,
+        "SITE_URL": "http://localhost",
+        "MAIL_SERVER": smtp.hostname,
+        "MAIL_PORT": smtp.port,
+        "MAIL_USE_SSL": False,
+        "MAIL_USE_TLS": False,
+        "MAIL_USERNAME": None,
+        "MAIL_PASSWORD": None,
+        "MAIL_DEFAULT_SENDER": "kelly@example.com",
+    }
+    if not page_cache:
+        config["PAGE_CACHE_TYPE"] = "null"
+    return create_app(config)
+
+
+def log_in(client):
+    with client.session_transaction() as session:
+        session["user_id"] = "bench"
+
+
+def scenarios(app, newsletters):
+    """
+    The scenarios, in the order they're run. Posting to /subscribe and
+    admin.send_mail queue the mail the worker scenario then sends. Every
+    newsletter goes to every subscriber, so admin.send_mail only runs
+    newsletters times.
+    """
+    with app.app_context():
+        post = Posts.query.order_by(Posts.id).offset(Posts.query.count() // 2).first()
+    emails = itertools.count()
+
+    def get(path):
+        return lambda client, n: client.get(path)
+
+    def subscribe(client, n):
+        return client.post(
+            "/subscribe",
+            data=dict(first="Bench", last="Mark", email=f"bench{next(emails)}@example.com"),
+        )
+
+    def send_mail(client, n):
+        log_in(client)
+        return client.post(
+            "/admin/send-mail",
+            data=dict(subject="Bench", body_text="Hi", body_html="<p>Hi {name}</p>"),
+        )
+
+    def mail_worker(client, n):
+        with client.application.app_context():
+            return mail_queue.run_once()
+
+    return [
+        Scenario("blog.index", get("/"), {200}, None, False),
+        Scenario("blog.view_post", get(f"/post/{post.slug}"), {200}, None, False),
+        Scenario("blog.redirect_post", get(f"/post/{post.id}"), {301}, None, False),
+        Scenario("blog.post_layout", get("/code"), {200}, None, False),
+        Scenario("blog.rss", get("/rss"), {200}, None, False),
+        Scenario("blog.subscribe", subscribe, {200}, None, False),
+        Scenario("admin.send_mail", send_mail, {302}, newsletters, False),
+        Scenario("mail worker", mail_worker, None, None, True),
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(latencies, errors, elapsed, items=None):
+    if not latencies:
+        return dict(count=0, errors=errors)
+    extra = {} if items is None else dict(items=items, items_per_second=items / elapsed)
+    return dict(
+        **extra,
+        count=len(latencies),
+        errors=errors,
+        throughput=len(latencies) / elapsed,
+        mean_ms=statistics.mean(latencies),
+        p50_ms=percentile(latencies, 0.50),
+        p95_ms=percentile(latencies, 0.95),
+        p99_ms=percentile(latencies, 0.99),
+        max_ms=max(latencies),
+    )
+
+
+def timed(scenario, client, n):
+    """
+    (ms, whether it succeeded, result) of one run of a scenario.
+    """
+    start = time.perf_counter()
+    result = scenario.run(client, n)
+    ms = (time.perf_counter() - start) * 1000
+    if scenario.drain:
+        return ms, True, result
+    return ms, result.status_code in scenario.ok, result
+
+
+def run_scenario(app, scenario, clients=1, seconds=5.0, requests=None, warmup=1.0):
+    """
+    Runs a scenario with clients threads (each with its own test client) for
+    seconds, or until requests runs in total, and summarizes the latencies.
+    """
+    if scenario.drain:
+        latencies, items = [], 0
+        start = time.perf_counter()
+        client = app.test_client()
+        for n in itertools.count():
+            ms, _, handled = timed(scenario, client, n)
+            if not handled:
+                break
+            latencies.append(ms)
+            items += handled
+        return summarize(latencies, 0, time.perf_counter() - start, items)
+
+    if scenario.limit is not None:
+        # limited scenarios aren't warmed up, their runs are all timed
+        requests, warmup = min(requests or scenario.limit, scenario.limit), 0
+    warm_client = app.test_client()
+    warm_until = time.perf_counter() + warmup
+    while time.perf_counter() < warm_until:
+        timed(scenario, warm_client, -1)
+
+    latencies, errors = [], []
+    counter = itertools.count()
+    stop_at = time.perf_counter() + seconds
+
+    def worker():
+        client = app.test_client()
+        while time.perf_counter() < stop_at:
+            n = next(counter)
+            if requests is not None and n >= requests:
+                break
+            ms, ok, _ = timed(scenario, client, n)
+            latencies.append(ms)
+            if not ok:
+                errors.append(n)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, len(errors), time.perf_counter() - start)
+
+
+def git_commit():
+    """
+    (commit, whether the tree has uncommitted changes), or (None, None) outside git.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty)
+
+
+def compare(baseline, report, tolerance):
+    """
+    Prints each scenario's change from the baseline report. Returns the names of
+    the scenarios whose throughput or p99 got more than tolerance worse.
+    """
+    regressions = []
+    print(f"\ncompared with {baseline.get('commit')}:")
+    print(f"{'scenario':22} {'req/s':>16} {'p99 (ms)':>18}")
+    for name, result in report["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if not old or not old.get("count") or not result.get("count"):
+            continue
+        throughput = result["throughput"] / old["throughput"] - 1
+        p99 = result["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+        worse = throughput < -tolerance or p99 > tolerance
+        print(
+            f"{name:22} {result['throughput']:9.1f} {throughput:+6.0%} "
+            f"{result['p99_ms']:10.2f} {p99:+6.0%}{'  <- regression' if worse else ''}"
+        )
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--images-per-post", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=1, help="concurrent test clients")
+    parser.add_argument("--seconds", type=float, default=5, help="time per scenario")
+    parser.add_argument("--requests", type=int, help="stop a scenario after this many requests")
+    parser.add_argument("--warmup", type=float, default=1, help="seconds of warmup per scenario")
+    parser.add_argument("--newsletters", type=int, default=3, help="times to run admin.send_mail")
+    parser.add_argument("--smtp-latency-ms", type=float, default=0)
+    parser.add_argument("--page-cache", action="store_true", help="leave the page cache on")
+    parser.add_argument("--only", nargs="+", help="only run these scenarios")
+    parser.add_argument("--output", help="where to save the JSON report")
+    parser.add_argument("--compare", help="an earlier JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    url = os.getenv("BENCH_DATABASE_URL")
+    temporary = None
+    if not url:
+        temporary = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(temporary.name, 'bench.db')}"
+
+    handler = SinkHandler(args.smtp_latency_ms / 1000)
+    smtp = Controller(handler, hostname="127.0.0.1", port=free_port())
+    smtp.start()
+    try:
+        app = bench_app(url, smtp, args.page_cache)
+        with app.app_context():
+            print(f"Seeding {args.posts} posts and {args.subscribers} subscribers...", file=sys.stderr)
+            db.drop_all()
+            db.create_all()
+            dataset.generate(args.posts, args.subscribers, args.images_per_post)
+            database = db.engine.dialect.name
+
+        results = {}
+        for scenario in scenarios(app, args.newsletters):
+            if args.only and scenario.name not in args.only:
+                continue
+            print(f"Running {scenario.name}...", file=sys.stderr)
+            results[scenario.name] = run_scenario(
+                app, scenario, args.clients, args.seconds, args.requests, args.warmup
+            )
+    finally:
+        smtp.stop()
+        if temporary is not None:
+            temporary.cleanup()
+
+    commit, dirty = git_commit()
+    report = dict(
+        commit=commit,
+        dirty=dirty,
+        created=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        python=platform.python_version(),
+        database=database,
+        settings={
+            key: getattr(args, key)
+            for key in (
+                "posts", "subscribers", "images_per_post", "clients", "seconds",
+                "requests", "warmup", "newsletters", "smtp_latency_ms", "page_cache",
+            )
+        },
+        emails_sent=handler.messages,
+        scenarios=results,
+    )
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'report'}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'scenario':22} {'count':>7} {'errors':>6} {'req/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}")
+    for name, result in results.items():
+        if not result["count"]:
+            print(f"{name:22} {0:7} {result['errors']:6}")
+            continue
+        print(
+            f"{name:22} {result['count']:7} {result['errors']:6} {result['throughput']:9.1f} "
+            f"{result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f}"
+        )
+    print(f"\n{handler.messages} emails sent, report saved to {output}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""How long a fresh process takes to import wsgi:app and serve its first response
+
+Every run is a new Python process, like a gunicorn worker booting on a new dyno:
+it times 'import wsgi' (create_app included) and then the first request to
+--path through a test client (the first database connection, the schema check
+and compiling the templates). The app is configured by the environment as usual,
+so DATABASE_URL should point at a migrated database.
+
+    python -m benchmarks.startup --runs 10 --max-import-ms 800
+
+With --max-import-ms/--max-first-response-ms it exits with status 1 when the
+median is over the limit, so CI can catch startup regressions.
+
+--precompile turns TEMPLATE_PRECOMPILE on and reports how long loading the
+templates took (see application/templating.py). --cold-templates gives every
+run an empty bytecode cache, as on the first boot after a deploy.
+
+    python -m benchmarks.startup --precompile --cold-templates
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+response = wsgi.app.test_client().get(sys.argv[1])
+responded = time.perf_counter()
+templates = wsgi.app.extensions.get("templates")
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (responded - imported) * 1000,
+    "templates_ms": templates["precompile_seconds"] * 1000 if templates else None,
+    "status": response.status_code,
+}))
+"""
+
+
+def run_once(path, importtime=False, environ=None):
+    env = dict(os.environ, **(environ or {}))
+    # a worker, not the flask command
+    env.pop("FLASK_RUN_FROM_CLI", None)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD, path]
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, count=15):
+    """
+    The packages (not their submodules) that took the longest to import,
+    submodules included, from -X importtime output.
+    """
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if cumulative.strip().isdigit() and "." not in name and name != "wsgi":
+            totals[name] = max(totals.get(name, 0), int(cumulative) / 1000)
+    return sorted(totals.items(), key=lambda item: -item[1])[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-first-response-ms", type=float)
+    parser.add_argument("--importtime", action="store_true", help="show the slowest imports")
+    parser.add_argument("--precompile", action="store_true", help="load every template in create_app")
+    parser.add_argument("--cold-templates", action="store_true", help="start every run with no bytecode cache")
+    args = parser.parse_args()
+
+    environ = {"TEMPLATE_PRECOMPILE": "true"} if args.precompile else {}
+    runs = []
+    for _ in range(args.runs):
+        if args.cold_templates:
+            with tempfile.TemporaryDirectory() as directory:
+                timings, _ = run_once(args.path, environ=dict(environ, TEMPLATE_CACHE_DIR=directory))
+        else:
+            timings, _ = run_once(args.path, environ=environ)
+        if timings["status"] >= 500:
+            parser.error(f"{args.path} answered {timings['status']}, is DATABASE_URL migrated?")
+        runs.append(timings)
+
+    failed = False
+    print(f"{'':22} {'min':>9} {'median':>9} {'max':>9}")
+    for key, limit in (
+        ("import_ms", args.max_import_ms),
+        ("first_response_ms", args.max_first_response_ms),
+        ("templates_ms", None),
+    ):
+        values = [run[key] for run in runs if run[key] is not None]
+        if not values:
+            continue
+        median = statistics.median(values)
+        print(f"{key:22} {min(values):9.1f} {median:9.1f} {max(values):9.1f}")
+        if limit is not None and median > limit:
+            print(f"  {key} median is over the {limit:.0f} ms limit")
+            failed = True
+
+    if args.importtime:
+        _, stderr = run_once(args.path, importtime=True, environ=environ)
+        print("\nslowest packages to import (ms):")
+        for name, ms in slowest_imports(stderr):
+            print(f"  {name:30} {ms:8.1f}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
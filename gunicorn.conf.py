@@ -0,0 +1,48 @@
+"""gunicorn settings for the web dyno, derived from the environment (see application/concurrency.py)"""
+
+import os
+import shutil
+import tempfile
+
+if os.getenv("GUNICORN_PROFILE") == "gevent":
+    # has to happen before anything else imports the socket/ssl modules
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+# every worker keeps its metrics in files here, which /metrics adds up (see
+# application/metrics.py). It has to be set before the app is imported, and
+# it's emptied so the counters start from zero with the master process.
+_metrics_dir = os.environ.setdefault(
+    "prometheus_multiproc_dir", os.path.join(tempfile.gettempdir(), "personal_website_metrics")
+)
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir)
+
+from application.concurrency import gunicorn_settings
+
+_settings = gunicorn_settings()
+
+worker_class = _settings["worker_class"]
+workers = _settings["workers"]
+threads = _settings["threads"]
+worker_connections = _settings["worker_connections"]
+preload_app = _settings["preload_app"]
+timeout = _settings["timeout"]
+keepalive = _settings["keepalive"]
+max_requests = _settings["max_requests"]
+max_requests_jitter = _settings["max_requests_jitter"]
+
+
+def when_ready(server):
+    server.log.info(
+        "Profile %s: %s workers x %s threads (%s connections)",
+        _settings["profile"], workers, threads, worker_connections,
+    )
+
+
+def child_exit(server, worker):
+    # drops the dead worker's gauges (its counters are kept)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,11 @@
+"""Runs the image worker that makes the variants of uploaded images (see application/image_queue.py)"""
+
+from application import create_app
+from application.image_queue import work
+
+# no statement timeout, a batch can take longer than a web request
+app = create_app({"DATABASE_STATEMENT_TIMEOUT": 0})
+
+if __name__ == "__main__":
+    with app.app_context():
+        work()
@@ -0,0 +1,53 @@
+"""Add a unique, indexed slug to posts for their urls
+
+Revision ID: 3a6d9f1c8e57
+Revises: 7c5e2b9d0a64
+Create Date: 2026-10-18 17:02:41.905316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import re
+import unicodedata
+
+
+# revision identifiers, used by Alembic.
+revision = '3a6d9f1c8e57'
+down_revision = '7c5e2b9d0a64'
+branch_labels = None
+depends_on = None
+
+
+def slugify(text, max_length=80):
+    # a copy of database.slugify as it was when this migration was written
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+    if len(slug) > max_length:
+        slug = slug[:max_length].rsplit("-", 1)[0]
+    if not slug or slug.isdigit():
+        slug = f"post-{slug}".strip("-")
+    return slug
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('slug', sa.String(length=120), nullable=True))
+
+    # existing posts get slugs from their titles, oldest post first
+    connection = op.get_bind()
+    posts = sa.table('posts', sa.column('id', sa.Integer), sa.column('h1', sa.String), sa.column('slug', sa.String))
+    taken = set()
+    for id, h1 in connection.execute(sa.select([posts.c.id, posts.c.h1]).order_by(posts.c.id)):
+        base = slug = slugify(h1)
+        number = 2
+        while slug in taken:
+            slug = f"{base}-{number}"
+            number += 1
+        taken.add(slug)
+        connection.execute(posts.update().where(posts.c.id == id).values(slug=slug))
+
+    op.create_index(op.f('ix_posts_slug'), 'posts', ['slug'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_posts_slug'), table_name='posts')
+    op.drop_column('posts', 'slug')
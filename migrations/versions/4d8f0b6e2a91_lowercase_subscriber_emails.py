@@ -0,0 +1,48 @@
+"""Store subscriber emails in lowercase
+
+Revision ID: 4d8f0b6e2a91
+Revises: c47a9e2d1f38
+Create Date: 2026-10-18 13:30:52.118604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8f0b6e2a91'
+down_revision = 'c47a9e2d1f38'
+branch_labels = None
+depends_on = None
+
+
+# the oldest subscriber with the same email as subscribers.email, whatever its case
+OLDEST = (
+    "(SELECT min(oldest.id) FROM subscribers AS oldest "
+    "WHERE lower(oldest.email) = lower(subscribers.email))"
+)
+
+
+def upgrade():
+    # emails that only differ by case are the same person: keep the oldest of
+    # their rows, subscribed if any of them still is, with all their deliveries
+    op.execute(
+        sa.text(
+            f"UPDATE subscribers SET still_subscribed = :subscribed "
+            f"WHERE id = {OLDEST} AND EXISTS ("
+            "SELECT 1 FROM subscribers AS same WHERE lower(same.email) = lower(subscribers.email) "
+            "AND same.still_subscribed = :subscribed)"
+        ).bindparams(subscribed=True)
+    )
+    op.execute(
+        f"UPDATE mail_deliveries SET subscriber_id = ("
+        f"SELECT {OLDEST} FROM subscribers WHERE subscribers.id = mail_deliveries.subscriber_id) "
+        f"WHERE subscriber_id IN (SELECT id FROM subscribers WHERE id <> {OLDEST})"
+    )
+    op.execute(f"DELETE FROM subscribers WHERE id <> {OLDEST}")
+    op.execute("UPDATE subscribers SET email = lower(email) WHERE email <> lower(email)")
+
+
+def downgrade():
+    # the original case of the emails and the duplicate subscribers aren't kept
+    pass
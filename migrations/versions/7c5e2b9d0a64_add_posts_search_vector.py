@@ -0,0 +1,35 @@
+"""Add a generated tsvector column and GIN index for full-text search of posts
+
+Revision ID: 7c5e2b9d0a64
+Revises: e1a7c3f95b22
+Create Date: 2026-10-18 16:21:05.771394
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c5e2b9d0a64'
+down_revision = 'e1a7c3f95b22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # generated columns need Postgres 12 or newer
+    op.execute(
+        "ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(h1, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(sample, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(body, '')), 'C')"
+        ") STORED"
+    )
+    op.create_index(
+        'ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_posts_search_vector', table_name='posts')
+    op.drop_column('posts', 'search_vector')
@@ -0,0 +1,26 @@
+"""Add Posts.updated column for conditional GETs
+
+Revision ID: 8e3b41f07c6d
+Revises: 5c1d2e7f9a40
+Create Date: 2026-10-18 10:02:47.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3b41f07c6d'
+down_revision = '5c1d2e7f9a40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('updated', sa.DateTime(timezone=True), nullable=True))
+    # posts that already exist were last changed when they were published as far as we know
+    op.execute("UPDATE posts SET updated = date")
+
+
+def downgrade():
+    op.drop_column('posts', 'updated')
@@ -0,0 +1,62 @@
+"""Add composite and partial indexes for the queries the blog, admin and workers run
+
+Revision ID: b58e0d4a7f26
+Revises: 3a6d9f1c8e57
+Create Date: 2026-10-18 17:48:12.530817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b58e0d4a7f26'
+down_revision = '3a6d9f1c8e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_posts_category_id', 'posts', ['category', 'id'], unique=False)
+    op.create_index(
+        'ix_posts_header_pending', 'posts', ['id'], unique=False,
+        postgresql_where=sa.text("header_status = 'pending'"),
+        sqlite_where=sa.text("header_status = 'pending'"),
+    )
+    op.create_index('ix_body_images_post_id_id', 'body_images', ['post_id', 'id'], unique=False)
+    op.create_index(
+        'ix_body_images_pending', 'body_images', ['id'], unique=False,
+        postgresql_where=sa.text("status = 'pending'"),
+        sqlite_where=sa.text("status = 'pending'"),
+    )
+    op.create_index('ix_image_variants_image_id', 'image_variants', ['image_id'], unique=False)
+    op.create_index(
+        'ix_image_variants_header', 'image_variants', ['post_id'], unique=False,
+        postgresql_where=sa.text("image_id IS NULL"),
+        sqlite_where=sa.text("image_id IS NULL"),
+    )
+    op.create_index(
+        'ix_subscribers_active', 'subscribers', ['id'], unique=False,
+        postgresql_where=sa.text("still_subscribed = true"),
+        sqlite_where=sa.text("still_subscribed = 1"),
+    )
+    op.create_index(
+        'ix_mail_deliveries_unfinished', 'mail_deliveries', ['id'], unique=False,
+        postgresql_where=sa.text("status IN ('pending', 'sending')"),
+        sqlite_where=sa.text("status IN ('pending', 'sending')"),
+    )
+    op.create_index(
+        'ix_mail_deliveries_job_id_status', 'mail_deliveries', ['job_id', 'status'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_mail_deliveries_job_id_status', table_name='mail_deliveries')
+    op.drop_index('ix_mail_deliveries_unfinished', table_name='mail_deliveries')
+    op.drop_index('ix_subscribers_active', table_name='subscribers')
+    op.drop_index('ix_image_variants_header', table_name='image_variants')
+    op.drop_index('ix_image_variants_image_id', table_name='image_variants')
+    op.drop_index('ix_body_images_pending', table_name='body_images')
+    op.drop_index('ix_body_images_post_id_id', table_name='body_images')
+    op.drop_index('ix_posts_header_pending', table_name='posts')
+    op.drop_index('ix_posts_category_id', table_name='posts')
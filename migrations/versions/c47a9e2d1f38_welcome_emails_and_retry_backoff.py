@@ -0,0 +1,31 @@
+"""Queue welcome emails as mail deliveries and add retry backoff
+
+Revision ID: c47a9e2d1f38
+Revises: 2f9c6a0d8b15
+Create Date: 2026-10-18 12:41:19.300472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a9e2d1f38'
+down_revision = '2f9c6a0d8b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('mail_deliveries', sa.Column('kind', sa.String(length=20), nullable=True))
+    op.add_column('mail_deliveries', sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute("UPDATE mail_deliveries SET kind = 'newsletter'")
+    # welcome emails don't belong to a mail job
+    op.alter_column('mail_deliveries', 'job_id', existing_type=sa.Integer(), nullable=True)
+
+
+def downgrade():
+    op.execute("DELETE FROM mail_deliveries WHERE job_id IS NULL")
+    op.alter_column('mail_deliveries', 'job_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_column('mail_deliveries', 'next_attempt_at')
+    op.drop_column('mail_deliveries', 'kind')
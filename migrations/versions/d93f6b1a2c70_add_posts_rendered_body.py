@@ -0,0 +1,27 @@
+"""Add the pre-rendered body and header image markup of posts
+
+Revision ID: d93f6b1a2c70
+Revises: b58e0d4a7f26
+Create Date: 2026-10-18 19:32:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93f6b1a2c70'
+down_revision = 'b58e0d4a7f26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled in by 'flask render-posts --missing', which the release phase runs
+    op.add_column('posts', sa.Column('rendered_body', sa.Text(), nullable=True))
+    op.add_column('posts', sa.Column('rendered_header', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('posts', 'rendered_header')
+    op.drop_column('posts', 'rendered_body')
@@ -0,0 +1,30 @@
+"""Track whether the variants of uploaded images have been made
+
+Revision ID: e1a7c3f95b22
+Revises: 9b2e5c7a4d13
+Create Date: 2026-10-18 15:37:44.118903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a7c3f95b22'
+down_revision = '9b2e5c7a4d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('body_images', sa.Column('status', sa.String(length=20), nullable=True))
+    op.add_column('posts', sa.Column('header_status', sa.String(length=20), nullable=True))
+    # images uploaded before this were processed in the request (or never, in
+    # which case 'flask process-images' queues them)
+    op.execute("UPDATE body_images SET status = 'ready'")
+    op.execute("UPDATE posts SET header_status = 'ready' WHERE header_path IS NOT NULL")
+
+
+def downgrade():
+    op.drop_column('posts', 'header_status')
+    op.drop_column('body_images', 'status')
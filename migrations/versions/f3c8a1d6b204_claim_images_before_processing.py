@@ -0,0 +1,53 @@
+"""Let image workers claim images instead of locking them while they're processed
+
+Revision ID: f3c8a1d6b204
+Revises: d93f6b1a2c70
+Create Date: 2026-10-18 20:05:12.540318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8a1d6b204'
+down_revision = 'd93f6b1a2c70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('body_images', sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('posts', sa.Column('header_claimed_at', sa.DateTime(timezone=True), nullable=True))
+    # the queues now hold claimed ('processing') images as well
+    op.drop_index('ix_body_images_pending', table_name='body_images')
+    op.create_index(
+        'ix_body_images_unfinished', 'body_images', ['id'], unique=False,
+        postgresql_where=sa.text("status IN ('pending', 'processing')"),
+        sqlite_where=sa.text("status IN ('pending', 'processing')"),
+    )
+    op.drop_index('ix_posts_header_pending', table_name='posts')
+    op.create_index(
+        'ix_posts_header_unfinished', 'posts', ['id'], unique=False,
+        postgresql_where=sa.text("header_status IN ('pending', 'processing')"),
+        sqlite_where=sa.text("header_status IN ('pending', 'processing')"),
+    )
+
+
+def downgrade():
+    op.execute("UPDATE body_images SET status = 'pending' WHERE status = 'processing'")
+    op.execute("UPDATE posts SET header_status = 'pending' WHERE header_status = 'processing'")
+    op.drop_index('ix_posts_header_unfinished', table_name='posts')
+    op.create_index(
+        'ix_posts_header_pending', 'posts', ['id'], unique=False,
+        postgresql_where=sa.text("header_status = 'pending'"),
+        sqlite_where=sa.text("header_status = 'pending'"),
+    )
+    op.drop_index('ix_body_images_unfinished', table_name='body_images')
+    op.create_index(
+        'ix_body_images_pending', 'body_images', ['id'], unique=False,
+        postgresql_where=sa.text("status = 'pending'"),
+        sqlite_where=sa.text("status = 'pending'"),
+    )
+    op.drop_column('posts', 'header_claimed_at')
+    op.drop_column('body_images', 'claimed_at')
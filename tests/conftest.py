@@ -4,6 +4,7 @@ from application.database import Admin, db, Posts, Subscribers
 import io
 import os
 from tests import setup_db, teardown_db, clean_db
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash
 
 
@@ -12,10 +13,14 @@ def app(codepost1, otherpost1, admin_user, subscriber1):
     app = create_app({
         'TESTING': True,
         'SQLALCHEMY_DATABASE_URI': os.getenv("TEST_DATABASE_URL"),
+        'PAGE_CACHE_TYPE': 'null',
+        # the test database is made from the models, not the migrations
+        'SCHEMA_CHECK': False,
     })
 
     # make sure db is clean to start
     with app.app_context():
+        db.create_all()
         clean_db()
         db.session.add(codepost1)
         db.session.add(otherpost1)
@@ -34,6 +39,39 @@ def client(app):
     return app.test_client()
 
 
+class QueryCounter(object):
+    """
+    Counts (and keeps) the SQL statements the app's engine executes
+    """
+    def __init__(self, app):
+        self._app = app
+        self.count = 0
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, *args, **kwargs):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.count = 0
+        self.statements = []
+        with self._app.app_context():
+            self._engine = db.engine
+        event.listen(self._engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self._engine, "before_cursor_execute", self._count)
+
+
+@pytest.fixture
+def count_queries(app):
+    """
+    Fixture to count the queries run inside a 'with count_queries:' block.
+    """
+    return QueryCounter(app)
+
+
 class AuthActions(object):
     """
     Handles logging a user in for @login_required views
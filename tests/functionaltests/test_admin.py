@@ -1,8 +1,13 @@
 """Tests for all the routes in the admin blueprint"""
 import pytest
+import io
 import os
-from application.database import Posts, Subscribers, Admin
+from PIL import Image
+from application.database import Posts, Subscribers, Admin, MailJobs
 from application.admin import mail
+from application.mail_queue import run_once
+from application import image_queue
+from concurrent.futures import ProcessPoolExecutor
 from flask import session
 
 
@@ -63,7 +68,7 @@ def test_logout_get(client, auth):
     assert b"Hiya, I'm Kelly" in response.data
 
 
-@pytest.mark.parametrize("path", ("/admin/create", "admin/edit/1", "/admin/", "admin/send-mail"))
+@pytest.mark.parametrize("path", ("/admin/create", "admin/edit/1", "/admin/", "admin/send-mail", "/admin/profiling"))
 def test_unauthorized_route_get(client, path):
     """
     GIVEN a Flask application configured for testing
@@ -125,6 +130,24 @@ def test_create_post_without_header_file(client, auth, post_to_upload_without_fi
     with app.app_context():
         post = Posts.query.filter_by(h1="This is the test post").first()
         assert post is not None
+        assert post.slug == "this-is-the-test-post"
+
+
+def test_create_post_slugs_are_unique(client, auth, post_to_upload_without_file, app):
+    """
+    GIVEN a Flask application
+    WHEN two posts with the same title are created
+    THEN check that they get different slugs
+    """
+    auth.login()
+    for i in range(2):
+        # the upload is read by the first request, so each one gets its own
+        data = dict(post_to_upload_without_file, header=(io.BytesIO(b""), ""))
+        client.post("admin/create", data=data)
+
+    with app.app_context():
+        slugs = [post.slug for post in Posts.query.filter_by(h1="This is the test post")]
+        assert sorted(slugs) == ["this-is-the-test-post", "this-is-the-test-post-2"]
 
 
 def test_create_post_with_header_file(client, auth, post_to_upload_with_file, app):
@@ -158,6 +181,67 @@ def test_create_post_with_header_file(client, auth, post_to_upload_with_file, ap
         pass  # directory not empty because actually posts are using it
 
 
+def test_create_post_makes_image_variants(client, auth, post_to_upload_with_file, app):
+    """
+    GIVEN a Flask application
+    WHEN a post is created with real header and body images
+    THEN check that the originals are served until the image worker has made
+    their variants, and the post page uses the variants in srcsets after that
+    """
+    def image_upload(name):
+        data = io.BytesIO()
+        Image.new("RGB", (1200, 600), (10, 120, 200)).save(data, format="JPEG")
+        data.seek(0)
+        return (data, name)
+
+    post_to_upload_with_file["header"] = image_upload("test-variants-header.jpg")
+    post_to_upload_with_file["body_imgs"] = [image_upload("test-variants-body.jpg")]
+    post_to_upload_with_file["body"] = "<p>{imgs[0].picture}</p>"
+    # the header image is only shown for posts without a video
+    post_to_upload_with_file["youtube_vid"] = ""
+    auth.login()
+    client.post("admin/create", data=post_to_upload_with_file)
+
+    with app.app_context():
+        post = Posts.query.filter_by(h1="This is the second test post").first()
+        img_folder = os.path.dirname(os.path.join("application", post.header_path))
+        assert post.header_status == "pending"
+        assert post.images[0].status == "pending"
+        assert not post.header_variants
+        assert os.listdir(img_folder)
+        # rendered when it was saved, with the original image until the variants are made
+        assert post.rendered_body.startswith('<p><img src="/static/post_imgs/')
+        assert post.rendered_header.startswith('<img src="/static/post_imgs/')
+
+    try:
+        response = client.get(f"/post/{post.slug}")
+        assert b"srcset" not in response.data
+        assert b'<img src="/static/post_imgs/' in response.data
+
+        with app.app_context(), ProcessPoolExecutor(max_workers=2) as executor:
+            # the other test posts' headers are queued as well
+            assert image_queue.run_once(executor) >= 2
+            assert image_queue.run_once(executor) == 0
+            post = Posts.query.get(post.id)
+            assert post.header_status == post.images[0].status == "ready"
+            assert len(post.header_variants) == len(post.images[0].variants) > 0
+            assert {v.width for v in post.header_variants} == {480, 960, 1200}
+
+        response = client.get(f"/post/{post.slug}")
+        assert b"test-variants-header-480w.webp 480w" in response.data
+        assert b"test-variants-body-960w.jpg 960w" in response.data
+        assert b'loading="lazy"' in response.data
+    finally:
+        # clean the images up, the folder may hold real post images
+        for name in os.listdir(img_folder):
+            if name.startswith("test-variants-"):
+                os.remove(os.path.join(img_folder, name))
+        try:
+            os.rmdir(img_folder)
+        except OSError:
+            pass
+
+
 def test_edit_post_get(client, auth):
     """
     GIVEN a Flask application configured for testing
@@ -203,6 +287,8 @@ def test_edit_post_with_no_header_files(app, auth, client, post_to_upload_withou
     response = client.post(
         f"admin/edit/{orig_post.id}", data=post_to_edit_without_file, follow_redirects=True
     )
+    # the url of the post doesn't change with its title
+    assert client.get(f"/post/{orig_post.slug}").status_code == 200
     assert response.status_code == 200
     assert b"Success, the post has been updated." in response.data
     with app.app_context():
@@ -303,7 +389,8 @@ def test_send_mail_post(client, email, app, auth):
     """
     GIVEN a Flask application
     WHEN the '/send-mail page is posted to (POST)
-    THEN check that a 200 status code is returned and proper number of emails are sent
+    THEN check that a 200 status code is returned, the mail is queued and the
+    mail worker sends the proper number of emails
     """
     assert app.testing is True
     # make sure the database is set up correctly
@@ -314,7 +401,12 @@ def test_send_mail_post(client, email, app, auth):
     with mail.record_messages() as outbox:
         response = client.post("admin/send-mail", data=email, follow_redirects=True)
         assert response.status_code == 200
-        assert b"Success, the mail has been sent." in response.data
+        assert b"Success, the mail is being sent." in response.data
+        # nothing is sent during the request
+        assert len(outbox) == 0
+
+        with app.app_context():
+            assert run_once() == 1
 
         # assert email was sent to the one subscriber in the db with the correct subject
         assert len(outbox) == 1
@@ -323,6 +415,22 @@ def test_send_mail_post(client, email, app, auth):
         assert outbox[0].html == f"<p>Hi {sub.first},</p><p>This is the text of the message</p>"
 
 
+def test_send_mail_post_unfillable_body(client, email, app, auth):
+    """
+    GIVEN a Flask application
+    WHEN the '/send-mail page is posted to (POST) with an html body that has a placeholder other than {name}
+    THEN check that a '400' status code is returned with the form and nothing is queued
+    """
+    auth.login()
+    email["body_html"] = "<p>Hi {name}, {foo}</p>"
+    response = client.post("admin/send-mail", data=email)
+    assert response.status_code == 400
+    assert b"only {name} can be used" in response.data
+    assert b"Fake Email Subject" in response.data
+    with app.app_context():
+        assert MailJobs.query.count() == 0
+
+
 def test_send_test_mail_get(client):
     """
     GIVEN a Flask application
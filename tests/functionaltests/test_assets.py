@@ -0,0 +1,93 @@
+"""Tests for the fingerprinted and precompressed CSS/JS bundles"""
+import pytest
+import gzip
+import re
+from flask import url_for
+from application.assets import build_assets, brotli
+
+
+def test_build_assets(tmp_path):
+    """
+    GIVEN CSS and JS source files
+    WHEN the bundles are built
+    THEN check that they're minified, concatenated in order and fingerprinted with compressed copies
+    """
+    (tmp_path / "a.css").write_text("/* comment */\nbody {\n    color: red;\n}\n")
+    (tmp_path / "b.css").write_text("p {  margin: 0;  }\n")
+    (tmp_path / "a.js").write_text("// comment\nfunction a() {\n    return 1;\n}\n")
+    bundles = {"site.css": ["a.css", "b.css"], "site.js": ["a.js"]}
+
+    manifest = build_assets(str(tmp_path), bundles)
+
+    assert re.fullmatch(r"dist/site\.[0-9a-f]{10}\.css", manifest["site.css"])
+    css = (tmp_path / manifest["site.css"]).read_bytes()
+    assert css == b"body{color:red}\np{margin:0}"
+    assert gzip.decompress((tmp_path / (manifest["site.css"] + ".gz")).read_bytes()) == css
+    if brotli is not None:
+        assert brotli.decompress((tmp_path / (manifest["site.css"] + ".br")).read_bytes()) == css
+    assert (tmp_path / manifest["site.js"]).read_bytes() == b"function a(){return 1;}"
+    assert '"site.css"' in (tmp_path / "dist" / "manifest.json").read_text()
+
+    # a bundle's name only changes with its content
+    assert build_assets(str(tmp_path), bundles) == manifest
+    (tmp_path / "b.css").write_text("p { margin: 1px; }\n")
+    assert build_assets(str(tmp_path), bundles)["site.css"] != manifest["site.css"]
+
+
+def test_layout_uses_fingerprinted_bundles(client):
+    """
+    GIVEN a Flask application
+    WHEN a page is requested
+    THEN check that it links each bundle once, by its fingerprinted URL
+    """
+    html = client.get("/").data.decode()
+    assert re.findall(r'href="/static/dist/site\.[0-9a-f]{10}\.css"', html)
+    assert len(re.findall(r'src="/static/dist/site\.[0-9a-f]{10}\.js"', html)) == 1
+    assert "styles.css" not in html
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, content_encoding",
+    [("gzip, deflate, br", "br" if brotli else "gzip"), ("gzip", "gzip"), ("", None)],
+)
+def test_bundles_served_precompressed(client, app, accept_encoding, content_encoding):
+    """
+    GIVEN a Flask application
+    WHEN a bundle is requested with different Accept-Encodings
+    THEN check that the best precompressed copy is sent with immutable caching headers
+    """
+    with app.test_request_context():
+        url = url_for("static", filename="site.css")
+    response = client.get(url, headers={"Accept-Encoding": accept_encoding})
+    assert response.status_code == 200
+    assert response.mimetype == "text/css"
+    assert response.headers.get("Content-Encoding") == content_encoding
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "max-age=31536000" in response.headers["Cache-Control"]
+    assert "public" in response.headers["Cache-Control"]
+
+
+def test_other_static_files_unchanged(client):
+    """
+    GIVEN a Flask application
+    WHEN a static file that isn't a bundle is requested
+    THEN check that it's sent as usual
+    """
+    response = client.get("/static/styles.css")
+    assert response.status_code == 200
+    assert "immutable" not in response.headers.get("Cache-Control", "")
+    assert "Content-Encoding" not in response.headers
+
+
+def test_manifest_not_cached_forever(client):
+    """
+    GIVEN a Flask application
+    WHEN the bundles' manifest, which isn't fingerprinted, is requested
+    THEN check that it's sent as usual, as JSON and without immutable caching
+    """
+    response = client.get("/static/dist/manifest.json")
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert "immutable" not in response.headers.get("Cache-Control", "")
+    assert "Content-Encoding" not in response.headers
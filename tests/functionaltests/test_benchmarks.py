@@ -0,0 +1,56 @@
+"""Tests that the route benchmarks' dataset and scenarios work against the app."""
+from application.database import Posts, Subscribers
+from benchmarks import dataset
+from benchmarks.routes import run_scenario, scenarios
+from benchmarks import compression
+import argparse
+
+
+def test_dataset(app):
+    """
+    GIVEN a Flask application
+    WHEN the benchmark dataset is generated
+    THEN check that the posts, images and subscribers are added and a post page renders its images
+    """
+    with app.app_context():
+        dataset.generate(posts=6, subscribers=20, images_per_post=2)
+        post = Posts.query.filter(Posts.slug.like("post-5-%")).one()
+        assert [image.status for image in post.images] == ["ready", "ready"]
+        assert Subscribers.query.filter_by(still_subscribed=False).count() == 2
+        slug = post.slug
+    response = app.test_client().get(f"/post/{slug}")
+    assert response.status_code == 200
+    assert b"<picture>" in response.data
+    assert b"srcset" in response.data
+
+
+def test_scenarios(app):
+    """
+    GIVEN a Flask application with the benchmark dataset
+    WHEN every request scenario runs a couple of times
+    THEN check that none of the requests fail
+    """
+    with app.app_context():
+        dataset.generate(posts=6, subscribers=20, images_per_post=1)
+    for scenario in scenarios(app, newsletters=1):
+        if scenario.drain:
+            continue
+        result = run_scenario(app, scenario, requests=2, warmup=0)
+        assert result["errors"] == 0, scenario.name
+        assert result["count"] >= 1, scenario.name
+
+
+def test_compression_benchmark(app):
+    """
+    GIVEN a Flask application with the benchmark dataset
+    WHEN the compression benchmark measures every route
+    THEN check that each route's compressed responses are smaller than the uncompressed ones
+    """
+    with app.app_context():
+        dataset.generate(posts=6, subscribers=0, images_per_post=1)
+    args = argparse.Namespace(repeat=1, gzip_level=6, brotli_quality=5)
+    results = compression.measure(app.config["SQLALCHEMY_DATABASE_URI"], args)
+    assert set(results) == {"blog.index", "blog.view_post", "blog.post_layout", "blog.rss", "blog.atom", "blog.json_feed"}
+    for result in results.values():
+        assert result["gzip_bytes"] < result["identity_bytes"]
+        assert result["gzip_request_ms_cached"] > 0
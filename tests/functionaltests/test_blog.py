@@ -1,6 +1,8 @@
 import pytest
-from application.database import Subscribers
+from application.database import db, Posts, BodyImages, Subscribers, MailDeliveries
+from flask_mail import Connection
 from application.admin import mail
+from application.mail_queue import run_once
 
 def test_index_get(client):
     """
@@ -18,6 +20,99 @@ def test_index_get(client):
     assert b"Hi this is a sample" in response.data
 
 
+def test_index_query_count_is_constant(client, app, count_queries):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/' page is requested (GET) with more and more posts in the database
+    THEN check that the number of queries run doesn't grow with the number of posts
+    """
+    with count_queries:
+        client.get("/")
+    queries_with_two_posts = count_queries.count
+
+    with app.app_context():
+        for i in range(5):
+            post = Posts(f"Post {i}", "sample", None, None, "<p>body</p>", "code")
+            db.session.add(post)
+            db.session.flush()
+            db.session.add(BodyImages(post.id, f"static/post_imgs/{post.id}/a.png"))
+            db.session.add(BodyImages(post.id, f"static/post_imgs/{post.id}/b.png"))
+        db.session.commit()
+
+    with count_queries:
+        response = client.get("/")
+    assert response.status_code == 200
+    assert b"Post 4" in response.data
+    assert count_queries.count == queries_with_two_posts
+
+
+def test_index_pagination(client, app):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/' page is requested (GET) with more posts than fit on a page
+    THEN check that only one page of posts is shown with working older/newer links
+    """
+    app.config["POSTS_PER_PAGE"] = 2
+    with app.app_context():
+        for i in range(3):
+            db.session.add(Posts(f"Paginated post {i}", "sample", None, None, "<p>body</p>", "code"))
+        db.session.commit()
+        ids = [post.id for post in Posts.query.order_by(Posts.id.desc()).all()]
+
+    response = client.get("/")
+    assert b"Paginated post 2" in response.data
+    assert b"Paginated post 1" in response.data
+    assert b"Paginated post 0" not in response.data
+    assert f"/?before={ids[1]}".encode() in response.data
+    assert b"Newer posts" not in response.data
+
+    response = client.get(f"/?before={ids[1]}")
+    assert b"Paginated post 0" in response.data
+    assert b"H1 for the other test post" in response.data
+    assert b"Paginated post 1" not in response.data
+    assert f"/?after={ids[2]}".encode() in response.data
+    assert f"/?before={ids[3]}".encode() in response.data
+
+    response = client.get(f"/?after={ids[2]}")
+    assert b"Paginated post 2" in response.data
+    assert b"Paginated post 1" in response.data
+    assert b"Paginated post 0" not in response.data
+    assert b"Newer posts" not in response.data
+
+    response = client.get(f"/?before={ids[3]}")
+    assert b"Header 1 for the test post" in response.data
+    assert b"Older posts" not in response.data
+
+
+def test_index_pagination_at_the_ends(client, app):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/' page is requested (GET) with cursors at and past the ends of the posts
+    THEN check that pages only link to older posts that exist and empty pages redirect to the first one
+    """
+    app.config["POSTS_PER_PAGE"] = 1
+    with app.app_context():
+        ids = [post.id for post in Posts.query.order_by(Posts.id.desc()).all()]
+
+    response = client.get(f"/?after={ids[1]}")
+    assert b"H1 for the other test post" in response.data
+    assert f"/?before={ids[0]}".encode() in response.data
+
+    for cursor in [f"after={ids[1] - 1}", "after=0"]:
+        response = client.get(f"/?{cursor}")
+        assert b"Header 1 for the test post" in response.data
+        assert b"Older posts" not in response.data
+
+    for cursor in [f"after={ids[0]}", f"before={ids[1]}", "before=1"]:
+        response = client.get(f"/?{cursor}")
+        assert response.status_code == 302
+        assert response.headers["Location"].endswith("/")
+
+    response = client.get(f"/code?before={ids[1]}")
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/code")
+
+
 def test_index_post(client):
     """
     GIVEN a Flask application
@@ -32,22 +127,69 @@ def test_index_post(client):
 def test_view_post_get(client):
     """
     GIVEN a Flask application configured for testing
-    WHEN the '/post/<id>' page is requested (GET)
+    WHEN the '/post/<slug>' page is requested (GET)
     THEN check that the response is valid
     """
-    response = client.get("/post/1")
+    response = client.get("/post/header-1-for-the-test-post")
     assert response.status_code == 200
     assert b"Header 1 for the test post" in response.data
     assert b"<p>hi I edited this</p>" in response.data
 
 
+def test_view_missing_post(client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a post that doesn't exist is requested, by slug or by id
+    THEN check that a '404' status code is returned
+    """
+    assert client.get("/post/no-such-post").status_code == 404
+    assert client.get("/post/100").status_code == 404
+
+
+def test_old_post_urls_redirect(client, count_queries):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a post is requested by its old '/post/<id>' url
+    THEN check that it's permanently redirected to its slug url, and that the
+    slug is only looked up in the database once
+    """
+    response = client.get("/post/1")
+    assert response.status_code == 301
+    assert response.location.endswith("/post/header-1-for-the-test-post")
+
+    with count_queries:
+        response = client.get("/post/1")
+    assert response.status_code == 301
+    assert count_queries.count == 0
+
+    response = client.get("/post/1", follow_redirects=True)
+    assert b"Header 1 for the test post" in response.data
+
+
+def test_view_post_is_validator_plus_one_fetch(client, app, count_queries):
+    """
+    GIVEN a Flask application whose posts were rendered by 'flask render-posts'
+    WHEN a post page is requested (GET)
+    THEN check that the post is fetched in a single query (after the ETag one)
+    """
+    runner = app.test_cli_runner()
+    assert "Rendered 2 changed posts" in runner.invoke(args=["render-posts"]).output
+    assert "Rendered 0 changed posts" in runner.invoke(args=["render-posts"]).output
+
+    with count_queries:
+        response = client.get("/post/header-1-for-the-test-post")
+    assert response.status_code == 200
+    assert b"<p>hi I edited this</p>" in response.data
+    assert count_queries.count == 2
+
+
 def test_view_post_post(client):
     """
     GIVEN a Flask application
-    WHEN the '/post/<id>' page is posted to (POST)
+    WHEN the '/post/<slug>' page is posted to (POST)
     THEN check that a '405' status code is returned
     """
-    response = client.post("/post/1")
+    response = client.post("/post/header-1-for-the-test-post")
     assert response.status_code == 405
     assert b"Header 1 for the test post" not in response.data
     assert b"<p>hi I edited this</p>" not in response.data
@@ -74,6 +216,30 @@ def test_post_layout_get(client):
     assert b"Hi this is a sample" not in response.data
 
 
+def test_post_layout_pagination(client, app):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/<category>' page is requested (GET) with more posts than fit on a page
+    THEN check that the older posts link stays within the category
+    """
+    app.config["POSTS_PER_PAGE"] = 1
+    with app.app_context():
+        post = Posts("Newest code post", "sample", None, None, "<p>body</p>", "code")
+        db.session.add(post)
+        db.session.commit()
+        newest_id = post.id
+
+    response = client.get("/code")
+    assert b"Newest code post" in response.data
+    assert b"Header 1 for the test post" not in response.data
+    assert f"/code?before={newest_id}".encode() in response.data
+
+    response = client.get(f"/code?before={newest_id}")
+    assert b"Header 1 for the test post" in response.data
+    assert b"H1 for the other test post" not in response.data
+    assert b"Older posts" not in response.data
+
+
 def test_post_layout_post(client):
     """
     GIVEN a Flask application
@@ -121,6 +287,11 @@ def test_successful_subscribe_post(client, app):
             data=dict(first=first, last=last, email=email),
         )
         assert response.status == "200 OK"
+        # the welcome email is queued, not sent during the request
+        assert len(outbox) == 0
+
+        with app.app_context():
+            assert run_once() == 1
 
         # assert email was sent to the new with the correct subject
         assert len(outbox) == 1
@@ -132,7 +303,7 @@ def test_successful_subscribe_post(client, app):
         sub = Subscribers.query.filter_by(email="test@example.com").first()
         assert sub is not None
 
-def test_bad_subscribe_post(client):
+def test_bad_subscribe_post(client, app):
     """
     GIVEN a Flask application
     WHEN the '/subscribe' page is posted to (POST)
@@ -154,8 +325,70 @@ def test_bad_subscribe_post(client):
         )
         assert response.status == "200 Duplicate Email"
 
-        # assert email was sent
-        assert len(outbox) == 0
+        # assert only the first welcome email was queued
+        with app.app_context():
+            assert run_once() == 1
+        assert len(outbox) == 1
+
+
+def test_subscribe_is_case_insensitive(client, app):
+    """
+    GIVEN a Flask application
+    WHEN the '/subscribe' page is posted to (POST) with an email that only differs by case
+    THEN check that it's treated as a duplicate and emails are stored lowercase
+    """
+    response = client.post(
+        "/subscribe", data=dict(first="first", last="last", email="Test_Email@Email.com ")
+    )
+    assert response.status == "200 Duplicate Email"
+
+    response = client.post(
+        "/subscribe", data=dict(first="first", last="last", email="New.Person@Example.com")
+    )
+    assert response.status == "200 OK"
+    with app.app_context():
+        assert Subscribers.query.filter_by(email="new.person@example.com").first() is not None
+
+
+def test_subscribe_single_statement(client, count_queries):
+    """
+    GIVEN a Flask application
+    WHEN the '/subscribe' page is posted to (POST)
+    THEN check that the subscriber is added without checking for duplicates first
+    """
+    with count_queries:
+        client.post("/subscribe", data=dict(first="a", last="b", email="one@example.com"))
+    subscriber_statements = [s for s in count_queries.statements if "subscribers" in s]
+    assert len(subscriber_statements) == 1
+    assert subscriber_statements[0].startswith("INSERT")
+
+    with count_queries:
+        response = client.post("/subscribe", data=dict(first="a", last="b", email="one@example.com"))
+    assert response.status == "200 Duplicate Email"
+    assert len(count_queries.statements) == 1
+
+
+def test_subscribe_survives_smtp_outage(client, app, monkeypatch):
+    """
+    GIVEN a Flask application whose SMTP server is down
+    WHEN the '/subscribe' page is posted to (POST)
+    THEN check that the subscriber is still added and the welcome email is retried later
+    """
+    def broken_connect(self):
+        raise ConnectionRefusedError("SMTP server is down")
+
+    monkeypatch.setattr(Connection, "__enter__", broken_connect)
+    response = client.post(
+        "/subscribe", data=dict(first="first", last="last", email="outage@example.com")
+    )
+    assert response.status == "200 OK"
+
+    with app.app_context():
+        run_once()
+        delivery = MailDeliveries.query.filter_by(kind="welcome").one()
+        assert delivery.status == "pending"
+        assert delivery.subscriber.email == "outage@example.com"
+        assert delivery.next_attempt_at is not None
 
 
 def test_rss_get(client):
@@ -168,6 +401,61 @@ def test_rss_get(client):
     assert response.status_code == 200
 
 
+def test_rss_item_cap(client, app):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/rss' page is requested (GET)
+    THEN check that only the newest FEED_ITEMS posts are included
+    """
+    app.config["FEED_ITEMS"] = 1
+    response = client.get("/rss")
+    assert response.data.count(b"<item>") == 1
+    assert b"H1 for the other test post" in response.data
+
+
+@pytest.mark.parametrize("path", ("/", "/post/header-1-for-the-test-post", "/code", "/rss"))
+def test_conditional_get(client, path):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a blog page is requested again with the validators it was sent with
+    THEN check that a '304' status code is returned without a body
+    """
+    response = client.get(path)
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+    response = client.get(path, headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    response = client.get(path, headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+def test_conditional_get_after_edit(client, auth, post_to_edit_without_file):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a post is edited
+    THEN check that the pages showing it get new ETags
+    """
+    post1, post2 = "/post/header-1-for-the-test-post", "/post/h1-for-the-other-test-post"
+    etags = {path: client.get(path).headers["ETag"] for path in ("/", post1, post2)}
+
+    auth.login()
+    client.post("admin/edit/1", data=post_to_edit_without_file)
+
+    for path in ("/", post1):
+        response = client.get(path, headers={"If-None-Match": etags[path]})
+        assert response.status_code == 200
+        assert b"This is the test edit post without a file" in response.data
+    response = client.get(post2, headers={"If-None-Match": etags[post2]})
+    assert response.status_code == 304
+
+
 def test_rss_post(client):
     """
     GIVEN a Flask application
@@ -0,0 +1,146 @@
+"""Tests for the gzip/brotli compression of responses"""
+import brotli
+import gzip
+import importlib
+import pytest
+from application import create_app
+from application.cache import page_cache
+from application.conditional import deploy_salt
+from types import SimpleNamespace
+import os
+
+# the module, application.compression is the extension
+compression = importlib.import_module("application.compression")
+
+POST = "/post/header-1-for-the-test-post"
+
+
+@pytest.fixture
+def small_threshold(app):
+    """
+    The app fixture compressing anything over 100 bytes, so the test pages are compressed.
+    """
+    app.config["COMPRESSION_MIN_SIZE"] = 100
+    return app
+
+
+@pytest.mark.parametrize("path", ("/", POST, "/code", "/rss"))
+def test_gzip(small_threshold, client, path):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a blog page is requested by a client that accepts gzip
+    THEN check that it's gzipped, varies on Accept-Encoding and has a weak ETag
+    """
+    identity = client.get(path)
+    response = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == identity.data
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.headers["ETag"] == f"W/{identity.headers['ETag']}"
+
+
+def test_brotli_preferred(small_threshold, client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a page is requested by a client that accepts brotli and gzip
+    THEN check that it's compressed with brotli
+    """
+    identity = client.get(POST)
+    response = client.get(POST, headers={"Accept-Encoding": "gzip, deflate, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(response.data) == identity.data
+
+
+def test_not_accepted(small_threshold, client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a page is requested by a client that doesn't accept any compression
+    THEN check that it's sent uncompressed, but still varies on Accept-Encoding
+    """
+    for headers in ({}, {"Accept-Encoding": "identity"}, {"Accept-Encoding": "gzip;q=0"}):
+        response = client.get(POST, headers=headers)
+        assert "Content-Encoding" not in response.headers
+        assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_small_or_other_responses_not_compressed(small_threshold, client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN responses below the size threshold or of types not in the allowlist are requested
+    THEN check that they're sent uncompressed and don't vary on Accept-Encoding
+    """
+    small_threshold.config["COMPRESSION_MIN_SIZE"] = 1024 * 1024
+    response = client.get(POST, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert "Vary" not in response.headers
+
+    small_threshold.config["COMPRESSION_MIN_SIZE"] = 100
+    small_threshold.config["COMPRESSION_MIMETYPES"] = ["application/json"]
+    response = client.get(POST, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compressed_conditional_get(small_threshold, client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN a compressed page is requested again with its weak ETag
+    THEN check that a '304' status code is returned
+    """
+    etag = client.get(POST, headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    response = client.get(POST, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_compressed_once(small_threshold, client, monkeypatch):
+    """
+    GIVEN a Flask application with the page cache turned on
+    WHEN the same page is requested compressed several times
+    THEN check that it's only compressed once per encoding
+    """
+    small_threshold.config["PAGE_CACHE_TYPE"] = "lru"
+    page_cache.init_app(small_threshold)
+    calls = []
+    compress = compression.compress
+
+    def counting_compress(data, encoding):
+        calls.append(encoding)
+        return compress(data, encoding)
+
+    monkeypatch.setattr(compression, "compress", counting_compress)
+    for _ in range(3):
+        assert client.get(POST, headers={"Accept-Encoding": "gzip"}).headers["Content-Encoding"] == "gzip"
+        assert client.get(POST, headers={"Accept-Encoding": "br"}).headers["Content-Encoding"] == "br"
+    assert calls == ["gzip", "br"]
+
+
+def test_compression_off(app):
+    """
+    GIVEN a Flask application with COMPRESSION off
+    WHEN a page is requested by a client that accepts gzip
+    THEN check that it's sent uncompressed
+    """
+    off = create_app({**app.config, "COMPRESSION": False, "COMPRESSION_MIN_SIZE": 100})
+    response = off.test_client().get(POST, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+
+
+def test_new_deploy_changes_compressed_copies(app, tmp_path):
+    """
+    GIVEN an app without HEROKU_SLUG_COMMIT (so no ETAG_SALT)
+    WHEN it's created, and when one of its templates changes
+    THEN check that the ETags are salted with a fingerprint of its files that changes too
+    """
+    salted = create_app({**app.config, "ETAG_SALT": ""})
+    assert salted.config["ETAG_SALT"] == deploy_salt(salted)
+
+    template = tmp_path / "templates" / "page.html"
+    template.parent.mkdir()
+    template.write_text("<p>old</p>")
+    fake_app = SimpleNamespace(root_path=str(tmp_path))
+    before = deploy_salt(fake_app)
+    assert deploy_salt(fake_app) == before
+    template.write_text("<p>new</p>")
+    os.utime(template, ns=(0, template.stat().st_mtime_ns + 1))
+    assert deploy_salt(fake_app) != before
@@ -0,0 +1,197 @@
+"""Tests for the static export of the public blog"""
+import json
+import os
+import pytest
+from application.cache import page_cache
+from application.database import db, Posts
+from application.export import export_site, static_export, MANIFEST
+
+PAGES = {
+    "/?": "index.html",
+    "/post/header-1-for-the-test-post?": os.path.join("post", "header-1-for-the-test-post", "index.html"),
+    "/post/h1-for-the-other-test-post?": os.path.join("post", "h1-for-the-other-test-post", "index.html"),
+    "/code?": os.path.join("code", "index.html"),
+    "/other?": os.path.join("other", "index.html"),
+    "/rss?": os.path.join("rss", "index.xml"),
+    "/atom?": os.path.join("atom", "index.xml"),
+    "/feed.json?": os.path.join("feed.json", "index.json"),
+}
+for category in ("code", "other"):
+    PAGES[f"/{category}/rss?"] = os.path.join(category, "rss", "index.xml")
+    PAGES[f"/{category}/atom?"] = os.path.join(category, "atom", "index.xml")
+    PAGES[f"/{category}/feed.json?"] = os.path.join(category, "feed.json", "index.json")
+
+# the pages showing the test post in the code category
+CODE_POST_PAGES = {
+    "/?", "/post/header-1-for-the-test-post?", "/code?", "/rss?", "/atom?", "/feed.json?",
+    "/code/rss?", "/code/atom?", "/code/feed.json?",
+}
+
+
+@pytest.fixture
+def export_app(app, tmp_path):
+    """
+    The app fixture with a page cache the export can take tokens from, and a site url.
+    """
+    app.config["PAGE_CACHE_TYPE"] = "lru"
+    app.config["SITE_URL"] = "https://blog.example.com"
+    app.config["STATIC_EXPORT_DIR"] = str(tmp_path)
+    page_cache.init_app(app)
+    return app
+
+
+@pytest.fixture
+def serving_app(export_app):
+    """
+    The export_app fixture serving exported pages from their files.
+    """
+    export_app.config["STATIC_EXPORT_SERVE"] = True
+    static_export.init_app(export_app)
+    return export_app
+
+
+def export(app, **kwargs):
+    with app.app_context():
+        return export_site(app.config["STATIC_EXPORT_DIR"], **kwargs)
+
+
+def read_manifest(app):
+    with open(os.path.join(app.config["STATIC_EXPORT_DIR"], MANIFEST)) as manifest:
+        return json.load(manifest)["pages"]
+
+
+def test_export_writes_every_page(export_app, client):
+    """
+    GIVEN a Flask application with two posts
+    WHEN the site is exported
+    THEN check that every public page is written and is what the app serves
+    """
+    assert export(export_app) == (len(PAGES), 0, 0)
+
+    pages = read_manifest(export_app)
+    assert {key: page["file"] for key, page in pages.items()} == PAGES
+    for key, page in pages.items():
+        response = client.get(key.rstrip("?"))
+        with open(os.path.join(export_app.config["STATIC_EXPORT_DIR"], page["file"]), "rb") as file:
+            assert file.read() == response.data
+        assert page["etag"] == response.get_etag()[0]
+    assert "post:1" in pages["/code?"]["tags"]
+
+
+def test_export_uses_the_site_url(export_app, client):
+    """
+    GIVEN a Flask application with a SITE_URL and a page cache
+    WHEN the site is exported and then the feed is requested
+    THEN check that the exported feed's links are on SITE_URL, and that the export didn't fill the page cache
+    """
+    export(export_app)
+    with open(os.path.join(export_app.config["STATIC_EXPORT_DIR"], PAGES["/rss?"]), "rb") as file:
+        feed = file.read()
+    assert b"https://blog.example.com/post/" in feed
+    assert b"localhost" not in feed
+    with export_app.test_request_context():
+        assert page_cache.get("/rss?") is None
+
+
+def test_export_needs_a_site_url(export_app):
+    """
+    GIVEN a Flask application without a SITE_URL
+    WHEN 'flask export-site' is run
+    THEN check that it refuses to export anything
+    """
+    export_app.config["SITE_URL"] = None
+    result = export_app.test_cli_runner().invoke(args=["export-site"])
+    assert result.exit_code != 0
+    assert "SITE_URL" in result.output
+    assert not os.path.exists(os.path.join(export_app.config["STATIC_EXPORT_DIR"], MANIFEST))
+
+
+def test_export_pages_of_older_posts(export_app):
+    """
+    GIVEN a Flask application with one post per page
+    WHEN the site is exported
+    THEN check that the pages of older posts are exported too
+    """
+    export_app.config["POSTS_PER_PAGE"] = 1
+    export(export_app)
+    pages = read_manifest(export_app)
+    assert pages["/?before=2"]["file"] == "index-before-2.html"
+    assert "/code?before=1" not in pages
+
+
+def test_export_is_incremental(export_app, client, auth, post_to_edit_without_file):
+    """
+    GIVEN an exported site
+    WHEN a post is edited and the site is exported again
+    THEN check that only the pages showing the post are rendered again
+    """
+    export(export_app)
+    assert export(export_app) == (0, len(PAGES), 0)
+
+    auth.login()
+    client.post("admin/edit/1", data=post_to_edit_without_file)
+    before = read_manifest(export_app)
+    assert export(export_app) == (len(CODE_POST_PAGES), len(PAGES) - len(CODE_POST_PAGES), 0)
+    after = read_manifest(export_app)
+    changed = {key for key in after if after[key]["etag"] != before[key]["etag"]}
+    assert changed == CODE_POST_PAGES
+
+    assert export(export_app, full=True) == (len(PAGES), 0, 0)
+
+
+def test_export_removes_pages_that_are_gone(export_app):
+    """
+    GIVEN a site exported with one post per page
+    WHEN it's exported again with more posts per page
+    THEN check that the pages that no longer exist are deleted
+    """
+    export_app.config["POSTS_PER_PAGE"] = 1
+    export(export_app)
+    export_app.config["POSTS_PER_PAGE"] = 10
+    rendered, unchanged, removed = export(export_app)
+    assert removed == 1
+    assert "/?before=2" not in read_manifest(export_app)
+    assert not os.path.exists(os.path.join(export_app.config["STATIC_EXPORT_DIR"], "index-before-2.html"))
+
+
+def test_serve_exported_pages(serving_app, client, count_queries):
+    """
+    GIVEN an exported site being served from its files
+    WHEN its pages are requested
+    THEN check that they're returned without running any queries, with 304s for current ETags
+    """
+    export(serving_app)
+    for key in PAGES:
+        path = key.rstrip("?")
+        with count_queries:
+            response = client.get(path)
+        assert count_queries.count == 0
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        with count_queries:
+            response = client.get(path, headers={"If-None-Match": etag})
+        assert count_queries.count == 0
+        assert response.status_code == 304
+    assert client.get("/rss").content_type.startswith("application/rss+xml")
+
+
+def test_serve_falls_back_to_dynamic(serving_app, client, auth, post_to_edit_without_file):
+    """
+    GIVEN an exported site being served from its files
+    WHEN a post is edited, or a page that wasn't exported is requested
+    THEN check that they're rendered dynamically
+    """
+    export(serving_app)
+    auth.login()
+    client.post("admin/edit/1", data=post_to_edit_without_file)
+
+    for key in CODE_POST_PAGES:
+        response = client.get(key.rstrip("?"))
+        assert b"This is the test edit post without a file" in response.data
+    assert b"H1 for the other test post" in client.get("/other").data
+
+    with serving_app.app_context():
+        db.session.add(Posts("New post", "sample", None, None, "<p>body</p>", "new"))
+        db.session.commit()
+    assert b"New post" in client.get("/new").data
@@ -0,0 +1,153 @@
+"""Tests for the RSS, Atom and JSON feeds"""
+import json
+import pytest
+import xml.etree.ElementTree as ElementTree
+from application import feeds
+from application.cache import page_cache
+from application.database import db, Posts
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+@pytest.fixture
+def feed_app(app):
+    """
+    The app fixture with a page cache to keep the feeds' entries in, and a site url.
+    """
+    app.config["PAGE_CACHE_TYPE"] = "lru"
+    app.config["SITE_URL"] = "https://blog.example.com"
+    page_cache.init_app(app)
+    return app
+
+
+def test_rss(feed_app, client):
+    """
+    GIVEN a Flask application with two posts
+    WHEN the '/rss' page is requested (GET)
+    THEN check that it's an RSS 2.0 feed of both posts, newest first, with absolute links
+    """
+    response = client.get("/rss")
+    assert response.content_type.startswith("application/rss+xml")
+    channel = ElementTree.fromstring(response.data).find("channel")
+    items = channel.findall("item")
+    assert [item.findtext("title") for item in items] == ["H1 for the other test post", "Header 1 for the test post"]
+    assert items[1].findtext("link") == "https://blog.example.com/post/header-1-for-the-test-post"
+    assert items[1].findtext("description") == "Hi this is a sample"
+    assert channel.find(f"{ATOM}link").get("href") == "https://blog.example.com/rss"
+
+
+def test_atom(feed_app, client):
+    """
+    GIVEN a Flask application with two posts
+    WHEN the '/atom' page is requested (GET)
+    THEN check that it's an Atom feed with an entry for each post
+    """
+    response = client.get("/atom")
+    assert response.content_type.startswith("application/atom+xml")
+    feed = ElementTree.fromstring(response.data)
+    entries = feed.findall(f"{ATOM}entry")
+    assert len(entries) == 2
+    assert entries[1].findtext(f"{ATOM}id") == "https://blog.example.com/post/1"
+    assert entries[1].find(f"{ATOM}link").get("href") == "https://blog.example.com/post/header-1-for-the-test-post"
+    assert entries[1].find(f"{ATOM}content") is None
+    assert feed.findtext(f"{ATOM}updated")
+
+
+def test_json_feed(feed_app, client):
+    """
+    GIVEN a Flask application with two posts
+    WHEN the '/feed.json' page is requested (GET)
+    THEN check that it's a JSON Feed with an item for each post
+    """
+    response = client.get("/feed.json")
+    assert response.content_type.startswith("application/feed+json")
+    feed = json.loads(response.data)
+    assert feed["version"] == "https://jsonfeed.org/version/1.1"
+    assert feed["feed_url"] == "https://blog.example.com/feed.json"
+    assert [item["id"] for item in feed["items"]] == ["2", "1"]
+    assert feed["items"][1]["content_text"] == "Hi this is a sample"
+
+
+@pytest.mark.parametrize("path", ("/code/rss", "/code/atom", "/code/feed.json"))
+def test_category_feeds(feed_app, client, path):
+    """
+    GIVEN a Flask application with a post in each of two categories
+    WHEN a category's feed is requested (GET)
+    THEN check that it only has the category's post
+    """
+    response = client.get(path)
+    assert response.status_code == 200
+    assert b"Header 1 for the test post" in response.data
+    assert b"H1 for the other test post" not in response.data
+
+
+def test_feed_full_content(feed_app, client):
+    """
+    GIVEN a Flask application with FEED_FULL_CONTENT on
+    WHEN the feeds are requested (GET)
+    THEN check that their entries have the posts' bodies with absolute image urls
+    """
+    feed_app.config["FEED_FULL_CONTENT"] = True
+    with feed_app.app_context():
+        post = Posts.query.get(1)
+        post.rendered_body = '<p>hi</p><img src="/static/a.jpg" srcset="/static/a-480.jpg 480w, /static/a-960.jpg 960w">'
+        db.session.commit()
+
+    feed = json.loads(client.get("/feed.json").data)
+    assert feed["items"][1]["content_html"] == (
+        '<p>hi</p><img src="https://blog.example.com/static/a.jpg" '
+        'srcset="https://blog.example.com/static/a-480.jpg 480w, https://blog.example.com/static/a-960.jpg 960w">'
+    )
+    entries = ElementTree.fromstring(client.get("/atom").data).findall(f"{ATOM}entry")
+    assert entries[1].findtext(f"{ATOM}content").startswith("<p>hi</p>")
+
+
+def test_feed_entries_are_cached(feed_app, client, auth, post_to_edit_without_file, monkeypatch):
+    """
+    GIVEN a Flask application whose feed has been requested
+    WHEN a post is edited and the feed is requested again
+    THEN check that only the edited post's entry is serialized again
+    """
+    client.get("/rss")
+    serialized = []
+
+    def rss_entry(post):
+        serialized.append(post.id)
+        return feeds.rss_entry(post)
+
+    monkeypatch.setitem(feeds.ENTRIES, "rss", rss_entry)
+    auth.login()
+    client.post("admin/edit/1", data=post_to_edit_without_file)
+    response = client.get("/rss")
+    assert b"This is the test edit post without a file" in response.data
+    assert b"H1 for the other test post" in response.data
+    assert serialized == [1]
+
+
+def test_feed_links_ignore_the_host(feed_app, client):
+    """
+    GIVEN a Flask application with a SITE_URL and a page cache
+    WHEN the feed is requested with a forged Host header and then with the real one
+    THEN check that neither of them has links to the forged host
+    """
+    forged = client.get("/rss", headers={"Host": "evil.example"})
+    assert b"evil.example" not in forged.data
+    assert b"https://blog.example.com/post/" in forged.data
+    assert b"evil.example" not in client.get("/rss").data
+
+
+def test_feeds_need_a_site_url(feed_app, client):
+    """
+    GIVEN a Flask application without a SITE_URL
+    WHEN the feed is requested in testing and outside debug and testing
+    THEN check that testing falls back to the development server's url, and the other fails
+    """
+    feed_app.config["SITE_URL"] = None
+    response = client.get("/rss", headers={"Host": "evil.example"})
+    assert b"evil.example" not in response.data
+    assert f"{feeds.DEVELOPMENT_URL}/post/".encode() in response.data
+
+    feed_app.testing = False
+    with feed_app.test_request_context("/rss"):
+        with pytest.raises(RuntimeError):
+            feeds.site_url()
@@ -0,0 +1,150 @@
+"""Tests for the image worker that makes the variants of uploaded images"""
+import pytest
+import datetime
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+from sqlalchemy import text
+from application import image_queue
+from application.database import db, Posts, BodyImages, ImageVariants
+
+
+@pytest.fixture
+def executor():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.fixture
+def image_folder():
+    """
+    A post image folder, any test-queue- files are removed afterwards.
+    """
+    folder = os.path.join("application", "static", "post_imgs", "test-queue")
+    os.makedirs(folder, exist_ok=True)
+    yield folder
+    for name in os.listdir(folder):
+        if name.startswith("test-queue-"):
+            os.remove(os.path.join(folder, name))
+    try:
+        os.rmdir(folder)
+    except OSError:
+        pass
+
+
+def add_body_image(post_id, folder, name, data):
+    with open(os.path.join(folder, name), "wb") as f:
+        f.write(data)
+    image = BodyImages(post_id, os.path.relpath(os.path.join(folder, name), "application"))
+    db.session.add(image)
+    db.session.commit()
+    return image.id
+
+
+def jpeg(width, height):
+    data = io.BytesIO()
+    Image.new("RGB", (width, height)).save(data, format="JPEG")
+    return data.getvalue()
+
+
+def test_unreadable_image_fails(app, executor, image_folder):
+    """
+    GIVEN a pending body image that isn't really an image
+    WHEN the image worker runs
+    THEN check that it's marked failed, without variants, and the original is still used
+    """
+    with app.app_context():
+        post = Posts.query.first()
+        good_id = add_body_image(post.id, image_folder, "test-queue-good.jpg", jpeg(600, 300))
+        bad_id = add_body_image(post.id, image_folder, "test-queue-bad.jpg", b"not an image")
+        before = post.updated
+
+        while image_queue.run_once(executor):
+            pass
+
+        good, bad = BodyImages.query.get(good_id), BodyImages.query.get(bad_id)
+        assert good.status == "ready"
+        assert {v.width for v in good.variants} == {480, 600}
+        assert bad.status == "failed"
+        assert bad.variants == []
+        assert "srcset" not in bad.picture
+        assert Posts.query.get(post.id).updated > before
+
+
+def test_images_encoded_outside_the_claim(app, image_folder, monkeypatch):
+    """
+    GIVEN two pending body images, one of which makes the encoder raise an unexpected error
+    WHEN the image worker runs
+    THEN check that they're claimed and committed before encoding, and the broken one is marked failed
+    """
+    encode_variants = image_queue.encode_variants
+    seen = {}
+
+    def encode(path, *args):
+        # what another connection sees while the image is being encoded
+        with engine.connect() as connection:
+            seen[os.path.basename(path)] = connection.execute(
+                text("SELECT status FROM body_images WHERE img_path LIKE :name"),
+                name=f"%{os.path.basename(path)}",
+            ).scalar()
+        if "broken" in path:
+            raise RuntimeError("encoder bug")
+        return encode_variants(path, *args)
+
+    monkeypatch.setattr(image_queue, "encode_variants", encode)
+    with app.app_context():
+        engine = db.engine
+        post = Posts.query.first()
+        good_id = add_body_image(post.id, image_folder, "test-queue-good.jpg", jpeg(600, 300))
+        broken_id = add_body_image(post.id, image_folder, "test-queue-broken.jpg", jpeg(600, 300))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert image_queue.run_once(executor) >= 2
+            assert image_queue.run_once(executor) == 0
+
+        assert seen["test-queue-good.jpg"] == seen["test-queue-broken.jpg"] == "processing"
+        assert BodyImages.query.get(good_id).status == "ready"
+        assert BodyImages.query.get(broken_id).status == "failed"
+        assert BodyImages.query.get(broken_id).variants == []
+
+
+def test_claims_of_dead_workers_expire(app, image_folder):
+    """
+    GIVEN a body image claimed by a worker that died
+    WHEN another worker looks for images, before and after IMAGE_QUEUE_LEASE
+    THEN check that it's only claimed again once the lease is over
+    """
+    with app.app_context():
+        post = Posts.query.first()
+        image_id = add_body_image(post.id, image_folder, "test-queue-lost.jpg", jpeg(600, 300))
+        assert [job.row_id for job in image_queue.claim_images(5) if job.image_id] == [image_id]
+        assert [job for job in image_queue.claim_images(5) if job.image_id] == []
+
+        image = BodyImages.query.get(image_id)
+        image.claimed_at -= datetime.timedelta(seconds=app.config["IMAGE_QUEUE_LEASE"] + 1)
+        db.session.commit()
+        assert [job.row_id for job in image_queue.claim_images(5) if job.image_id] == [image_id]
+
+
+def test_process_images_command(app, image_folder):
+    """
+    GIVEN body images that were uploaded before the image pipeline
+    WHEN 'flask process-images' is run
+    THEN check that they're queued and processed
+    """
+    with app.app_context():
+        post = Posts.query.first()
+        image_id = add_body_image(post.id, image_folder, "test-queue-old.jpg", jpeg(500, 500))
+        image = BodyImages.query.get(image_id)
+        image.status = "ready"
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["process-images"])
+    assert "Processed" in result.output
+
+    with app.app_context():
+        image = BodyImages.query.get(image_id)
+        assert image.status == "ready"
+        assert {(v.width, v.format) for v in image.variants} >= {(480, "webp"), (500, "jpeg")}
+        assert ImageVariants.query.filter_by(image_id=image_id).count() == len(image.variants)
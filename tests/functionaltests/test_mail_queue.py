@@ -0,0 +1,219 @@
+"""Tests for the mail queue that sends emails to subscribers in the background"""
+import pytest
+import datetime
+import smtplib
+from flask_mail import Connection
+from application.admin import mail
+from application.database import db, Subscribers, MailJobs, MailDeliveries
+from application.mail_delivery import delivery_engine
+from application.mail_queue import enqueue_newsletter, run_once, claim_deliveries
+
+
+@pytest.fixture
+def subscribers(app):
+    """
+    Adds more subscribers, one of which has unsubscribed.
+    """
+    with app.app_context():
+        for i in range(4):
+            db.session.add(Subscribers(f"First{i}", f"Last{i}", f"sub{i}@email.com"))
+        gone = Subscribers("Gone", "Gone", "gone@email.com")
+        gone.still_subscribed = False
+        db.session.add(gone)
+        db.session.commit()
+
+
+def test_enqueue_newsletter(app, subscribers, email):
+    """
+    GIVEN a Flask application with subscribers
+    WHEN a newsletter is queued
+    THEN check that there is one pending delivery per current subscriber and nothing is sent
+    """
+    with app.app_context(), mail.record_messages() as outbox:
+        job = enqueue_newsletter(**email)
+        assert job.status == "queued"
+        deliveries = MailDeliveries.query.filter_by(job_id=job.id).all()
+        assert len(deliveries) == 5
+        assert {d.status for d in deliveries} == {"pending"}
+        assert "gone@email.com" not in {d.subscriber.email for d in deliveries}
+        assert len(outbox) == 0
+
+
+def test_run_once_sends_in_batches(app, subscribers, email):
+    """
+    GIVEN a queued newsletter
+    WHEN the worker runs
+    THEN check that every subscriber gets one email and the job is marked done
+    """
+    with app.app_context(), mail.record_messages() as outbox:
+        job_id = enqueue_newsletter(**email).id
+        assert run_once(batch_size=3) == 3
+        assert MailJobs.query.get(job_id).status == "queued"
+        assert run_once(batch_size=3) == 2
+        assert run_once(batch_size=3) == 0
+
+        assert sorted(msg.recipients[0] for msg in outbox) == sorted(
+            ["test_email@email.com"] + [f"sub{i}@email.com" for i in range(4)]
+        )
+        job = MailJobs.query.get(job_id)
+        assert job.status == "done"
+        assert job.finished is not None
+        assert {d.status for d in job.deliveries} == {"sent"}
+
+
+def test_worker_resumes_after_crash(app, subscribers, email):
+    """
+    GIVEN deliveries that were claimed by a worker that died
+    WHEN another worker runs after the lease runs out
+    THEN check that only the unsent deliveries are sent
+    """
+    with app.app_context(), mail.record_messages() as outbox:
+        job_id = enqueue_newsletter(**email).id
+        # a worker claims two deliveries and dies before sending them
+        crashed = [d.id for d in claim_deliveries(2)]
+        # and another finished one
+        run_once(batch_size=1)
+        assert len(outbox) == 1
+
+        # the claimed deliveries are left alone while the lease lasts
+        run_once()
+        assert len(outbox) == 3
+
+        for delivery in MailDeliveries.query.filter(MailDeliveries.id.in_(crashed)):
+            delivery.claimed_at -= datetime.timedelta(
+                seconds=app.config["MAIL_QUEUE_LEASE"] + 1
+            )
+        db.session.commit()
+        assert run_once() == 2
+        assert len(outbox) == 5
+        assert len({msg.recipients[0] for msg in outbox}) == 5
+        assert MailJobs.query.get(job_id).status == "done"
+
+
+def test_deliveries_recorded_as_they_are_sent(app, subscribers, email, monkeypatch):
+    """
+    GIVEN a queued newsletter sent in one batch over one connection
+    WHEN the worker dies half way through the batch
+    THEN check that the deliveries sent before that are already recorded as sent
+    """
+    send = Connection.send
+    sent = []
+
+    def dying_send(connection, msg):
+        if len(sent) == 2:
+            raise RuntimeError("worker killed")
+        send(connection, msg)
+        sent.append(msg)
+
+    monkeypatch.setattr(Connection, "send", dying_send)
+    with app.app_context():
+        job_id = enqueue_newsletter(**email).id
+        with pytest.raises(RuntimeError):
+            run_once()
+        db.session.rollback()
+        statuses = [d.status for d in MailDeliveries.query.filter_by(job_id=job_id).order_by(MailDeliveries.id)]
+        assert statuses == ["sent", "sent", "sending", "sending", "sending"]
+
+
+def test_unfillable_newsletter_fails(app, email):
+    """
+    GIVEN a queued newsletter whose html body has a placeholder other than {name}
+    WHEN the worker runs
+    THEN check that the worker keeps going and the delivery fails once it's out of attempts
+    """
+    app.config["MAIL_QUEUE_MAX_ATTEMPTS"] = 1
+    with app.app_context(), mail.record_messages() as outbox:
+        job_id = enqueue_newsletter(email["subject"], email["body_text"], "<p>{foo}</p>").id
+        assert run_once() == 1
+        delivery = MailDeliveries.query.filter_by(job_id=job_id).one()
+        assert delivery.status == "failed"
+        assert "KeyError" in delivery.error
+        assert MailJobs.query.get(job_id).status == "done"
+        assert len(outbox) == 0
+
+
+def test_abandoned_deliveries_given_up(app, email):
+    """
+    GIVEN a delivery on its last attempt, claimed by a worker that died
+    WHEN another worker runs after the lease runs out
+    THEN check that it's marked failed instead of being claimed again
+    """
+    app.config["MAIL_QUEUE_MAX_ATTEMPTS"] = 1
+    with app.app_context(), mail.record_messages() as outbox:
+        job_id = enqueue_newsletter(**email).id
+        (delivery,) = claim_deliveries(1)
+        delivery.claimed_at -= datetime.timedelta(seconds=app.config["MAIL_QUEUE_LEASE"] + 1)
+        db.session.commit()
+
+        assert run_once() == 0
+        delivery = MailDeliveries.query.filter_by(job_id=job_id).one()
+        assert delivery.status == "failed"
+        assert delivery.attempts == 1
+        assert MailJobs.query.get(job_id).status == "done"
+        assert len(outbox) == 0
+
+
+def test_worker_keeps_one_engine(app):
+    """
+    GIVEN a Flask application
+    WHEN its delivery engine is asked for more than once
+    THEN check that it's the same one, so its per-minute limit holds across batches
+    """
+    with app.app_context():
+        assert delivery_engine() is delivery_engine()
+
+
+def test_failed_deliveries_are_retried(app, email, monkeypatch):
+    """
+    GIVEN a queued newsletter
+    WHEN sending fails
+    THEN check that the delivery is retried until MAIL_QUEUE_MAX_ATTEMPTS is reached
+    """
+    def broken_send(connection, msg):
+        raise smtplib.SMTPDataError(554, "Message rejected")
+
+    app.config["MAIL_QUEUE_MAX_ATTEMPTS"] = 2
+    monkeypatch.setattr(Connection, "send", broken_send)
+    with app.app_context():
+        job_id = enqueue_newsletter(**email).id
+
+        run_once()
+        delivery = MailDeliveries.query.filter_by(job_id=job_id).one()
+        assert delivery.status == "pending"
+        assert "Message rejected" in delivery.error
+
+        # it isn't retried until its backoff is over
+        assert run_once() == 0
+        delivery.next_attempt_at = datetime.datetime.now(datetime.timezone.utc)
+        db.session.commit()
+
+        run_once()
+        delivery = MailDeliveries.query.filter_by(job_id=job_id).one()
+        assert delivery.status == "failed"
+        assert delivery.attempts == 2
+        assert MailJobs.query.get(job_id).status == "done"
+        assert run_once() == 0
+
+
+def test_retry_backoff_doubles(app, email, monkeypatch):
+    """
+    GIVEN a queued newsletter that keeps failing
+    WHEN it's retried
+    THEN check that the wait before each retry doubles
+    """
+    def broken_send(connection, msg):
+        raise smtplib.SMTPDataError(554, "Message rejected")
+
+    app.config["MAIL_QUEUE_BACKOFF"] = 10
+    monkeypatch.setattr(Connection, "send", broken_send)
+    with app.app_context():
+        job_id = enqueue_newsletter(**email).id
+        waits = []
+        for attempt in range(3):
+            before = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            assert run_once() == 1
+            delivery = MailDeliveries.query.filter_by(job_id=job_id).one()
+            waits.append((delivery.next_attempt_at.replace(tzinfo=None) - before).total_seconds())
+            delivery.next_attempt_at = datetime.datetime.now(datetime.timezone.utc)
+            db.session.commit()
+        assert [round(w) for w in waits] == [10, 20, 40]
@@ -0,0 +1,166 @@
+from application import create_app
+import json
+import os
+import subprocess
+import sys
+
+"""Tests for the Prometheus metrics served at /metrics."""
+
+
+def sample(text, name, **labels):
+    """
+    The value of a sample in Prometheus text output, or None.
+    """
+    wanted = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        series_name, _, series_labels = series.partition("{")
+        if series_name == name and ",".join(sorted(series_labels.rstrip("}").split(","))) == wanted:
+            return float(value)
+    return None
+
+
+def test_request_metrics(client):
+    """
+    GIVEN a Flask application
+    WHEN pages are requested and then '/metrics' is scraped
+    THEN check that the requests are counted and timed by endpoint
+    """
+    before = client.get("/metrics").get_data(as_text=True)
+    count = sample(before, "flask_http_requests_total", method="GET", endpoint="blog.rss", status="200") or 0
+    client.get("/rss")
+    client.get("/rss")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert sample(text, "flask_http_requests_total", method="GET", endpoint="blog.rss", status="200") == count + 2
+    assert sample(text, "flask_http_request_duration_seconds_count", endpoint="blog.rss") >= 2
+    assert sample(text, "db_pool_checked_out_connections") is not None
+    assert sample(text, "mail_queue_deliveries", status="pending") == 0
+
+
+def test_unknown_methods_share_a_label(client):
+    """
+    GIVEN a Flask application
+    WHEN requests are made with made up HTTP methods
+    THEN check that they're all counted under the 'other' method instead of one series each
+    """
+    before = client.get("/metrics").get_data(as_text=True)
+    count = sample(before, "flask_http_requests_total", method="other", endpoint="<no endpoint>", status="405") or 0
+    for n in range(3):
+        client.open("/rss", method=f"FOO{n}")
+    text = client.get("/metrics").get_data(as_text=True)
+    assert "FOO" not in text
+    assert sample(text, "flask_http_requests_total", method="other", endpoint="<no endpoint>", status="405") == count + 3
+
+
+def test_page_cache_metrics(app):
+    """
+    GIVEN a Flask application with the page cache on
+    WHEN a page is requested twice
+    THEN check that there's a page cache miss and a hit
+    """
+    cached_app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': os.getenv("TEST_DATABASE_URL"),
+        'PAGE_CACHE_TYPE': 'lru',
+        'SCHEMA_CHECK': False,
+    })
+    client = cached_app.test_client()
+    before = client.get("/metrics").get_data(as_text=True)
+    hits = sample(before, "page_cache_requests_total", result="hit") or 0
+    misses = sample(before, "page_cache_requests_total", result="miss") or 0
+    client.get("/code")
+    client.get("/code")
+    text = client.get("/metrics").get_data(as_text=True)
+    assert sample(text, "page_cache_requests_total", result="hit") == hits + 1
+    assert sample(text, "page_cache_requests_total", result="miss") == misses + 1
+
+
+def test_metrics_token(app):
+    """
+    GIVEN a Flask application with a METRICS_TOKEN
+    WHEN '/metrics' is scraped with and without the token
+    THEN check that it's only served with the token
+    """
+    app.config["METRICS_TOKEN"] = "s3cret"
+    client = app.test_client()
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+
+def test_metrics_off(app):
+    """
+    GIVEN a Flask application with METRICS off
+    WHEN '/metrics' is requested
+    THEN check that no metrics are served (it's just an empty category page)
+    """
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': os.getenv("TEST_DATABASE_URL"),
+        'SCHEMA_CHECK': False,
+        'METRICS': False,
+    })
+    assert b"flask_http_requests_total" not in app.test_client().get("/metrics").data
+
+
+def test_metrics_need_a_token_in_production(app, monkeypatch):
+    """
+    GIVEN a Flask application that isn't in debug or testing
+    WHEN '/metrics' is requested without and with a METRICS_TOKEN configured
+    THEN check that it's only served when there's a token
+    """
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    # the same database as the app fixture
+    config = {
+        'SQLALCHEMY_DATABASE_URI': app.config["SQLALCHEMY_DATABASE_URI"],
+        'SQLALCHEMY_ENGINE_OPTIONS': app.config["SQLALCHEMY_ENGINE_OPTIONS"],
+        'SCHEMA_CHECK': False,
+    }
+    app = create_app(config)
+    assert b"flask_http_requests_total" not in app.test_client().get("/metrics").data
+
+    app = create_app(dict(config, METRICS_TOKEN="s3cret"))
+    client = app.test_client()
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+
+WORKER = """
+import json, sys
+from application import create_app
+app = create_app({
+    "TESTING": True,
+    "SQLALCHEMY_DATABASE_URI": sys.argv[1],
+    "SQLALCHEMY_ENGINE_OPTIONS": json.loads(sys.argv[2]),
+    "SCHEMA_CHECK": False,
+    "PAGE_CACHE_TYPE": "null",
+})
+client = app.test_client()
+for _ in range(int(sys.argv[3])):
+    client.get("/rss")
+if len(sys.argv) > 4:
+    sys.stdout.write(client.get("/metrics").get_data(as_text=True))
+"""
+
+
+def test_multiprocess_metrics(app, tmp_path):
+    """
+    GIVEN worker processes sharing a prometheus_multiproc_dir
+    WHEN each of them serves requests and one of them is scraped
+    THEN check that '/metrics' adds up the requests of every process
+    """
+    env = dict(os.environ, prometheus_multiproc_dir=str(tmp_path))
+    # the workers use the same database as the app fixture
+    database = [app.config["SQLALCHEMY_DATABASE_URI"], json.dumps(app.config["SQLALCHEMY_ENGINE_OPTIONS"])]
+    for requests in (2, 3):
+        subprocess.run([sys.executable, "-c", WORKER, *database, str(requests)], env=env, check=True)
+    scrape = subprocess.run(
+        [sys.executable, "-c", WORKER, *database, "1", "scrape"],
+        env=env, check=True, capture_output=True, text=True,
+    )
+    assert sample(scrape.stdout, "flask_http_requests_total", method="GET", endpoint="blog.rss", status="200") == 6
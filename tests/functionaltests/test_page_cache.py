@@ -0,0 +1,116 @@
+"""Tests for the rendered-page cache of the blog routes"""
+import pytest
+from application import blog
+from application.cache import page_cache, post_tag
+from application.database import db, Posts
+
+
+@pytest.fixture(params=["lru", "filesystem"])
+def cached_app(app, request, tmp_path):
+    """
+    The app fixture with the page cache turned on.
+    """
+    app.config["PAGE_CACHE_TYPE"] = request.param
+    app.config["PAGE_CACHE_DIR"] = str(tmp_path)
+    page_cache.init_app(app)
+    return app
+
+
+def test_cached_page_skips_database(cached_app, client, count_queries):
+    """
+    GIVEN a Flask application with the page cache turned on
+    WHEN the same blog pages are requested twice
+    THEN check that the second response is identical and runs no queries
+    """
+    for path in ("/", "/post/header-1-for-the-test-post", "/code", "/rss"):
+        first = client.get(path)
+        assert first.status_code == 200
+        with count_queries:
+            second = client.get(path)
+        assert count_queries.count == 0
+        assert second.status_code == 200
+        assert second.data == first.data
+        assert second.content_type == first.content_type
+
+
+def test_cached_page_not_modified(cached_app, client, count_queries):
+    """
+    GIVEN a Flask application with the page cache turned on
+    WHEN a cached page is requested with a matching If-None-Match header
+    THEN check that a '304' status code is returned without running any queries
+    """
+    etag = client.get("/post/header-1-for-the-test-post").headers["ETag"]
+    with count_queries:
+        response = client.get("/post/header-1-for-the-test-post", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert count_queries.count == 0
+
+
+def test_page_invalidated_while_rendering_not_cached(cached_app, client, count_queries, monkeypatch):
+    """
+    GIVEN a Flask application with the page cache turned on
+    WHEN a post is edited (and its tag invalidated) while its page is being rendered
+    THEN check that the page, which may show the old post, isn't cached
+    """
+    with cached_app.app_context():
+        post_id = Posts.query.filter_by(slug="header-1-for-the-test-post").one().id
+    render_template = blog.render_template
+
+    def render_during_edit(*args, **kwargs):
+        page_cache.invalidate(post_tag(post_id))
+        return render_template(*args, **kwargs)
+
+    monkeypatch.setattr(blog, "render_template", render_during_edit)
+    assert client.get("/post/header-1-for-the-test-post").status_code == 200
+    monkeypatch.setattr(blog, "render_template", render_template)
+    with count_queries:
+        assert client.get("/post/header-1-for-the-test-post").status_code == 200
+    assert count_queries.count > 0
+    with count_queries:
+        client.get("/post/header-1-for-the-test-post")
+    assert count_queries.count == 0
+
+
+def test_create_invalidates_listings(cached_app, client, auth, post_to_upload_without_file):
+    """
+    GIVEN a Flask application with the page cache turned on
+    WHEN a new post is created
+    THEN check that the listings it belongs to are re-rendered, but other pages are not
+    """
+    client.get("/")
+    client.get("/other")
+    client.get("/code")
+    client.get("/rss")
+
+    auth.login()
+    post_to_upload_without_file["category"] = "other"
+    client.post("admin/create", data=post_to_upload_without_file)
+
+    assert b"This is the test post" in client.get("/").data
+    assert b"This is the test post" in client.get("/other").data
+    assert b"This is the test post" in client.get("/rss").data
+
+    # the code listing doesn't show the post so it stays cached
+    with cached_app.app_context():
+        db.session.add(Posts("Sneaky post", "sample", None, None, "<p>body</p>", "code"))
+        db.session.commit()
+    assert b"Sneaky post" not in client.get("/code").data
+
+
+def test_edit_invalidates_pages_showing_post(cached_app, client, auth, post_to_edit_without_file):
+    """
+    GIVEN a Flask application with the page cache turned on
+    WHEN a post is edited
+    THEN check that every cached page showing that post is re-rendered
+    """
+    for path in ("/", "/post/header-1-for-the-test-post", "/code", "/rss"):
+        assert b"Header 1 for the test post" in client.get(path).data
+    client.get("/post/h1-for-the-other-test-post")
+
+    auth.login()
+    client.post("admin/edit/1", data=post_to_edit_without_file)
+
+    for path in ("/", "/post/header-1-for-the-test-post", "/code", "/rss"):
+        response = client.get(path)
+        assert b"This is the test edit post without a file" in response.data
+        assert b"Header 1 for the test post" not in response.data
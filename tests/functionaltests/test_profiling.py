@@ -0,0 +1,123 @@
+import pytest
+from application import create_app
+import os
+
+"""Tests for the opt-in per-request profiling."""
+
+
+@pytest.fixture
+def profiled_app(app, tmp_path):
+    """
+    An app with profiling on, using the test database the app fixture filled.
+    """
+    return create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': os.getenv("TEST_DATABASE_URL"),
+        'PAGE_CACHE_TYPE': 'null',
+        'SCHEMA_CHECK': False,
+        'PROFILING': True,
+        'PROFILING_SLOW_MS': 0,
+        'PROFILING_SAMPLE_ENDPOINTS': ['blog.view_post'],
+        'PROFILING_SAMPLE_INTERVAL_MS': 0.1,
+        'PROFILING_SAMPLE_DIR': str(tmp_path),
+    })
+
+
+def test_server_timing(profiled_app):
+    """
+    GIVEN a Flask application with profiling on
+    WHEN a page is requested
+    THEN check that the Server-Timing header has the SQL, template and total times
+    """
+    response = profiled_app.test_client().get("/")
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("db;dur=")
+    assert "render;dur=" in timing
+    assert "total;dur=" in timing
+    queries = int(timing.split('desc="')[1].split(" ")[0])
+    assert queries > 0
+
+
+def test_no_server_timing_when_off(client):
+    """
+    GIVEN a Flask application with profiling off
+    WHEN a page is requested
+    THEN check that there's no Server-Timing header
+    """
+    assert "Server-Timing" not in client.get("/").headers
+
+
+def test_slow_request_logged(profiled_app, caplog):
+    """
+    GIVEN a Flask application with profiling on and a 0 ms slow request threshold
+    WHEN a page is requested
+    THEN check that the request is logged along with its queries
+    """
+    profiled_app.test_client().get("/code")
+    messages = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Slow request")]
+    assert len(messages) == 1
+    assert "GET /code" in messages[0]
+    assert "FROM posts" in messages[0]
+
+
+def test_mail_timed(profiled_app, email):
+    """
+    GIVEN a Flask application with profiling on
+    WHEN a logged in admin sends a test email
+    THEN check that the time spent sending it through the delivery engine is in the Server-Timing header
+    """
+    client = profiled_app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = "test"
+    response = client.post("/admin/send-test", data=email)
+    assert response.status_code == 204
+    assert "mail;dur=" in response.headers["Server-Timing"]
+
+
+def test_sampled_endpoint_stacks(profiled_app, tmp_path):
+    """
+    GIVEN a Flask application sampling the blog.view_post endpoint
+    WHEN a post is viewed
+    THEN check that its stacks are saved in the folded format
+    """
+    client = profiled_app.test_client()
+    for _ in range(5):
+        client.get("/post/header-1-for-the-test-post")
+    client.get("/")
+    assert os.listdir(tmp_path) == ["blog.view_post.folded"]
+    lines = (tmp_path / "blog.view_post.folded").read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert ";" in stack
+
+
+def test_profiling_page(profiled_app):
+    """
+    GIVEN a Flask application with profiling on
+    WHEN a logged in admin opens '/admin/profiling' after some requests
+    THEN check that the endpoints' stats are shown
+    """
+    client = profiled_app.test_client()
+    client.get("/")
+    client.get("/rss")
+    with client.session_transaction() as session:
+        session["user_id"] = "test"
+    response = client.get("/admin/profiling")
+    assert response.status_code == 200
+    assert b"blog.index" in response.data
+    assert b"blog.rss" in response.data
+
+
+def test_profiling_page_when_off(client, auth):
+    """
+    GIVEN a Flask application with profiling off
+    WHEN a logged in admin opens '/admin/profiling'
+    THEN check that it says profiling is off
+    """
+    auth.login()
+    response = client.get("/admin/profiling")
+    assert response.status_code == 200
+    assert b"Profiling is off" in response.data
@@ -0,0 +1,101 @@
+"""Tests for searching the posts"""
+import pytest
+from application.database import db, Posts
+from application.search import search_posts, InvertedIndex, highlight
+
+
+@pytest.fixture
+def search_posts_data(app):
+    """
+    Adds posts that mention pandas in different places, and twelve about climbing.
+    """
+    with app.app_context():
+        db.session.add(Posts(
+            "Learning pandas in a week", "A crash course", None, "", "<p>Dataframes and plots.</p>", "code"
+        ))
+        db.session.add(Posts(
+            "Flask tips", "Some tips", None, "",
+            "<p>I used <b>pandas</b> to clean the data &amp; plot it.</p>", "code"
+        ))
+        for i in range(12):
+            db.session.add(Posts(
+                f"Climbing trip {i}", "Rocks", None, "", f"<p>Climbing day {i}</p>", "other"
+            ))
+        db.session.commit()
+
+
+def test_search_ranks_title_matches_first(client, search_posts_data):
+    """
+    GIVEN posts that mention a word in their title or their body
+    WHEN that word is searched for
+    THEN check that both are found, title matches first, with highlighted snippets
+    """
+    response = client.get("/search?q=pandas")
+    assert response.status_code == 200
+    html = response.data.decode()
+    assert html.index("Learning pandas in a week") < html.index("Flask tips")
+    assert "<mark>pandas</mark> to clean the data &amp; plot it" in html
+    assert "<b>" not in html
+    assert "hi I edited this" not in html
+
+
+def test_search_every_term_must_match(app, search_posts_data):
+    """
+    GIVEN posts
+    WHEN several words are searched for
+    THEN check that only the posts with all of them are found
+    """
+    with app.app_context():
+        page = search_posts("pandas plot")
+        assert [r.post.h1 for r in page.results] == ["Flask tips"]
+        assert search_posts("pandas giraffes").results == []
+        assert search_posts("   ").results == []
+
+
+def test_search_pagination(client, app, search_posts_data):
+    """
+    GIVEN more matching posts than fit on a page
+    WHEN the pages of results are requested
+    THEN check that every post is found once and the pages link to each other
+    """
+    with app.app_context():
+        first = search_posts("climbing", per_page=10)
+        second = search_posts("climbing", page=2, per_page=10)
+    assert len(first.results) == 10 and first.has_next
+    assert len(second.results) == 2 and not second.has_next
+    ids = [r.post.id for r in first.results + second.results]
+    assert len(set(ids)) == 12
+
+    html = client.get("/search?q=climbing").data.decode()
+    assert "page=2" in html
+    html = client.get("/search?q=climbing&page=2").data.decode()
+    assert "Better matches" in html
+    assert "More results" not in html
+
+
+def test_search_no_results(client):
+    """
+    GIVEN a Flask application
+    WHEN a word that isn't in any post is searched for
+    THEN check that the page says so and escapes the query
+    """
+    response = client.get("/search?q=<em>zebras</em>")
+    assert response.status_code == 200
+    assert b"No posts match" in response.data
+    assert b"&lt;em&gt;zebras&lt;/em&gt;" in response.data
+
+
+def test_inverted_index_highlight():
+    """
+    GIVEN an inverted index of posts
+    WHEN it is searched
+    THEN check that scores follow the field weights and snippets are escaped and marked
+    """
+    title = Posts("Rust", "", None, "", "", "code")
+    body = Posts("Go", "", None, "", "<p>rust and rust</p>", "code")
+    # the posts aren't saved, so give them ids
+    title.id, body.id = 1, 2
+    index = InvertedIndex([body, title])
+    assert index.search("Rust") == [1, 2]
+    assert index.search("go rust") == [2]
+    assert highlight("a < b, then rust", {"rust"}) == "a &lt; b, then <mark>rust</mark>"
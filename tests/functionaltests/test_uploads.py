@@ -0,0 +1,182 @@
+"""Tests for streaming file uploads and their size limits"""
+import hashlib
+import io
+import os
+import pytest
+import tracemalloc
+from application.database import Posts
+from application.uploads import save_upload
+from flask import jsonify, request
+from werkzeug.test import EnvironBuilder
+
+KB = 1024
+
+
+@pytest.fixture
+def upload_app(app, tmp_path):
+    """
+    The app fixture with a route that saves every uploaded file to a folder
+    and small size limits.
+    """
+    saved = tmp_path / "saved"
+    saved.mkdir()
+    app.config["UPLOAD_TMP_DIR"] = str(tmp_path / "uploading")
+    os.makedirs(app.config["UPLOAD_TMP_DIR"])
+    app.config["UPLOAD_MAX_FILE_SIZE"] = 600 * KB
+    app.config["UPLOAD_MAX_REQUEST_SIZE"] = app.config["MAX_CONTENT_LENGTH"] = 4 * 1024 * KB
+
+    def upload():
+        digests = {}
+        for field in request.files:
+            for file in request.files.getlist(field):
+                if field == "keep":
+                    digests[file.filename] = save_upload(file, os.path.join(saved, file.filename))
+        return jsonify(digests)
+
+    app.add_url_rule("/test-upload", "test_upload", upload, methods=["POST"])
+    app.config["saved"] = str(saved)
+    return app
+
+
+def files(count, size):
+    return [(io.BytesIO(os.urandom(size)), f"file-{n}.bin") for n in range(count)]
+
+
+def test_files_under_the_limit_saved(upload_app, client):
+    """
+    GIVEN an app that allows 600 KB per file and 4 MB per request
+    WHEN 5 files of 500 KB (2.5 MB) are uploaded
+    THEN check that they're all saved with the right hashes and no temporary files are left
+    """
+    uploads = files(5, 500 * KB)
+    expected = {name: hashlib.sha256(data.getvalue()).hexdigest() for data, name in uploads}
+    response = client.post("/test-upload", data={"keep": uploads}, content_type="multipart/form-data")
+    assert response.status_code == 200
+    assert response.get_json() == expected
+    for name, digest in expected.items():
+        with open(os.path.join(upload_app.config["saved"], name), "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == digest
+    assert os.listdir(upload_app.config["UPLOAD_TMP_DIR"]) == []
+
+
+def test_file_over_the_limit(upload_app, client):
+    """
+    GIVEN an app that allows 600 KB per file
+    WHEN a file of 700 KB is uploaded
+    THEN check that a '413' status code is returned and nothing is left on disk
+    """
+    response = client.post(
+        "/test-upload", data={"keep": files(1, 700 * KB)}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 413
+    assert os.listdir(upload_app.config["saved"]) == []
+    assert os.listdir(upload_app.config["UPLOAD_TMP_DIR"]) == []
+
+
+def test_request_over_the_limit(upload_app, client):
+    """
+    GIVEN an app that allows 4 MB per request
+    WHEN 10 files of 500 KB are uploaded
+    THEN check that a '413' status code is returned
+    """
+    response = client.post(
+        "/test-upload", data={"keep": files(10, 500 * KB)}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 413
+    assert os.listdir(upload_app.config["saved"]) == []
+
+
+def test_unsaved_uploads_removed(upload_app, client):
+    """
+    GIVEN an app streaming uploads to temporary files
+    WHEN files are uploaded that the view doesn't save
+    THEN check that their temporary files are removed after the request
+    """
+    response = client.post(
+        "/test-upload", data={"ignored": files(2, 100 * KB)}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 200
+    assert os.listdir(upload_app.config["UPLOAD_TMP_DIR"]) == []
+
+
+def test_upload_memory_is_constant(upload_app, tmp_path):
+    """
+    GIVEN an app that allows 16 MB per file and 64 MB per request
+    WHEN 24 MB of files are uploaded, read from disk
+    THEN check that handling the request never holds more than 1 MB in memory
+    """
+    upload_app.config["UPLOAD_MAX_FILE_SIZE"] = 16 * 1024 * KB
+    upload_app.config["MAX_CONTENT_LENGTH"] = 64 * 1024 * KB
+    boundary = "uploadboundary"
+    body = tmp_path / "body"
+    with open(body, "wb") as f:
+        for n in range(3):
+            f.write(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="keep"; filename="big-{n}.bin"\r\n'
+                f"Content-Type: application/octet-stream\r\n\r\n".encode()
+            )
+            for _ in range(8):
+                f.write(os.urandom(1024 * KB))
+            f.write(b"\r\n")
+        f.write(f"--{boundary}--\r\n".encode())
+
+    with open(body, "rb") as stream:
+        environ = EnvironBuilder(
+            path="/test-upload",
+            method="POST",
+            input_stream=stream,
+            content_type=f"multipart/form-data; boundary={boundary}",
+            content_length=os.path.getsize(body),
+        ).get_environ()
+        statuses = []
+        tracemalloc.start()
+        try:
+            output = b"".join(upload_app(environ, lambda status, headers: statuses.append(status)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    assert statuses == ["200 OK"], output
+    assert sorted(os.listdir(upload_app.config["saved"])) == ["big-0.bin", "big-1.bin", "big-2.bin"]
+    assert peak < 1024 * KB
+
+
+def test_large_bodies_refused_outside_the_admin(client):
+    """
+    GIVEN a Flask application with the default limits
+    WHEN a 5 MB multipart body is posted to '/subscribe'
+    THEN check that a '413' status code is returned, since only the admin's create and edit take large uploads
+    """
+    response = client.post(
+        "/subscribe",
+        data={"first": "a", "last": "b", "email": "a@example.com", "file": files(1, 5 * 1024 * KB)},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 413
+
+
+def test_create_post_with_several_images(client, auth, post_to_upload_without_file, app):
+    """
+    GIVEN a Flask application
+    WHEN a post is created with 3 body images of 600 KB each
+    THEN check that it's created with all of them, since only each image is limited
+    """
+    post_to_upload_without_file["body_imgs"] = [
+        (io.BytesIO(os.urandom(600 * KB)), f"test-upload-{n}.jpg") for n in range(3)
+    ]
+    auth.login()
+    response = client.post("admin/create", data=post_to_upload_without_file)
+    assert response.status_code == 302
+
+    with app.app_context():
+        post = Posts.query.filter_by(h1="This is the test post").one()
+        paths = [os.path.join("application", image.img_path) for image in post.images]
+    try:
+        assert len(paths) == 3
+        assert all(os.path.getsize(path) == 600 * KB for path in paths)
+    finally:
+        for path in paths:
+            os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(paths[0]))
+        except (OSError, IndexError):
+            pass
@@ -2,8 +2,12 @@
 
 from application import create_app
 from application.database import Subscribers, Posts, db
+from benchmarks import dataset
+import sys
 
 # heroku run python --app kellyfoulk-staging -- tests/staging-app/test_data.py
+# generated posts and subscribers can be added too (see benchmarks/dataset.py):
+# heroku run python --app kellyfoulk-staging -- tests/staging-app/test_data.py 500 5000
 
 app = create_app()
 with app.app_context():
@@ -28,4 +32,9 @@ with app.app_context():
     post2 = Posts(h1, sample, header_path, youtube_vid, body, category)
     db.session.add(post2)
     
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+
+    if len(sys.argv) > 1:
+        posts = int(sys.argv[1])
+        subscribers = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+        dataset.generate(posts, subscribers)
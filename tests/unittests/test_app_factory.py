@@ -1,4 +1,9 @@
-from application import create_app
+from application import create_app, schema
+from application.database import db
+from sqlalchemy import text
+import os
+import subprocess
+import sys
 
 """Tests the app factory setup."""
 
@@ -12,3 +17,59 @@ def test_config():
     assert create_app({'TESTING': True}).testing
 
 
+def test_startup_does_not_touch_the_database():
+    """
+    GIVEN a database that can't be reached
+    WHEN the app is created
+    THEN check that it starts anyway, since the schema is left to the migrations
+    """
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql://nobody@127.0.0.1:1/nothing'})
+    assert 'blog.index' in app.view_functions
+
+
+def test_wsgi_import_skips_flask_migrate(tmp_path):
+    """
+    GIVEN the wsgi module gunicorn loads
+    WHEN it is imported outside the flask command
+    THEN check that Flask-Migrate (and alembic) aren't imported
+    """
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + str(tmp_path / 'startup.db'))
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    output = subprocess.check_output(
+        [sys.executable, '-c', "import sys, wsgi; print('alembic' in sys.modules, 'flask_migrate' in sys.modules)"],
+        env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    )
+    assert output.split() == [b'False', b'False']
+
+
+def test_schema_check(tmp_path, caplog):
+    """
+    GIVEN a database at an old migration
+    WHEN the first requests are served
+    THEN check that an error is logged once, and that it clears when the database is upgraded
+    """
+    def sqlite_app(name):
+        return create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / name),
+        })
+
+    app = sqlite_app('old.db')
+    with app.app_context():
+        db.session.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32))"))
+        db.session.execute(text("INSERT INTO alembic_version VALUES ('b084cbb1c085')"))
+        db.session.commit()
+    app.test_client().get('/styles')
+    app.test_client().get('/styles')
+    errors = [r for r in caplog.records if 'schema is out of date' in r.getMessage()]
+    assert len(errors) == 1
+    assert 'b084cbb1c085' in errors[0].getMessage()
+
+    app = sqlite_app('new.db')
+    with app.app_context():
+        db.session.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32))"))
+        assert len(schema.head_revisions()) == 1
+        for head in schema.head_revisions():
+            db.session.execute(text("INSERT INTO alembic_version VALUES (:head)"), {'head': head})
+        db.session.commit()
+        assert schema.check_schema() is None
@@ -0,0 +1,50 @@
+from application.cache import LRUCache
+import time
+
+
+def test_lru_cache_get_set():
+    """
+    GIVEN an LRUCache
+    WHEN values are set and deleted
+    THEN check that get returns them until they're deleted
+    """
+    cache = LRUCache(max_entries=10, default_timeout=0)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.has("a")
+    assert cache.delete("a")
+    assert cache.get("a") is None
+    assert not cache.delete("a")
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """
+    GIVEN an LRUCache that is full
+    WHEN a new value is set
+    THEN check that the least recently used value is evicted
+    """
+    cache = LRUCache(max_entries=2, default_timeout=0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # reading 'a' makes 'b' the least recently used
+    cache.get("a")
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries():
+    """
+    GIVEN an LRUCache
+    WHEN a value is older than its timeout
+    THEN check that it is no longer returned
+    """
+    cache = LRUCache(max_entries=10, default_timeout=300)
+    cache.set("a", 1, timeout=0.01)
+    cache.set("b", 2)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
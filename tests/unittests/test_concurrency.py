@@ -0,0 +1,131 @@
+import pytest
+from application import create_app
+from application.concurrency import engine_options, gunicorn_settings
+
+"""Tests for deriving the gunicorn and database pool settings from the environment."""
+
+POSTGRES = "postgresql://localhost/personal_website"
+
+
+@pytest.mark.parametrize(
+    "profile, workers, threads",
+    [
+        ("sync", 9, 1),
+        ("gthread", 5, 4),
+        ("gevent", 5, 1),
+    ],
+)
+def test_gunicorn_settings_defaults(profile, workers, threads):
+    """
+    GIVEN a gunicorn profile and a 4 CPU machine
+    WHEN the gunicorn settings are derived without any other environment variables
+    THEN check that the worker class, number of workers and threads follow the CPU count
+    """
+    settings = gunicorn_settings({"GUNICORN_PROFILE": profile}, cpus=4)
+    assert settings["worker_class"] == profile
+    assert settings["workers"] == workers
+    assert settings["threads"] == threads
+    assert settings["preload_app"] is True
+
+
+def test_gunicorn_settings_from_environment():
+    """
+    GIVEN WEB_CONCURRENCY and GUNICORN_* environment variables
+    WHEN the gunicorn settings are derived
+    THEN check that the environment wins over the CPU count defaults
+    """
+    settings = gunicorn_settings(
+        {"WEB_CONCURRENCY": "2", "GUNICORN_THREADS": "8", "GUNICORN_PRELOAD": "false"}, cpus=4
+    )
+    assert settings["worker_class"] == "gthread"
+    assert settings["workers"] == 2
+    assert settings["threads"] == 8
+    assert settings["preload_app"] is False
+
+
+def test_gunicorn_settings_unknown_profile():
+    """
+    GIVEN a GUNICORN_PROFILE that doesn't exist
+    WHEN the gunicorn settings are derived
+    THEN check that it's refused
+    """
+    with pytest.raises(ValueError):
+        gunicorn_settings({"GUNICORN_PROFILE": "tornado"}, cpus=4)
+
+
+@pytest.mark.parametrize(
+    "profile, pool_size",
+    [
+        ("sync", 1),
+        ("gthread", 4),
+        ("gevent", 10),
+    ],
+)
+def test_engine_options_pool_follows_profile(profile, pool_size):
+    """
+    GIVEN a gunicorn profile
+    WHEN the engine options are derived
+    THEN check that the pool has a connection for each request a worker serves at once (at most 10)
+    """
+    options = engine_options(POSTGRES, {"GUNICORN_PROFILE": profile}, statement_timeout=20000)
+    assert options["pool_size"] == pool_size
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"]["options"] == "-c timezone=utc -c statement_timeout=20000"
+
+
+def test_engine_options_connection_budget():
+    """
+    GIVEN a dyno allowed 20 database connections and 4 threaded workers with 8 threads each
+    WHEN the engine options are derived
+    THEN check that all the workers' pools together fit in the budget
+    """
+    env = {"WEB_CONCURRENCY": "4", "GUNICORN_THREADS": "8", "DATABASE_MAX_CONNECTIONS": "20"}
+    options = engine_options(POSTGRES, env)
+    assert options["pool_size"] == 5
+    assert options["max_overflow"] == 0
+    assert 4 * (options["pool_size"] + options["max_overflow"]) <= 20
+
+
+@pytest.mark.parametrize(
+    "url, connect_args",
+    [
+        ("postgres://localhost/personal_website", {"options": "-c timezone=utc"}),
+        ("mysql://localhost/personal_website", None),
+    ],
+)
+def test_engine_options_follow_dialect(url, connect_args):
+    """
+    GIVEN a database URL that isn't SQLite
+    WHEN the engine options are derived without a statement timeout
+    THEN check that the pool is sized and only Postgres gets its connect_args
+    """
+    options = engine_options(url, {})
+    assert options["pool_size"] == 4
+    assert options.get("connect_args") == connect_args
+
+
+def test_engine_options_sqlite():
+    """
+    GIVEN a SQLite database URL
+    WHEN the app is created without any engine options
+    THEN check that none are set, so SQLite's own pool is used
+    """
+    assert engine_options("sqlite://", {}) == {}
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SCHEMA_CHECK": False})
+    assert app.config["SQLALCHEMY_ENGINE_OPTIONS"] == {}
+
+
+def test_statement_timeout_only_for_web(monkeypatch):
+    """
+    GIVEN a Postgres database URL
+    WHEN the app is created for the web, and for a 'flask' command
+    THEN check that only the web app has a statement timeout
+    """
+    config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": POSTGRES, "SCHEMA_CHECK": False}
+    monkeypatch.delenv("FLASK_RUN_FROM_CLI", raising=False)
+    web = create_app(config)
+    assert "statement_timeout=20000" in web.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"]["options"]
+
+    monkeypatch.setenv("FLASK_RUN_FROM_CLI", "true")
+    cli = create_app(config)
+    assert cli.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] == {"options": "-c timezone=utc"}
@@ -0,0 +1,154 @@
+import pytest
+import os
+from PIL import Image
+from application.images import encode_variants, picture, supported_formats
+from application.database import ImageVariants
+
+"""Tests for the upload-time image pipeline."""
+
+
+@pytest.fixture
+def photo(tmp_path):
+    """
+    A 2000x1000 JPEG with EXIF data (camera make and GPS info).
+    """
+    path = tmp_path / "photo.jpg"
+    img = Image.new("RGB", (2000, 1000), (200, 30, 30))
+    exif = Image.Exif()
+    exif[0x010F] = "Nelly's Camera"
+    exif[0x8825] = {1: "N", 2: (38.0, 58.0, 0.0)}
+    img.save(path, format="JPEG", exif=exif)
+    return str(path)
+
+
+def test_encode_variants_widths_and_formats(photo):
+    """
+    GIVEN an uploaded photo
+    WHEN its variants are encoded
+    THEN check that every width and format is written next to it at the right size
+    """
+    variants = encode_variants(photo, [480, 960, 1600], ["webp", "avif"])
+    formats = supported_formats(["webp", "avif"]) + ["jpeg"]
+    assert "webp" in formats
+    assert {(w, f) for w, h, f, p in variants} == {
+        (w, f) for w in (480, 960, 1600) for f in formats
+    }
+    for width, height, fmt, path in variants:
+        assert os.path.dirname(path) == os.path.dirname(photo)
+        assert path.endswith(f"-{width}w.{'jpg' if fmt == 'jpeg' else fmt}")
+        with Image.open(path) as img:
+            assert img.size == (width, height)
+            assert height == width // 2
+
+
+def test_encode_variants_never_upscales(tmp_path):
+    """
+    GIVEN a photo narrower than the biggest variant width
+    WHEN its variants are encoded
+    THEN check that the widest variant is the photo's own width
+    """
+    path = str(tmp_path / "small.png")
+    Image.new("RGBA", (700, 300)).save(path)
+    variants = encode_variants(path, [480, 960, 1600], [])
+    assert [(w, f) for w, h, f, p in variants] == [(480, "png"), (700, "png")]
+
+
+def test_encode_variants_strips_exif(photo):
+    """
+    GIVEN a photo with EXIF data
+    WHEN its variants are encoded
+    THEN check that neither the variants nor the original keep the EXIF data
+    """
+    with Image.open(photo) as img:
+        assert img.getexif()
+    variants = encode_variants(photo, [480], ["webp"])
+    for path in [photo] + [p for w, h, f, p in variants]:
+        with Image.open(path) as img:
+            assert not img.getexif()
+            assert "exif" not in img.info
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG"])
+def test_original_not_reencoded(tmp_path, fmt):
+    """
+    GIVEN a rotated photo with EXIF data
+    WHEN its variants are encoded
+    THEN check that the original only loses its metadata: same pixels, smaller file, orientation kept
+    """
+    path = str(tmp_path / f"photo.{fmt.lower()}")
+    exif = Image.Exif()
+    exif[0x010F] = "Nelly's Camera"
+    exif[0x0112] = 6
+    Image.effect_noise((300, 200), 60).convert("RGB").save(path, format=fmt, exif=exif)
+    with Image.open(path) as img:
+        pixels = img.tobytes()
+    size = os.path.getsize(path)
+
+    encode_variants(path, [120], [])
+    with Image.open(path) as img:
+        assert img.tobytes() == pixels
+        assert dict(img.getexif()) == {0x0112: 6}
+    assert os.path.getsize(path) < size
+
+
+def test_original_without_metadata_unchanged(tmp_path):
+    """
+    GIVEN a photo without any metadata
+    WHEN its variants are encoded
+    THEN check that the original file isn't rewritten
+    """
+    path = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (300, 200), (1, 2, 3)).save(path, quality=60)
+    with open(path, "rb") as f:
+        data = f.read()
+    encode_variants(path, [120], [])
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_encode_variants_skips_animations(tmp_path):
+    """
+    GIVEN an animated gif
+    WHEN its variants are encoded
+    THEN check that it is left alone
+    """
+    path = str(tmp_path / "anim.gif")
+    frames = [Image.new("P", (800, 800), i) for i in range(3)]
+    frames[0].save(path, save_all=True, append_images=frames[1:])
+    assert encode_variants(path, [480], ["webp"]) == []
+    assert os.listdir(tmp_path) == ["anim.gif"]
+
+
+def test_picture_markup():
+    """
+    GIVEN the variants of an image
+    WHEN its <picture> markup is made
+    THEN check that there's a source per modern format and a lazy fallback img with a srcset
+    """
+    variants = [
+        ImageVariants(1, 1, "static/a.jpg", w, w // 2, f, f"static/a-{w}w.{f}")
+        for w in (480, 960) for f in ("webp", "jpeg")
+    ]
+    html = picture("static/a.jpg", variants, alt="A photo", sizes="100vw")
+    assert html.startswith("<picture>")
+    assert '<source type="image/webp" srcset="/static/a-480w.webp 480w, /static/a-960w.webp 960w" sizes="100vw">' in html
+    assert 'srcset="/static/a-480w.jpeg 480w, /static/a-960w.jpeg 960w"' in html
+    assert '<img src="/static/a.jpg" alt="A photo" loading="lazy"' in html
+    assert "avif" not in html
+
+    assert picture("static/a.jpg", [], sizes="100vw") == '<img src="/static/a.jpg" alt="" loading="lazy">'
+
+
+def test_picture_urls_encoded():
+    """
+    GIVEN the variants of an image with spaces and a quote in its name
+    WHEN its <picture> markup is made
+    THEN check that the URLs are percent-encoded, so the srcset candidates stay whole
+    """
+    variants = [
+        ImageVariants(1, 1, "static/post_imgs/3/Denver's Map.png", w, w, f, f"static/post_imgs/3/Denver's Map-{w}w.{f}")
+        for w in (480, 960) for f in ("webp", "png")
+    ]
+    html = picture("static/post_imgs/3/Denver's Map.png", variants, sizes="100vw")
+    assert 'srcset="/static/post_imgs/3/Denver%27s%20Map-480w.webp 480w, /static/post_imgs/3/Denver%27s%20Map-960w.webp 960w"' in html
+    assert '<img src="/static/post_imgs/3/Denver%27s%20Map.png"' in html
@@ -0,0 +1,244 @@
+import pytest
+import smtplib
+import socket
+from flask import Flask
+from flask_mail import Mail, Message
+from application.mail_delivery import DeliveryEngine
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+"""Tests for the batched SMTP delivery engine, against a local SMTP server."""
+
+
+class RecordingHandler(object):
+    """
+    aiosmtpd handler that keeps every message it gets and counts connections.
+    Mail to anyone @refused.com is rejected.
+    """
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith("@refused.com"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+@pytest.fixture
+def mail_app(smtp_server):
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER=smtp_server.hostname,
+        MAIL_PORT=smtp_server.port,
+        MAIL_USE_SSL=False,
+        MAIL_USE_TLS=False,
+        MAIL_DEFAULT_SENDER="kelly@example.com",
+    )
+    mail = Mail(app)
+    with app.app_context():
+        yield app, mail
+
+
+def messages(*recipients):
+    return [
+        Message("Subject", sender="kelly@example.com", recipients=[r], body="Hello")
+        for r in recipients
+    ]
+
+
+def test_batches_share_connections(mail_app, smtp_server):
+    """
+    GIVEN a DeliveryEngine and a local SMTP server
+    WHEN more messages are sent than fit on one connection
+    THEN check that every message is delivered over one connection per batch
+    """
+    app, mail = mail_app
+    engine = DeliveryEngine(mail, max_per_connection=3)
+    recipients = [f"sub{i}@example.com" for i in range(7)]
+
+    results = engine.send(messages(*recipients))
+
+    assert [r.sent for r in results] == [True] * 7
+    assert [r.message.recipients[0] for r in results] == recipients
+    assert engine.connections_opened == 3
+    assert smtp_server.handler.connections == 3
+    assert [m.rcpt_tos[0] for m in smtp_server.handler.messages] == recipients
+
+
+def test_refused_recipient_does_not_stop_batch(mail_app, smtp_server):
+    """
+    GIVEN a DeliveryEngine and a local SMTP server
+    WHEN one of the recipients is refused
+    THEN check that only that message fails and the rest go over the same connection
+    """
+    app, mail = mail_app
+    engine = DeliveryEngine(mail)
+    seen = []
+
+    results = engine.send(
+        messages("a@example.com", "nobody@refused.com", "b@example.com"),
+        on_result=seen.append,
+    )
+
+    assert [r.sent for r in results] == [True, False, True]
+    assert "No such user" in results[1].error
+    assert seen == results
+    assert smtp_server.handler.connections == 1
+    assert len(smtp_server.handler.messages) == 2
+
+
+def test_unreachable_server_fails_batch():
+    """
+    GIVEN a DeliveryEngine for an SMTP server that isn't running
+    WHEN messages are sent
+    THEN check that every message fails without raising
+    """
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=free_port(), MAIL_USE_SSL=False)
+    mail = Mail(app)
+    with app.app_context():
+        results = DeliveryEngine(mail).send(messages("a@example.com", "b@example.com"))
+    assert [r.sent for r in results] == [False, False]
+    assert all(r.error for r in results)
+
+
+class FlakyConnection(object):
+    """
+    Stand-in for a flask_mail Connection that drops after a number of messages.
+    """
+    def __init__(self, mail, drop_after):
+        self.mail = mail
+        self.drop_after = drop_after
+        self.sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.sent >= self.drop_after:
+            raise smtplib.SMTPServerDisconnected("already closed")
+
+    def send(self, message):
+        if self.sent >= self.drop_after:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent += 1
+        self.mail.outbox.append(message)
+
+
+class FlakyMail(object):
+    def __init__(self, drop_after):
+        self.drop_after = drop_after
+        self.outbox = []
+
+    def connect(self):
+        return FlakyConnection(self, self.drop_after)
+
+
+def test_reconnects_when_connection_drops():
+    """
+    GIVEN a DeliveryEngine whose connections drop after two messages
+    WHEN a batch of five messages is sent
+    THEN check that it reconnects and every message is sent once
+    """
+    mail = FlakyMail(drop_after=2)
+    engine = DeliveryEngine(mail, max_per_connection=5)
+    results = engine.send(messages(*[f"sub{i}@example.com" for i in range(5)]))
+    assert [r.sent for r in results] == [True] * 5
+    assert len(mail.outbox) == 5
+    assert engine.connections_opened == 3
+
+
+def test_gives_up_after_retries():
+    """
+    GIVEN a DeliveryEngine whose connections always drop
+    WHEN a message is sent
+    THEN check that it's retried 'retries' times and then reported as failed
+    """
+    mail = FlakyMail(drop_after=0)
+    engine = DeliveryEngine(mail, retries=2)
+    result = engine.send_one(messages("a@example.com")[0])
+    assert not result.sent
+    assert "unexpectedly closed" in result.error
+    assert engine.connections_opened == 3
+
+
+def test_per_minute_limit():
+    """
+    GIVEN a DeliveryEngine limited to two messages a minute
+    WHEN five messages are sent
+    THEN check that it waits for the window to pass before going over the limit
+    """
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    mail = FlakyMail(drop_after=100)
+    engine = DeliveryEngine(mail, max_per_minute=2, clock=lambda: now[0], sleep=sleep)
+    engine.send(messages(*[f"sub{i}@example.com" for i in range(5)]))
+    assert len(mail.outbox) == 5
+    assert sleeps == [60, 60]
+
+
+def test_results_reported_as_sent():
+    """
+    GIVEN a DeliveryEngine sending a batch over one connection
+    WHEN on_result is called for a message
+    THEN check that it's called before the next message is sent
+    """
+    mail = FlakyMail(drop_after=100)
+    engine = DeliveryEngine(mail, max_per_connection=5)
+    outbox_sizes = []
+    engine.send(
+        messages(*[f"sub{i}@example.com" for i in range(3)]),
+        on_result=lambda result: outbox_sizes.append(len(mail.outbox)),
+    )
+    assert outbox_sizes == [1, 2, 3]
+
+
+def test_per_minute_limit_across_sends():
+    """
+    GIVEN a DeliveryEngine limited to two messages a minute
+    WHEN it sends two batches of two messages, like a worker's loop
+    THEN check that the second batch waits for the first one's minute to pass
+    """
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    mail = FlakyMail(drop_after=100)
+    engine = DeliveryEngine(mail, max_per_minute=2, clock=lambda: now[0], sleep=sleep)
+    engine.send(messages("a@example.com", "b@example.com"))
+    engine.send(messages("c@example.com", "d@example.com"))
+    assert sleeps == [60]
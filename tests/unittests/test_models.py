@@ -22,6 +22,7 @@ def test_posts_model():
     assert post.sample == sample
     assert post.body == body
     assert post.category == category
+    assert post.updated is not None
 
 
 def test_body_images():
@@ -0,0 +1,100 @@
+import os
+import pytest
+from application import create_app
+from application.database import Posts, BodyImages, ImageVariants
+from application.rendering import render_body, render_post
+from flask import Markup
+
+"""Tests for pre-rendering post bodies."""
+
+
+@pytest.fixture
+def app_context():
+    app = create_app({'TESTING': True, 'SCHEMA_CHECK': False, 'IMAGE_SIZES': '80vw'})
+    with app.app_context():
+        yield
+
+
+def post_with_images(body, images=1, ready=True):
+    post = Posts("Title", "sample", None, None, body, "code")
+    post.id = 7
+    for n in range(images):
+        image = BodyImages(post.id, f"static/post_imgs/7/{n}.jpg")
+        image.id = n + 1
+        if ready:
+            image.status = "ready"
+            image.variants = [ImageVariants(7, image.id, image.img_path, 480, 320, "webp", f"static/post_imgs/7/{n}-480.webp")]
+        post.images.append(image)
+    return post
+
+
+def test_placeholders_replaced(app_context):
+    """
+    GIVEN a post body with image placeholders
+    WHEN it's rendered
+    THEN check that the placeholders are replaced with the images' markup and paths
+    """
+    post = post_with_images("<p>a</p>{imgs[0].picture}<p>{imgs[1].img_path}</p>", images=2)
+    body = render_body(post)
+    assert body.startswith('<p>a</p><picture><source type="image/webp" srcset="/static/post_imgs/7/0-480.webp 480w"')
+    assert body.endswith("<p>static/post_imgs/7/1.jpg</p>")
+
+
+def test_literal_braces_kept(app_context):
+    """
+    GIVEN a post body with code samples full of braces
+    WHEN it's rendered
+    THEN check that only the placeholders and doubled braces change
+    """
+    post = post_with_images("<pre>def f(): return {'a': 0} {{ jinja }} {imgs}</pre>{imgs[0].img_path}")
+    assert render_body(post) == "<pre>def f(): return {'a': 0} { jinja } {imgs}</pre>static/post_imgs/7/0.jpg"
+
+
+def test_legacy_body_renders_as_before(app_context):
+    """
+    GIVEN a real post body written for str.format, with its CSS braces doubled
+    WHEN it's rendered
+    THEN check that it's rendered exactly like the old Markup(body).format(imgs=imgs)
+    """
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "application", "templates", "test-posts", "test1.html")
+    with open(path) as f:
+        body = f.read().split("\n\n", 1)[1].replace("p {", "p {{").replace("}\n</style>", "}}\n</style>")
+    post = post_with_images(body, images=5)
+    post.images[2].img_path = "static/post_imgs/3/Denver's Racial Distribution.png"
+    rendered = render_body(post)
+    assert rendered == Markup(body).format(imgs=post.images)
+    assert "p {\n" in rendered and "Denver&#39;s Racial Distribution.png" in rendered
+
+
+def test_image_path_escaped(app_context):
+    """
+    GIVEN a post body image whose path has a quote in it
+    WHEN its path is rendered into an attribute
+    THEN check that the quote is escaped
+    """
+    post = post_with_images("<img src='../{imgs[0].img_path}'>")
+    post.images[0].img_path = "static/post_imgs/3/Denver's Racial Distribution.png"
+    assert render_body(post) == "<img src='../static/post_imgs/3/Denver&#39;s Racial Distribution.png'>"
+
+
+def test_missing_image_left_in(app_context):
+    """
+    GIVEN a post body with a placeholder for an image the post doesn't have
+    WHEN it's rendered
+    THEN check that the placeholder is left as it is instead of failing
+    """
+    post = post_with_images("<p>{imgs[3].picture}</p>")
+    assert render_body(post) == "<p>{imgs[3].picture}</p>"
+
+
+def test_render_post_reports_changes(app_context):
+    """
+    GIVEN a post
+    WHEN it's rendered twice
+    THEN check that only the first render reports a change
+    """
+    post = post_with_images("{imgs[0].picture}", ready=False)
+    assert render_post(post)
+    assert post.rendered_body == '<img src="/static/post_imgs/7/0.jpg" alt="" loading="lazy">'
+    assert post.rendered_header == ""
+    assert not render_post(post)
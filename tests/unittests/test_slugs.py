@@ -0,0 +1,35 @@
+import pytest
+from application.database import slugify
+
+"""Tests for turning post titles into slugs."""
+
+
+@pytest.mark.parametrize(
+    "title, slug",
+    [
+        ("Learning Pandas in a Week", "learning-pandas-in-a-week"),
+        ("  What's new? (Part 2)  ", "what-s-new-part-2"),
+        ("Crème brûlée & Flask", "creme-brulee-flask"),
+        ("2021", "post-2021"),
+        ("!!!", "post"),
+        ("", "post"),
+    ],
+)
+def test_slugify(title, slug):
+    """
+    GIVEN a post title
+    WHEN it's turned into a slug
+    THEN check that it's lowercase ascii separated by dashes, and never all digits
+    """
+    assert slugify(title) == slug
+
+
+def test_slugify_max_length():
+    """
+    GIVEN a very long post title
+    WHEN it's turned into a slug
+    THEN check that it's cut at a word boundary
+    """
+    slug = slugify("word " * 50)
+    assert len(slug) <= 80
+    assert slug.endswith("word")
@@ -0,0 +1,77 @@
+from application import create_app
+from application.metrics import TEMPLATE_PRECOMPILE
+from flask import render_template
+import os
+
+"""Tests the Jinja bytecode cache and template precompilation."""
+
+CONFIG = {
+    "TESTING": True,
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+    "SCHEMA_CHECK": False,
+}
+
+
+def test_bytecode_cache(tmp_path):
+    """
+    GIVEN an app with the bytecode cache on
+    WHEN a template is rendered, and then rendered by a new app
+    THEN check that its compiled code is saved and loaded by the new app instead of compiling it
+    """
+    app = create_app({**CONFIG, "TEMPLATE_CACHE_DIR": str(tmp_path)})
+    with app.test_request_context():
+        render_template("admin/login.html")
+    saved = os.listdir(tmp_path)
+    assert saved
+
+    again = create_app({**CONFIG, "TEMPLATE_CACHE_DIR": str(tmp_path)})
+    compiled = []
+    compile = again.jinja_env.compile
+
+    def counting_compile(*args, **kwargs):
+        compiled.append(args)
+        return compile(*args, **kwargs)
+
+    again.jinja_env.compile = counting_compile
+    with again.test_request_context():
+        render_template("admin/login.html")
+    assert compiled == []
+    assert os.listdir(tmp_path) == saved
+
+
+def test_bytecode_cache_off(tmp_path):
+    """
+    GIVEN an app with TEMPLATE_BYTECODE_CACHE off
+    WHEN it's created
+    THEN check that Jinja has no bytecode cache
+    """
+    app = create_app({**CONFIG, "TEMPLATE_BYTECODE_CACHE": False, "TEMPLATE_CACHE_DIR": str(tmp_path)})
+    assert app.jinja_env.bytecode_cache is None
+
+
+def test_precompile(tmp_path):
+    """
+    GIVEN an app with TEMPLATE_PRECOMPILE on
+    WHEN it's created
+    THEN check that every template is loaded and the time it took is reported
+    """
+    app = create_app({**CONFIG, "TEMPLATE_PRECOMPILE": True, "TEMPLATE_CACHE_DIR": str(tmp_path)})
+    names = app.jinja_env.list_templates()
+    assert "layout.html" in names and "emails/welcome.html" in names
+    assert app.extensions["templates"]["count"] == len(names)
+    assert app.extensions["templates"]["precompile_seconds"] > 0
+    assert TEMPLATE_PRECOMPILE._value.get() == app.extensions["templates"]["precompile_seconds"]
+    assert len(os.listdir(tmp_path)) == len(names)
+
+
+def test_compile_templates_command(tmp_path):
+    """
+    GIVEN an app with the bytecode cache on
+    WHEN 'flask compile-templates' is run
+    THEN check that every template is saved to the bytecode cache
+    """
+    app = create_app({**CONFIG, "TEMPLATE_CACHE_DIR": str(tmp_path)})
+    result = app.test_cli_runner().invoke(args=["compile-templates"])
+    assert result.exit_code == 0
+    assert f"Compiled {len(app.jinja_env.list_templates())} templates" in result.output
+    assert len(os.listdir(tmp_path)) == len(app.jinja_env.list_templates())
@@ -0,0 +1,11 @@
+"""Runs the mail worker that sends the queued emails (see application/mail_queue.py)"""
+
+from application import create_app
+from application.mail_queue import work
+
+# no statement timeout, a batch can take longer than a web request
+app = create_app({"DATABASE_STATEMENT_TIMEOUT": 0})
+
+if __name__ == "__main__":
+    with app.app_context():
+        work()